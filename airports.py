@@ -0,0 +1,281 @@
+"""
+Offline index of airports with an IATA code, used to check and fill in the airport codes suggested by the LLM.
+
+The bundled data/airports.tsv has one tab-separated record per airport, sorted by IATA code:
+    IATA  name  city  country  latitude  longitude
+Lookups by code are binary searches over the memory-mapped file, so nothing is loaded up front.
+To rebuild the file from the airportsdata airports.csv:
+    python airports.py path/to/airports.csv
+"""
+from math import asin, cos, radians, sin, sqrt
+import csv
+import mmap
+import os
+import re
+import sys
+import unicodedata
+
+AIRPORTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "airports.tsv")
+
+
+def normalize_name(name):
+    """
+    Normalize a place name for lookups: no accents, case or punctuation, and single spaces.
+    
+    :param name: str: Place name
+    :return: str: Normalized name
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", name.casefold()).split())
+
+
+def distance_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance between two points.
+    
+    :return: float: Distance in kilometers
+    """
+    latitude1, longitude1, latitude2, longitude2 = map(radians, (latitude1, longitude1, latitude2, longitude2))
+    a = sin((latitude2 - latitude1) / 2) ** 2 + cos(latitude1) * cos(latitude2) * sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * 6371 * asin(sqrt(a))
+
+
+def matches_destination(airport, place, airport_name=""):
+    """
+    Check that an airport fits a destination line, so a wrong code suggested by the LLM is not trusted.
+    It fits when a part of the place, e.g. "Barcelona" of "Barcelona, Spain", is in the airport's city or name,
+    or when the airport name of the line is in the airport's name.
+    
+    :param airport: Airport: Airport of the suggested code
+    :param place: str: Destination name, e.g. "Barcelona, Spain"
+    :param airport_name: str: Airport name of the destination line, if any
+    :return: bool: Whether the airport fits the destination
+    """
+    words = set(normalize_name(f"{airport.city} {airport.name}").split())
+    names = place.split(',') + [re.sub(r'\b(international|airport)\b', '', airport_name, flags=re.IGNORECASE)]
+    return any(set(name.split()) <= words for name in map(normalize_name, names) if name)
+
+
+class Airport:
+    """
+    A class to represent an airport.
+    """
+    
+    __slots__ = ("code", "name", "city", "country", "latitude", "longitude")
+
+    def __init__(self, code, name, city, country, latitude, longitude):
+        """
+        Initialize the Airport object with the necessary details.
+        
+        :param code: str: IATA code
+        :param name: str: Airport name
+        :param city: str: City served by the airport
+        :param country: str: ISO country code
+        :param latitude: float: Latitude in degrees
+        :param longitude: float: Longitude in degrees
+        """
+        self.code = code
+        self.name = name
+        self.city = city
+        self.country = country
+        self.latitude = latitude
+        self.longitude = longitude
+
+    @classmethod
+    def from_record(cls, record):
+        code, name, city, country, latitude, longitude = record.decode('utf-8').rstrip('\n').split('\t')
+        return cls(code, name, city, country, float(latitude), float(longitude))
+
+    def __repr__(self):
+        return f"Airport {self.code} ({self.name}, {self.city}, {self.country})"
+
+
+class AirportIndex:
+    """
+    A class to look up airports by IATA code, airport name or city from the bundled airport file.
+    """
+    
+    def __init__(self, path=AIRPORTS_PATH):
+        """
+        Initialize the AirportIndex. The file is only opened on the first lookup.
+        
+        :param path: str: Path of the airport file
+        """
+        self.path = path
+        self.data = None
+        self.start = 0
+        self.names = None
+        self.cities = None
+
+    def open(self):
+        """
+        Memory-map the airport file and skip its comment header.
+        """
+        if self.data is not None:
+            return
+        with open(self.path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        while self.data[self.start:self.start + 1] == b'#':
+            self.start = self.data.find(b'\n', self.start) + 1
+
+    def get(self, code):
+        """
+        Look up an airport by IATA code.
+        
+        :param code: str: IATA code
+        :return: Airport: The airport or None if the code is unknown
+        """
+        if not code:
+            return None
+        self.open()
+        target = code.strip().upper().encode('ascii', 'ignore')
+        if len(target) != 3:
+            return None
+        low, high = self.start, len(self.data)
+        while low < high:
+            middle = (low + high) // 2
+            line_start = max(self.data.rfind(b'\n', self.start, middle) + 1, self.start)
+            line_end = self.data.find(b'\n', line_start)
+            line_end = len(self.data) if line_end == -1 else line_end
+            found = self.data[line_start:line_start + 3]
+            if found == target:
+                return Airport.from_record(self.data[line_start:line_end])
+            if found < target:
+                low = line_end + 1
+            else:
+                high = line_start
+        return None
+
+    def records(self):
+        """
+        Iterate over every record of the airport file.
+        
+        :return: iterator: (offset, Airport) pairs
+        """
+        self.open()
+        offset = self.start
+        while offset < len(self.data):
+            line_end = self.data.find(b'\n', offset)
+            line_end = len(self.data) if line_end == -1 else line_end
+            if line_end > offset:
+                yield offset, Airport.from_record(self.data[offset:line_end])
+            offset = line_end + 1
+
+    def load_names(self):
+        """
+        Build the airport name and city lookups on first use. They map normalized names to IATA codes.
+        """
+        if self.names is not None:
+            return
+        names, cities = {}, {}
+        for _, airport in self.records():
+            names.setdefault(normalize_name(airport.name), airport.code)
+            cities.setdefault(normalize_name(airport.city), []).append(airport.code)
+        self.names, self.cities = names, cities
+
+    def find_by_name(self, name):
+        """
+        Look up an airport by its name, with or without the words "airport" and "international".
+        Falls back to the shortest airport name that contains every word of the given name.
+        
+        :param name: str: Airport name
+        :return: Airport: The airport or None if no airport has that name
+        """
+        self.load_names()
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+        for candidate in (normalized, f"{normalized} airport", f"{normalized} international airport"):
+            if candidate in self.names:
+                return self.get(self.names[candidate])
+        words = set(normalized.split())
+        matches = [candidate for candidate in self.names if words.issubset(candidate.split())]
+        if matches:
+            return self.get(self.names[min(matches, key=len)])
+        return None
+
+    def find_city(self, city):
+        """
+        Find the airport serving a city. When a city has several airports, international airports are
+        preferred and among them the one nearest to the middle of the city's airports.
+        
+        :param city: str: City name
+        :return: Airport: The airport or None if no airport serves that city
+        """
+        self.load_names()
+        normalized = normalize_name(city)
+        codes = self.cities.get(normalized) if normalized else None
+        if not codes:
+            return None
+        airports = [self.get(code) for code in codes]
+        if len(airports) == 1:
+            return airports[0]
+        international = [airport for airport in airports if "international" in airport.name.lower()] or airports
+        latitude = sum(airport.latitude for airport in airports) / len(airports)
+        longitude = sum(airport.longitude for airport in airports) / len(airports)
+        return min(international, key=lambda airport: distance_km(latitude, longitude, airport.latitude, airport.longitude))
+
+    def resolve(self, destination, code=None):
+        """
+        Resolve the airport of an LLM destination line in the format 'Destination Name - Nearest Airport Name (IATA Code)'.
+        A known code is kept when its airport matches the destination line, otherwise the airport is looked up
+        by airport name and then by destination name.
+        
+        :param destination: str: Destination line
+        :param code: str: IATA code suggested for the destination, if any
+        :return: Airport: The airport or None if it cannot be resolved
+        """
+        text = re.sub(r'\(.*?\)', '', destination).strip()
+        place, _, airport_name = text.partition(' - ')
+        airport = self.get(code)
+        if airport and matches_destination(airport, place, airport_name):
+            return airport
+
+        if airport_name.strip():
+            airport = self.find_by_name(airport_name)
+            if airport:
+                return airport
+        for name in (place, place.split(',')[0]):
+            if name.strip():
+                airport = self.find_city(name) or self.find_by_name(name)
+                if airport:
+                    return airport
+        return None
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+
+def build_airport_file(source_path, target_path=AIRPORTS_PATH):
+    """
+    Build the compact airport file from the airportsdata airports.csv, keeping airports with an IATA code.
+    
+    :param source_path: str: Path of the airportsdata airports.csv
+    :param target_path: str: Path of the airport file to write
+    :return: int: Number of airports written
+    """
+    skipped_words = ("heliport", "air base", "air force", "seaplane", "military")
+    airports = {}
+    with open(source_path, encoding='utf-8', newline='') as file:
+        for row in csv.DictReader(file):
+            code = row['iata'].strip().upper()
+            if len(code) != 3 or not code.isalpha() or any(word in row['name'].lower() for word in skipped_words):
+                continue
+            fields = [row['name'], row['city'], row['country']]
+            fields = [" ".join(field.replace('\t', ' ').split()) for field in fields]
+            airports[code] = [code] + fields + [f"{float(row['lat']):.4f}", f"{float(row['lon']):.4f}"]
+
+    with open(target_path, 'w', encoding='utf-8', newline='\n') as file:
+        file.write("# Airports with an IATA code: IATA, name, city, country, latitude, longitude. Sorted by IATA code.\n")
+        file.write("# Generated by airports.py from airportsdata (MIT License, Copyright (c) 2020- Mike Borsetti),\n")
+        file.write("# which includes data from https://github.com/mwgg/Airports (MIT License).\n")
+        for code in sorted(airports):
+            file.write("\t".join(airports[code]) + "\n")
+    return len(airports)
+
+
+if __name__ == "__main__":
+    print(f"Wrote {build_airport_file(sys.argv[1])} airports to {AIRPORTS_PATH}")
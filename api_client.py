@@ -1,57 +1,139 @@
-import requests
-from models import Flight, Hotel
+from airports import AirportIndex
+from flight_search import FlightTable, date_window
+from http_pool import HTTPPool
+from metrics import Metrics, timed
+from models import Destination, Flight, Hotel, HotelIndex
+from structured_output import DESTINATIONS_TOOL, force_tool, tool_arguments
+from upstream import Upstream, UpstreamError
+import asyncio
+import httpx
+import orjson
 import re
 
+DEFAULT_ORIGIN = "TLV"  # Assuming departure from Tel Aviv (Ben Gurion Airport)
+
 class APIClient:
     """
     A class to interact with the OpenAI and SerpAPI to fetch travel suggestions, flight details, and hotel details.
     """
     
-    def __init__(self, openai_api_key, serpapi_key):
+    def __init__(self, openai_api_key, serpapi_key, openai_url="https://api.openai.com", serpapi_url="https://serpapi.com", request_timeout=30, pool=None, cache=None,
+                 budget_independent_hotels=False, suggestion_cache=None, airport_index=None,
+                 max_flight_searches=10, openai_upstream=None, serpapi_upstream=None, metrics=None):
         """
         Initialize the APIClient with OpenAI and SerpAPI keys.
         
         :param openai_api_key: str: API key for OpenAI
         :param serpapi_key: str: API key for SerpAPI
+        :param openai_url: str: Base URL of the OpenAI API
+        :param serpapi_url: str: Base URL of SerpAPI
+        :param request_timeout: float: Timeout in seconds for a single upstream request
+        :param pool: HTTPPool: Shared connection pool, a private one is created if not given
+        :param cache: ResponseCache: Cache for SerpAPI search responses, or None to always go upstream
+        :param budget_independent_hotels: bool: Search hotels without a price limit and pick within budget locally
+        :param suggestion_cache: ResponseCache: Cache for destination suggestions per vacation type and month
+        :param airport_index: AirportIndex: Index used to check and fill in airport codes, the bundled one if not given
+        :param max_flight_searches: int: Maximum number of flexible flight searches running at once
+        :param openai_upstream: Upstream: Rate limits, retries and circuit breaker for OpenAI, default ones if not given
+        :param serpapi_upstream: Upstream: Rate limits, retries and circuit breaker for SerpAPI, default ones if not given
+        :param metrics: Metrics: Registry the stage latencies and errors are recorded in, a private one if not given
         """
         self.openai_api_key = openai_api_key
         self.serpapi_key = serpapi_key
-        self.google_flights_base_url = "https://serpapi.com/search?engine=google_flights"
-        self.google_hotels_base_url = "https://serpapi.com/search?engine=google_hotels"
+        self.openai_url = openai_url.rstrip('/')
+        self.request_timeout = request_timeout
+        self.serpapi_url = serpapi_url.rstrip('/')
+        self.pool = pool or HTTPPool(timeout=request_timeout)
+        self.metrics = metrics or Metrics()
+        self.openai = openai_upstream or Upstream("openai", self.openai_url, self.pool, metrics=self.metrics)
+        self.serpapi = serpapi_upstream or Upstream("serpapi", self.serpapi_url, self.pool, metrics=self.metrics)
+        self.cache = cache
+        self.budget_independent_hotels = budget_independent_hotels
+        self.suggestion_cache = suggestion_cache
+        self.airport_index = airport_index or AirportIndex()
+        self.flight_search_semaphore = asyncio.Semaphore(max_flight_searches)
 
-    def suggest_destinations(self, vacation_type, month):
+    @timed("suggest_destinations")
+    async def suggest_destinations(self, vacation_type, month):
         """
-        Suggest travel destinations based on vacation type and month.
+        Suggest travel destinations based on vacation type and month, answering from the suggestion cache when one is configured.
         
         :param vacation_type: str: Type of vacation (e.g., beach, adventure)
         :param month: str: Month for travel
-        :return: list: List of destination suggestions
+        :return: list: Destination objects
+        """
+        if self.suggestion_cache is None:
+            suggestions = await self.fetch_destination_suggestions(vacation_type, month)
+        else:
+            suggestions = await self.suggestion_cache.get_or_fetch(
+                "suggested_destinations",
+                {"vacation_type": vacation_type, "month": month},
+                lambda: self.fetch_destination_suggestions(vacation_type, month)
+            )
+        return [Destination(**suggestion) for suggestion in suggestions]
+
+    async def warm_suggestions(self, vacation_types, months):
+        """
+        Fill the suggestion cache ahead of time for every combination of vacation type and month.
+        
+        :param vacation_types: list: Vacation types to warm up
+        :param months: list: Month names to warm up
+        :return: dict: Number of combinations warmed up and the failed ones
+        """
+        pairs = [(vacation_type, month) for vacation_type in vacation_types for month in months]
+        results = await asyncio.gather(
+            *(self.suggest_destinations(vacation_type, month) for vacation_type, month in pairs),
+            return_exceptions=True
+        )
+        failed = [f"{vacation_type}/{month}: {result}" for (vacation_type, month), result in zip(pairs, results) if isinstance(result, Exception)]
+        return {"warmed": len(pairs) - len(failed), "failed": failed}
+
+    async def fetch_destination_suggestions(self, vacation_type, month):
+        """
+        Ask the OpenAI API for travel destinations based on vacation type and month, as a validated function call.
+        
+        :param vacation_type: str: Type of vacation (e.g., beach, adventure)
+        :param month: str: Month for travel
+        :return: list: Validated destinations as dictionaries with name, airport and iata_code, ready to be cached
         """
         headers = {
             'Authorization': f'Bearer {self.openai_api_key}',
             'Content-Type': 'application/json'
         }
         
-        data = {
+        data = force_tool({
             "model": "gpt-4",
             "messages": [
                 {
                     "role": "system",
-                    "content": f"Suggest five travel destinations suitable for a {vacation_type} vacation in {month}. For each destination, provide the name of the destination, the name of the nearest airport, and the airport's IATA code in parentheses in the following format: 'Destination Name - Nearest Airport Name (IATA Code)'. Output only the requested format."
+                    "content": f"Suggest five travel destinations suitable for a {vacation_type} vacation in {month}. For each destination, give the city and country, the name of the nearest airport and the airport's IATA code."
                 }
             ],
             "temperature": 0.5,
-            "max_tokens": 150
-        }
+            "max_tokens": 300
+        }, DESTINATIONS_TOOL)
         
         try:
-            response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
+            response = await self.openai.post('/v1/chat/completions', headers=headers, json=data, timeout=self.request_timeout)
             response.raise_for_status()
-            suggestions = response.json()['choices'][0]['message']['content'].strip().split('\n')
-            return [destination.strip() for destination in suggestions if destination.strip()]
-        except requests.RequestException as e:
+            arguments = tool_arguments(orjson.loads(response.content))
+        except httpx.HTTPError as e:
             print("API Error:", str(e))
-            raise Exception("Failed to fetch data from the OpenAI API.")
+            raise UpstreamError("Failed to fetch data from the OpenAI API.") from e
+        except ValueError as e:
+            raise UpstreamError(f"Invalid destination suggestions from the OpenAI API: {e}") from e
+
+        destinations = []
+        for suggestion in arguments.get('destinations') or []:
+            try:
+                destination = Destination.from_dict(suggestion)
+            except ValueError as e:
+                print(f"Skipped invalid destination suggestion: {e}")
+                continue
+            destinations.append({"name": destination.name, "airport": destination.airport, "iata_code": destination.iata_code})
+        if not destinations:
+            raise UpstreamError("The OpenAI API suggested no valid destinations.")
+        return destinations
 
     def extract_iata_code(self, destination):
         """
@@ -63,7 +145,63 @@ class APIClient:
         match = re.search(r'\((.*?)\)', destination)
         return match.group(1) if match else None
 
-    def fetch_flights(self, to_city, date_out, date_return):
+    def resolve_iata_code(self, destination):
+        """
+        Find a valid IATA code for a destination. The suggested code is checked against the airport index and,
+        when it is missing or unknown, looked up from the airport and destination names.
+        
+        :param destination: Destination or str: Suggested destination, or a destination string usually containing the IATA code
+        :return: str: Valid IATA code or None if the destination cannot be resolved
+        """
+        if isinstance(destination, Destination):
+            airport = self.airport_index.resolve(str(destination), destination.iata_code)
+        else:
+            airport = self.airport_index.resolve(destination, self.extract_iata_code(destination))
+        return airport.code if airport else None
+
+    async def search(self, params, transform=None, namespace=None):
+        """
+        Run a SerpAPI search, answering it from the response cache when one is configured.
+        
+        :param params: dict: SerpAPI request parameters, including the engine
+        :param transform: callable: Function applied to the raw results before they are cached
+        :param namespace: str: Cache namespace, defaults to the engine
+        :return: dict: Raw search results, or the transformed results if transform is given
+        """
+        async def fetch():
+            # Searches are idempotent, so a slow one may be hedged with a second copy
+            response = await self.serpapi.get('/search', params=params, timeout=self.request_timeout, hedge=True)
+            response.raise_for_status()
+            results = orjson.loads(response.content)
+            return transform(results) if transform else results
+
+        if self.cache is None:
+            return await fetch()
+        return await self.cache.get_or_fetch(namespace or params["engine"], params, fetch)
+
+    def flight_search_params(self, departure_code, arrival_code, date_out, date_return):
+        """
+        Build the Google Flights search parameters for a round trip.
+        
+        :param departure_code: str: IATA code of the origin airport
+        :param arrival_code: str: IATA code of the destination airport
+        :param date_out: str: Outbound date in YYYY-MM-DD format
+        :param date_return: str: Return date in YYYY-MM-DD format
+        :return: dict: SerpAPI request parameters
+        """
+        return {
+            "engine": "google_flights",
+            "departure_id": departure_code,
+            "arrival_id": arrival_code,
+            "outbound_date": date_out,
+            "return_date": date_return,
+            "currency": "USD",
+            "hl": "en",
+            "api_key": self.serpapi_key
+        }
+
+    @timed("fetch_flights")
+    async def fetch_flights(self, to_city, date_out, date_return):
         """
         Fetch flight details from the Google Flights API via SerpAPI.
         
@@ -72,60 +210,203 @@ class APIClient:
         :param date_return: str: Return date in YYYY-MM-DD format
         :return: Flight: Flight object containing flight details
         """
-        departure_code = "TLV"  # Assuming departure from Tel Aviv (Ben Gurion Airport)
-        arrival_code = self.extract_iata_code(to_city)
+        arrival_code = self.resolve_iata_code(to_city)
 
         if not arrival_code:
-            raise Exception(f"Missing airport code for the destination city: {to_city}")
+            raise Exception(f"Unknown airport code for the destination city: {to_city}")
 
-        params = {
+        params = self.flight_search_params(DEFAULT_ORIGIN, arrival_code, date_out, date_return)
+
+        try:
+            results = await self.search(params, transform=self.slim_flight_data)
+            return self.parse_flight_data(results)
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Failed to fetch flight details: {e}") from e
+
+    def one_way_search_params(self, departure_code, arrival_code, date_out):
+        """
+        Build the Google Flights search parameters for a one-way flight.
+        
+        :param departure_code: str: IATA code of the origin airport
+        :param arrival_code: str: IATA code of the destination airport
+        :param date_out: str: Departure date in YYYY-MM-DD format
+        :return: dict: SerpAPI request parameters
+        """
+        return {
             "engine": "google_flights",
+            "type": "2",
             "departure_id": departure_code,
             "arrival_id": arrival_code,
             "outbound_date": date_out,
-            "return_date": date_return,
             "currency": "USD",
             "hl": "en",
             "api_key": self.serpapi_key
         }
 
+    @timed("fetch_one_way_flight")
+    async def fetch_one_way_flight(self, departure_code, arrival_code, date_out):
+        """
+        Fetch the cheapest one-way flight between two airports, at most max_flight_searches at a time.
+        
+        :param departure_code: str: IATA code of the origin airport
+        :param arrival_code: str: IATA code of the destination airport
+        :param date_out: str: Departure date in YYYY-MM-DD format
+        :return: Flight: Cheapest flight, with its origin and date set, or None if there is none
+        """
+        params = self.one_way_search_params(departure_code, arrival_code, date_out)
         try:
-            response = requests.get(self.google_flights_base_url, params=params)
-            response.raise_for_status()
-            results = response.json()
-            return self.parse_flight_data(results)
-        except requests.RequestException as e:
-            raise Exception(f"Failed to fetch flight details: {e}")
+            async with self.flight_search_semaphore:
+                results = await self.search(params, transform=self.slim_flight_data)
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Failed to fetch flight details: {e}") from e
+        itineraries = [itinerary for itinerary in results.get("best_flights", []) + results.get("other_flights", [])
+                       if itinerary.get('flights') and isinstance(itinerary.get('price'), (int, float))]
+        if not itineraries:
+            return None
+        return Flight.from_itinerary(min(itineraries, key=lambda itinerary: itinerary['price']),
+                                     origin=departure_code, outbound_date=date_out)
 
-    def fetch_hotel(self, destination, date_checkin, date_checkout, budget):
+    @timed("search_flight_combinations")
+    async def search_flight_combinations(self, arrival_codes, origins, start_date, end_date, flexible_days=0):
         """
-        Fetch hotel details from the Google Hotels API via SerpAPI.
+        Search round trips for every origin, destination and date pair within flexible_days of the requested dates.
+        The searches run concurrently, at most max_flight_searches at a time, and failed searches are skipped.
+        
+        :param arrival_codes: list: IATA codes of the destination airports
+        :param origins: list: IATA codes of the origin airports
+        :param start_date: str: Requested outbound date in YYYY-MM-DD format
+        :param end_date: str: Requested return date in YYYY-MM-DD format
+        :param flexible_days: int: Number of days the dates may move in either direction
+        :return: FlightTable: Every itinerary found, column by column
+        """
+        queries = [
+            (origin, arrival_code, date_out, date_return)
+            for origin in origins
+            for arrival_code in arrival_codes
+            for date_out in date_window(start_date, flexible_days)
+            for date_return in date_window(end_date, flexible_days)
+            if date_return > date_out
+        ]
+
+        async def run(query):
+            async with self.flight_search_semaphore:
+                return await self.search(self.flight_search_params(*query), transform=self.slim_flight_data)
+
+        results = await asyncio.gather(*(run(query) for query in queries), return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
+        if queries and len(failures) == len(queries):
+            raise UpstreamError(f"Failed to fetch flight details: {failures[0]}") from failures[0]
+        return FlightTable.from_results(
+            [query + (result,) for query, result in zip(queries, results) if not isinstance(result, Exception)]
+        )
+
+    def hotel_search_params(self, destination, date_checkin, date_checkout):
+        """
+        Build the Google Hotels search parameters for a destination and dates, without a price limit.
         
         :param destination: str: Destination city
         :param date_checkin: str: Check-in date in YYYY-MM-DD format
         :param date_checkout: str: Check-out date in YYYY-MM-DD format
-        :param budget: int: Maximum budget for the hotel
-        :return: Hotel: Hotel object containing hotel details
+        :return: dict: SerpAPI request parameters
         """
-        params = {
+        return {
             "engine": "google_hotels",
             "q": f"hotels in {destination} near main attractions and landmarks, offering amenities such as free Wi-Fi, breakfast, and airport shuttle services",
             "check_in_date": date_checkin,
             "check_out_date": date_checkout,
             "api_key": self.serpapi_key,
-            "max_price": int(budget),  # Ensure budget is an integer
         }
 
+    @timed("fetch_hotel_index")
+    async def fetch_hotel_index(self, destination, date_checkin, date_checkout):
+        """
+        Fetch every hotel for a destination and dates once, regardless of budget, as a price-sorted index.
+        The compact index is what gets cached, so any budget can be answered from it locally.
+        
+        :param destination: str: Destination city
+        :param date_checkin: str: Check-in date in YYYY-MM-DD format
+        :param date_checkout: str: Check-out date in YYYY-MM-DD format
+        :return: HotelIndex: Hotels sorted by price
+        """
+        params = self.hotel_search_params(destination, date_checkin, date_checkout)
         try:
-            response = requests.get(self.google_hotels_base_url, params=params)
-            response.raise_for_status()
-            hotel_data = response.json()
+            rows = await self.search(
+                params,
+                transform=lambda data: HotelIndex.from_properties(data.get("properties", [])).to_rows(),
+                namespace="google_hotels_index"
+            )
+            return HotelIndex.from_rows(rows)
+        except httpx.HTTPError as e:
+            print(f"Failed to fetch hotel details: {e}")
+            raise UpstreamError(f"Failed to fetch hotel details: {e}") from e
+
+    @timed("fetch_hotel")
+    async def fetch_hotel(self, destination, date_checkin, date_checkout, budget):
+        """
+        Fetch hotel details from the Google Hotels API via SerpAPI.
+        
+        :param destination: str: Destination city
+        :param date_checkin: str: Check-in date in YYYY-MM-DD format
+        :param date_checkout: str: Check-out date in YYYY-MM-DD format
+        :param budget: int: Maximum budget for the hotel
+        :return: Hotel: Hotel object containing hotel details
+        """
+        if self.budget_independent_hotels:
+            hotel_index = await self.fetch_hotel_index(destination, date_checkin, date_checkout)
+            closest_hotel = hotel_index.best_within(budget)
+            if not closest_hotel:
+                print("No hotels found within the given budget.")
+            return closest_hotel
+
+        params = self.hotel_search_params(destination, date_checkin, date_checkout)
+        params["max_price"] = int(budget)  # Ensure budget is an integer
+
+        try:
+            hotel_data = await self.search(params, transform=self.slim_hotel_data)
             closest_hotel = self.parse_hotel_data(hotel_data, budget)
             return closest_hotel
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             print(f"Failed to fetch hotel details: {e}")
-            raise Exception(f"Failed to fetch hotel details: {e}")
+            raise UpstreamError(f"Failed to fetch hotel details: {e}") from e
+
+    @staticmethod
+    def slim_flight_data(data):
+        """
+        Keep only the itinerary fields the planner reads from a Google Flights search, so large payloads
+        are not kept in the cache.
+        
+        :param data: dict: Raw flight data from the API
+        :return: dict: best_flights and other_flights with only the fields used by Flight and FlightTable
+        """
+        segment_fields = ('departure_airport', 'arrival_airport', 'duration', 'airplane', 'airline', 'travel_class', 'flight_number')
+        return {
+            group: [
+                {
+                    'price': itinerary.get('price'),
+                    'total_duration': itinerary.get('total_duration'),
+                    'flights': [{field: segment[field] for field in segment_fields if field in segment} for segment in itinerary.get('flights', [])]
+                }
+                for itinerary in data.get(group, [])
+            ]
+            for group in ('best_flights', 'other_flights')
+        }
 
+    @staticmethod
+    def slim_hotel_data(data):
+        """
+        Keep only the name and price of each property from a Google Hotels search.
+        
+        :param data: dict: Raw hotel data from the API
+        :return: dict: properties with only their name and total_rate
+        """
+        return {
+            'properties': [
+                {'name': hotel.get('name'), 'total_rate': {'extracted_lowest': hotel.get('total_rate', {}).get('extracted_lowest')}}
+                for hotel in data.get('properties', []) if 'name' in hotel
+            ]
+        }
+
+    @timed("parse_flight_data")
     def parse_flight_data(self, data):
         """
         Parse flight data received from the API.
@@ -138,35 +419,9 @@ class APIClient:
             return None
 
         cheapest_flight = min(best_flights, key=lambda x: x.get('price', float('inf')))
+        return Flight.from_itinerary(cheapest_flight)
 
-        flight_segments = cheapest_flight['flights']
-        first_segment = flight_segments[0]
-        last_segment = flight_segments[-1]
-
-        departure_airport = first_segment['departure_airport'].get('name', 'Unknown')
-        arrival_airport = last_segment['arrival_airport'].get('name', 'Unknown')
-        departure_time = first_segment['departure_airport'].get('time', 'Unknown')
-        arrival_time = last_segment['arrival_airport'].get('time', 'Unknown')
-        duration = sum(segment.get('duration', 0) for segment in flight_segments)
-        airplane = first_segment.get('airplane', 'Unknown')
-        airline = first_segment.get('airline', 'Unknown')
-        travel_class = first_segment.get('travel_class', 'Unknown')
-        flight_number = first_segment.get('flight_number', 'Unknown')
-        price = cheapest_flight.get('price', 'Unknown')
-
-        return Flight(
-            price=price,
-            airline=airline,
-            departure=departure_airport,
-            arrival=arrival_airport,
-            departure_time=departure_time,
-            arrival_time=arrival_time,
-            duration=duration,
-            airplane=airplane,
-            travel_class=travel_class,
-            flight_number=flight_number
-        )
-
+    @timed("parse_hotel_data")
     def parse_hotel_data(self, data, budget):
         """
         Parse hotel data received from the API.
@@ -175,15 +430,10 @@ class APIClient:
         :param budget: int: Maximum budget for the hotel
         :return: Hotel: Parsed Hotel object
         """
-        hotels = data.get("properties", [])
-        
-        affordable_hotels = [hotel for hotel in hotels if hotel.get('total_rate', {}).get('extracted_lowest', float('inf')) <= budget]
-        if not affordable_hotels:
+        hotel_index = HotelIndex.from_properties(data.get("properties", []))
+        closest_hotel = hotel_index.best_within(budget)
+        if not closest_hotel:
             print("No hotels found within the given budget.")
             return None
 
-        closest_hotel = max(affordable_hotels, key=lambda x: x['total_rate']['extracted_lowest'])
-
-        closest_hotel_obj = Hotel(price=closest_hotel['total_rate']['extracted_lowest'], name=closest_hotel['name'])
-
-        return closest_hotel_obj
+        return closest_hotel
@@ -0,0 +1,192 @@
+"""
+Load-test the FastAPI app of main.py in process, replaying recorded upstream responses.
+
+Record fixtures once (against the stub server, or against the real APIs with the keys set in main.py):
+    python -m benchmarks.record_fixtures --stub
+
+Then run the benchmark at several concurrency levels:
+    python -m benchmarks.bench_load --concurrency 1,4,16 --trips 48 --latency 0.3 --jitter 0.3 --error-rate 0.02
+"""
+from replay import ReplayTransport
+import argparse
+import asyncio
+import httpx
+import os
+import shutil
+import tempfile
+import time
+
+# The databases and image store of main.py go to a temporary directory, so the benchmark tools neither read
+# the caches of a local server nor leave files in the working directory. Set before main is imported.
+DATA_DIR = os.environ.setdefault("TRIP_PLANNER_DATA_DIR", tempfile.mkdtemp(prefix="trip-planner-bench-"))
+
+import main
+
+FIXTURES = "benchmarks/fixtures"
+
+# Trips of the workload, in the order the workers take them. The fixtures have to be recorded with the same list.
+WORKLOAD = [
+    {"vacation_type": vacation_type, "start_date": "2024-07-01", "end_date": "2024-07-05", "budget": 3000}
+    for vacation_type in ("beach", "ski", "city")
+]
+
+
+def percentile(values, q):
+    """
+    Compute a percentile by linear interpolation between the closest ranks.
+
+    :param values: list: Measured values
+    :param q: float: Percentile between 0 and 100
+    :return: float: Percentile, or 0.0 without values
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+async def choose_trip(client, plan_id, choice):
+    """
+    Choose a trip option and wait for its job to finish.
+
+    :param client: httpx.AsyncClient: Client bound to the app
+    :param plan_id: str: ID of the planning session
+    :param choice: int: Chosen trip option
+    :return: tuple: (True, chosen trip) if the job succeeded, otherwise (False, response body)
+    """
+    response = await client.post("/choose_trip", json={"plan_id": plan_id, "choice": choice})
+    if not response.is_success:
+        return False, response.json()
+    job = response.json()
+    while job["status"] in ("queued", "running"):
+        job = (await client.get(f"/jobs/{job['job_id']}", params={"wait": 30})).json()
+    return job["status"] == "done", job.get("result") or job
+
+
+async def run_trip(client, trip_request, choice, timings):
+    """
+    Plan a trip and choose one of its options, recording the latency of both calls.
+
+    :param client: httpx.AsyncClient: Client bound to the app
+    :param trip_request: dict: Body of /plan_trip
+    :param choice: int: Preferred option, wrapped around the number of options returned
+    :param timings: dict: Endpoint to a list of (seconds, success) pairs, filled in place
+    :return: dict: Chosen trip, or None if planning failed
+    """
+    started = time.perf_counter()
+    response = await client.post("/plan_trip", json=trip_request)
+    timings["/plan_trip"].append((time.perf_counter() - started, response.is_success))
+    if not response.is_success or not response.json()["trip_options"]:
+        return None
+
+    plan = response.json()
+    choice = (choice - 1) % len(plan["trip_options"]) + 1
+    started = time.perf_counter()
+    success, trip = await choose_trip(client, plan["plan_id"], choice)
+    timings["/choose_trip"].append((time.perf_counter() - started, success))
+    return trip if success else None
+
+
+async def run_level(client, concurrency, trips):
+    """
+    Run a number of trips with a fixed number of concurrent users.
+
+    :param client: httpx.AsyncClient: Client bound to the app
+    :param concurrency: int: Number of users sending requests at the same time
+    :param trips: int: Number of trips to plan and choose in total
+    :return: tuple: (timings per endpoint, wall time in seconds)
+    """
+    timings = {"/plan_trip": [], "/choose_trip": []}
+    queue = asyncio.Queue()
+    for number in range(trips):
+        queue.put_nowait(number)
+
+    async def user():
+        while not queue.empty():
+            number = queue.get_nowait()
+            await run_trip(client, WORKLOAD[number % len(WORKLOAD)], number // len(WORKLOAD) + 1, timings)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return timings, time.perf_counter() - started
+
+
+# Caches of the SerpAPI responses, destination suggestions, daily plans and images, and shared planning runs and jobs
+CACHES = ("response_cache", "suggestion_cache", "content_cache", "request_cache")
+
+
+def disable_caches():
+    """
+    Make every cache the app answers from keep nothing, so each trip runs the whole pipeline.
+    Concurrent identical calls still share one upstream call.
+    """
+    for name in CACHES:
+        cache = getattr(main, name)
+        cache.ttls = dict.fromkeys(cache.ttls, 0)
+        cache.default_ttl = 0
+
+
+def reset_caches():
+    """
+    Empty every cache and the speculatively prepared daily plans, so no level starts warm from the one before.
+    """
+    for name in CACHES:
+        getattr(main, name).memory.clear()
+    main.speculator.cancel_all()
+    main.speculator.results.clear()
+
+
+def report(concurrency, timings, elapsed):
+    for endpoint, samples in timings.items():
+        seconds = [duration for duration, success in samples if success]
+        errors = sum(1 for _, success in samples if not success)
+        print(f"{concurrency:>5} {endpoint:<13} {len(samples):>6} {errors:>6} {len(samples) / elapsed:>8.2f} "
+              f"{percentile(seconds, 50):>7.3f} {percentile(seconds, 95):>7.3f} {percentile(seconds, 99):>7.3f}")
+
+
+async def run(args):
+    # Keep the persistent caches out of the measurements, memory is cleared per level
+    for cache in (main.suggestion_cache, main.content_cache):
+        cache.close()
+        cache.disk = None
+    main.http_pool.transport = ReplayTransport(args.fixtures, args.latency, args.jitter, args.error_rate,
+                                               args.error_status or None, seed=args.seed)
+
+    if not args.keep_caches:
+        disable_caches()
+
+    print(f"{'users':>5} {'endpoint':<13} {'calls':>6} {'errors':>6} {'calls/s':>8} {'p50':>7} {'p95':>7} {'p99':>7}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None) as client:
+        for concurrency in args.concurrency:
+            if not args.keep_caches:
+                reset_caches()
+            timings, elapsed = await run_level(client, concurrency, args.trips)
+            report(concurrency, timings, elapsed)
+    await main.job_workers.stop()
+    await main.trip_planner.aclose()
+    main.job_queue.close()
+    main.bulk_checkpoints.close()
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES, help="directory of the recorded responses")
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 4, 16],
+                        help="comma-separated numbers of concurrent users")
+    parser.add_argument("--trips", type=int, default=30, help="trips planned and chosen per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.3, help="base upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.3, help="maximum extra random upstream latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="status of injected errors, 0 for connection errors")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the latency and error randomness")
+    parser.add_argument("--keep-caches", action="store_true", help="cache responses, daily plans, images and shared runs as in production, "
+                                                                     "and keep them warm between levels")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,61 @@
+"""
+Benchmark TripPlanner.plan_trip against a local stub of the upstream APIs.
+
+Run from the repository root:
+    python -m benchmarks.bench_plan_trip --latency 0.5 --jitter 0.5
+"""
+from benchmarks.stub_server import StubUpstreamServer
+from trip_planner import TripPlanner
+import argparse
+import asyncio
+import time
+
+
+async def plan_sequentially(planner, vacation_type, start_date, end_date, budget):
+    """
+    Price the destinations one after another, as plan_trip did before the concurrent fan-out.
+    """
+    month = time.strptime(start_date, "%Y-%m-%d")
+    destinations = await planner.client.suggest_destinations(vacation_type, time.strftime("%B", month))
+    trip_options = []
+    for destination in destinations:
+        try:
+            trip_options.append(await planner.price_destination(destination, start_date, end_date, budget))
+        except Exception as e:
+            print(f"Error planning trip to {destination}: {e}")
+    return planner.show_trip_options(trip_options)
+
+
+async def plan_concurrently(planner, vacation_type, start_date, end_date, budget):
+    return await planner.plan_trip(vacation_type, start_date, end_date, budget)
+
+
+async def run(args, planner):
+    for name, plan in (("sequential", plan_sequentially), ("concurrent", plan_concurrently)):
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            options = await plan(planner, "beach", "2024-07-01", "2024-07-08", 5000)
+            timings.append(time.perf_counter() - started)
+        print(f"{name:>10}: {len(options)} options, "
+              f"min {min(timings):.2f}s, mean {sum(timings) / len(timings):.2f}s, max {max(timings):.2f}s")
+    await planner.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.5, help="base upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="maximum extra random latency in seconds")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs per mode")
+    args = parser.parse_args()
+
+    server = StubUpstreamServer(latency=args.latency, jitter=args.jitter).start()
+    planner = TripPlanner("stub", "stub", openai_url=server.url, serpapi_url=server.url)
+    try:
+        asyncio.run(run(args, planner))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
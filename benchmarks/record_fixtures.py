@@ -0,0 +1,63 @@
+"""
+Record the upstream responses of the load benchmark workload to fixture files.
+
+With --stub the responses come from the local stub server; otherwise the real APIs are called with the keys
+set in main.py. Every trip option is chosen once through /choose_trip and once through /choose_trip/stream,
+so its daily plan, streamed daily plan and images are recorded too.
+
+Run from the repository root:
+    python -m benchmarks.record_fixtures --stub
+"""
+from benchmarks.bench_load import DATA_DIR, FIXTURES, WORKLOAD, choose_trip
+from benchmarks.stub_server import StubUpstreamServer
+from replay import RecordingTransport
+import argparse
+import asyncio
+import httpx
+import main
+import shutil
+
+
+async def record(args):
+    transport = RecordingTransport(args.output)
+    main.http_pool.transport = transport
+    # Record every suggestion, daily plan and image instead of answering from the persistent caches
+    for cache in (main.suggestion_cache, main.content_cache):
+        cache.close()
+        cache.disk = None
+    if args.stub:
+        server = StubUpstreamServer(latency=0).start()
+        main.openai_upstream.base_url = server.url
+        main.serpapi_upstream.base_url = server.url
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://record", timeout=None) as client:
+        for trip_request in WORKLOAD:
+            response = await client.post("/plan_trip", json=trip_request)
+            response.raise_for_status()
+            plan = response.json()
+            for choice in range(1, len(plan["trip_options"]) + 1):
+                success, trip = await choose_trip(client, plan["plan_id"], choice)
+                if not success:
+                    raise Exception(f"Choosing option {choice} failed: {trip}")
+                async with client.stream("POST", "/choose_trip/stream", json={"plan_id": plan["plan_id"], "choice": choice}) as response:
+                    await response.aread()
+            print(f"{trip_request['vacation_type']}: {len(plan['trip_options'])} options")
+    await main.job_workers.stop()
+    await main.trip_planner.aclose()
+    main.job_queue.close()
+    main.bulk_checkpoints.close()
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+    if args.stub:
+        server.shutdown()
+    print(f"Recorded {transport.recorded} responses to {args.output}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=FIXTURES, help="directory the fixtures are written to")
+    parser.add_argument("--stub", action="store_true", help="record from the local stub server instead of the real APIs")
+    asyncio.run(record(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,200 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from datetime import date, timedelta
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+DESTINATIONS = [
+    {"name": "Barcelona, Spain", "airport": "Barcelona El Prat Airport", "iata_code": "BCN"},
+    {"name": "Nice, France", "airport": "Nice Cote d'Azur Airport", "iata_code": "NCE"},
+    {"name": "Larnaca, Cyprus", "airport": "Larnaca International Airport", "iata_code": "LCA"},
+    {"name": "Heraklion, Greece", "airport": "Heraklion International Airport", "iata_code": "HER"},
+    {"name": "Antalya, Turkey", "airport": "Antalya Airport", "iata_code": "AYT"}
+]
+
+ACTIVITIES = ["Old town walking tour", "Beach afternoon", "Local food market", "Sunset boat trip", "Museum visit", "Hike to the viewpoint"]
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """
+    A request handler that fakes the OpenAI and SerpAPI endpoints used by the trip planner.
+    Every response is delayed by the latency configured on the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload):
+        """
+        Send a JSON payload after sleeping for the configured latency.
+        
+        :param payload: dict: Response body
+        """
+        time.sleep(self.server.pick_latency())
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event_stream(self, chunks):
+        """
+        Send pieces of tool call arguments as OpenAI-style server-sent events, spreading the configured latency over them.
+        
+        :param chunks: list: Pieces of the JSON arguments to stream
+        """
+        delay = self.server.pick_latency() / max(len(chunks), 1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [{"choices": [{"delta": {"tool_calls": [{"index": 0, "function": {"arguments": chunk}}]}}]} for chunk in chunks]
+        for line in [f"data: {json.dumps(event)}" for event in events] + ["data: [DONE]"]:
+            time.sleep(delay)
+            data = f"{line}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_file(self):
+        """
+        Send a fake PNG image whose content is derived from its name.
+        """
+        time.sleep(self.server.pick_latency())
+        body = b"\x89PNG\r\n\x1a\n" + urlparse(self.path).path.encode() * 64
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def daily_plan(self, request):
+        """
+        Build fake daily plan arguments covering the dates in the prompt.
+        
+        :param request: dict: Chat completion request
+        :return: dict: Days of the plan
+        """
+        start, end = re.findall(r"\d{4}-\d{2}-\d{2}", request["messages"][0]["content"])[:2]
+        start = date.fromisoformat(start)
+        days = (date.fromisoformat(end) - start).days + 1
+        return {"days": [
+            {
+                "day": number + 1,
+                "date": (start + timedelta(days=number)).isoformat(),
+                "title": f"Day {number + 1} highlights",
+                "activities": [ACTIVITIES[(number + offset) % len(ACTIVITIES)] for offset in range(3)]
+            }
+            for number in range(days)
+        ]}
+
+    def itinerary(self, departure, arrival, outbound_date, price, stops):
+        """
+        Build a fake Google Flights itinerary.
+        
+        :param departure: str: IATA code of the origin
+        :param arrival: str: IATA code of the destination
+        :param outbound_date: str: Outbound date in YYYY-MM-DD format
+        :param price: int: Price of the round trip or one-way flight
+        :param stops: int: Number of stops
+        :return: dict: Itinerary in the Google Flights format
+        """
+        segments = [{
+            "departure_airport": {"name": "Ben Gurion Airport" if departure == "TLV" else f"{departure} Airport", "time": f"{outbound_date} 08:00"},
+            "arrival_airport": {"name": f"{arrival} Airport", "time": f"{outbound_date} 12:00"},
+            "duration": 240,
+            "airplane": "Airbus A320",
+            "airline": "Stub Air",
+            "travel_class": "Economy",
+            "flight_number": f"SA {100 + index}"
+        } for index in range(stops + 1)]
+        return {"price": price, "flights": segments, "total_duration": 240 * (stops + 1) + 90 * stops}
+
+    def do_GET(self):
+        if urlparse(self.path).path.startswith("/files/"):
+            return self.send_file()
+        query = parse_qs(urlparse(self.path).query)
+        engine = query.get("engine", [""])[0]
+        if engine == "google_flights":
+            departure = query.get("departure_id", ["TLV"])[0]
+            arrival = query.get("arrival_id", ["XXX"])[0]
+            outbound_date = query.get("outbound_date", ["2024-07-01"])[0]
+            # Vary the price with the route and dates so flexible and multi-city searches have something to find
+            if query.get("type", ["1"])[0] == "2":
+                price = 150 + sum(map(ord, departure + arrival + outbound_date)) % 120
+            else:
+                price = 300 + sum(map(ord, arrival + outbound_date + query.get("return_date", [""])[0])) % 150
+            self.send_json({
+                "best_flights": [self.itinerary(departure, arrival, outbound_date, price, stops=0)],
+                "other_flights": [self.itinerary(departure, arrival, outbound_date, price - 40, stops=1)]
+            })
+        elif engine == "google_hotels":
+            self.send_json({
+                "properties": [
+                    {"name": f"Stub Hotel {price}", "total_rate": {"extracted_lowest": price}}
+                    for price in (200, 400, 800, 1600)
+                ]
+            })
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.endswith("/chat/completions"):
+            tool = request.get("tool_choice", {}).get("function", {}).get("name")
+            arguments = json.dumps(self.daily_plan(request) if tool == "daily_plan" else {"destinations": DESTINATIONS})
+            if request.get("stream"):
+                self.send_event_stream([arguments[start:start + 16] for start in range(0, len(arguments), 16)])
+            else:
+                call = {"type": "function", "function": {"name": tool, "arguments": arguments}}
+                self.send_json({"choices": [{"message": {"content": None, "tool_calls": [call]}}]})
+        elif self.path.endswith("/images/generations"):
+            # Images are served by this server, with content that depends on the prompt
+            name = hashlib.sha256(request.get("prompt", "").encode()).hexdigest()[:16]
+            self.send_json({"data": [{"url": f"http://{self.headers['Host']}/files/{name}.png"}]})
+        else:
+            self.send_error(404)
+
+
+class StubUpstreamServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server that fakes the upstream APIs with configurable latency.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.5, jitter=0.0, port=0):
+        """
+        Initialize the stub server.
+        
+        :param latency: float: Base latency in seconds added to every response
+        :param jitter: float: Maximum random latency in seconds added on top of the base latency
+        :param port: int: Port to listen on, 0 picks a free port
+        """
+        super().__init__(("127.0.0.1", port), StubUpstreamHandler)
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def pick_latency(self):
+        return self.latency + random.uniform(0, self.jitter)
+
+    def start(self):
+        """
+        Serve requests from a background thread.
+        
+        :return: StubUpstreamServer: The running server
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
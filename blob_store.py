@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import hashlib
+import os
+import re
+
+# Names are the SHA-256 of the content and an extension, so they can be served without path checks beyond this
+BLOB_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,5}$")
+
+
+class BlobStore:
+    """
+    A class to keep binary files (e.g. generated images) in a local directory, named by the hash of their content,
+    and to evict the least recently used files once the directory grows past a size limit.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        """
+        Initialize the BlobStore, indexing the files already in the directory by their last access.
+        
+        :param directory: str: Directory the files are kept in, created if needed
+        :param max_bytes: int: Maximum total size of the files in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sizes = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and BLOB_NAME.match(entry.name)]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            self.sizes[entry.name] = entry.stat().st_size
+            self.total_bytes += entry.stat().st_size
+        self.evict()
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __contains__(self, name):
+        return name in self.sizes
+
+    def path(self, name):
+        """
+        Get the path of a stored file and mark it as recently used.
+        
+        :param name: str: Name of the file
+        :return: str: Path of the file, or None if it is not stored
+        """
+        if name not in self.sizes:
+            return None
+        self.sizes.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        # The modification time keeps the recency across restarts
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.total_bytes -= self.sizes.pop(name)
+            return None
+        return path
+
+    def put(self, content, extension="png"):
+        """
+        Store content, once per distinct content.
+        
+        :param content: bytes: Content of the file
+        :param extension: str: File extension, without the dot
+        :return: str: Name of the stored file
+        """
+        name = f"{hashlib.sha256(content).hexdigest()}.{extension}"
+        if name in self.sizes:
+            self.path(name)
+            return name
+        path = os.path.join(self.directory, name)
+        # Write under a temporary name, so readers never see a partial file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+        self.sizes[name] = len(content)
+        self.total_bytes += len(content)
+        self.evict()
+        return name
+
+    def evict(self):
+        """
+        Delete the least recently used files until the total size is within the limit.
+        """
+        while self.total_bytes > self.max_bytes and self.sizes:
+            name, size = self.sizes.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def collect(self):
+        """
+        Read the store size and evictions for the metrics endpoint.
+        
+        :return: list: (name, type, labels, value) tuples
+        """
+        return [
+            ("blob_store_files", "gauge", {}, len(self.sizes)),
+            ("blob_store_bytes", "gauge", {}, self.total_bytes),
+            ("blob_store_evictions_total", "counter", {}, self.evictions)
+        ]
+
+    def stats(self):
+        return {"files": len(self.sizes), "bytes": self.total_bytes, "max_bytes": self.max_bytes, "evictions": self.evictions}
@@ -0,0 +1,122 @@
+"""
+Plan a batch of trips through the /plan_trips/bulk endpoint of a running server.
+
+The input file has one TripRequest per line as JSON, optionally with an "id" that is copied to its result.
+Results are appended to the output file as JSON lines as soon as they arrive. Running the same command again
+after an interruption only sends the requests without a successful result in the output file, and the server
+answers lines it already finished from its checkpoint.
+
+Run from the repository root:
+    python bulk_plan.py requests.jsonl results.jsonl
+    python bulk_plan.py requests.jsonl results.jsonl --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import hashlib
+import httpx
+import orjson
+import os
+import time
+
+
+def read_statuses(path):
+    """
+    Read the status of the last result of each request in an output file.
+    
+    :param path: str: Path of the output file
+    :return: dict: Index of each request with a result, to "ok" or "error"
+    """
+    statuses = {}
+    if not os.path.exists(path):
+        return statuses
+    with open(path, "rb") as file:
+        for line in file:
+            try:
+                result = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # The last line may be cut off by the interruption
+                continue
+            if result.get("event") == "result":
+                statuses[result["index"]] = result.get("status")
+    return statuses
+
+
+def end_last_line(path):
+    """
+    Terminate a line cut off by an interruption, so the results appended next start on their own line.
+    
+    :param path: str: Path of the output file
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as file:
+        file.seek(-1, os.SEEK_END)
+        if file.read(1) != b"\n":
+            file.write(b"\n")
+
+
+async def plan_batch(args):
+    with open(args.input, "rb") as file:
+        content = file.read()
+    lines = [line for line in content.split(b"\n") if line.strip()]
+    batch_id = args.batch_id or hashlib.sha256(content).hexdigest()[:32]
+    statuses = read_statuses(args.output)
+    end_last_line(args.output)
+    done = {index for index, status in statuses.items() if status == "ok"}
+    pending = []
+    invalid = []
+    for index, line in enumerate(lines):
+        if index in done:
+            continue
+        try:
+            item = orjson.loads(line)
+            item["index"] = index
+        except (orjson.JSONDecodeError, TypeError) as e:
+            # Lines that are not JSON fail the same way every time, so they are reported once
+            if index not in statuses:
+                invalid.append({"event": "result", "index": index, "id": None, "status": "error",
+                                "detail": f"Invalid JSON: {e}"})
+            continue
+        pending.append(orjson.dumps(item))
+    print(f"Batch {batch_id}: {len(lines)} requests, {len(done)} already done, sending {len(pending)}")
+    if invalid:
+        print(f"Skipped {len(invalid)} lines that are not JSON objects")
+        with open(args.output, "ab") as output:
+            output.write(b"".join(orjson.dumps(result) + b"\n" for result in invalid))
+    if not pending:
+        return
+
+    started = time.perf_counter()
+    summary = None
+    async with httpx.AsyncClient(base_url=args.url, timeout=httpx.Timeout(args.timeout, connect=10)) as client:
+        async with client.stream("POST", "/plan_trips/bulk", params={"batch_id": batch_id},
+                                 content=b"\n".join(pending) + b"\n",
+                                 headers={"Content-Type": "application/x-ndjson"}) as response:
+            response.raise_for_status()
+            with open(args.output, "ab") as output:
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    result = orjson.loads(line)
+                    if result.get("event") == "summary":
+                        summary = result
+                        continue
+                    output.write(line.encode() + b"\n")
+                    output.flush()
+                    if result["status"] != "ok":
+                        print(f"Request {result['index']} failed: {result.get('detail')}")
+    print(f"Finished in {time.perf_counter() - started:.1f}s: {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSON lines file with one trip request per line")
+    parser.add_argument("output", help="JSON lines file the results are appended to")
+    parser.add_argument("--url", default="http://localhost:8000", help="base URL of the trip planner server")
+    parser.add_argument("--batch-id", help="checkpoint ID of the batch, derived from the input file if not given")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the next result")
+    asyncio.run(plan_batch(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+from collections import OrderedDict
+import asyncio
+import orjson
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+    """
+    A class to hold values in memory with a per-entry time to live, evicting the least recently used entry when full.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        Initialize the LRUCache.
+        
+        :param max_size: int: Maximum number of entries kept in memory
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Get a fresh value from the cache.
+        
+        :param key: str: Cache key
+        :return: tuple: (True, value) on a hit or (False, None) on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            return False, None
+        self.entries.move_to_end(key)
+        return True, value
+
+    def set(self, key, value, ttl):
+        """
+        Store a value in the cache.
+        
+        :param key: str: Cache key
+        :param value: object: Value to store
+        :param ttl: float: Time in seconds the value stays fresh
+        """
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SQLiteCache:
+    """
+    A class to hold JSON-serializable values (including dataclasses) in a SQLite file, so cached responses survive a restart.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the SQLiteCache and create its table if needed.
+        
+        :param path: str: Path of the SQLite database file
+        """
+        self.path = path
+        # Callers may use the cache from worker threads, which must not interleave statements on the connection
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # Write-ahead logging lets several processes read while one of them writes.
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+        self.connection.commit()
+
+    def get(self, key):
+        """
+        Get a fresh value and its remaining time to live from the cache.
+        
+        :param key: str: Cache key
+        :return: tuple: (True, value, remaining ttl) on a hit or (False, None, 0) on a miss
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None, 0
+        value, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            self.pop(key)
+            return False, None, 0
+        return True, orjson.loads(value), remaining
+
+    def set(self, key, value, ttl):
+        """
+        Store a value in the cache.
+        
+        :param key: str: Cache key
+        :param value: object: JSON-serializable value to store
+        :param ttl: float: Time in seconds the value stays fresh
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, orjson.dumps(value), time.time() + ttl)
+            )
+            self.connection.commit()
+
+    def set_many(self, items, ttl):
+        """
+        Store several values in the cache with a single commit.
+        
+        :param items: list: (key, value) pairs, values JSON-serializable
+        :param ttl: float: Time in seconds the values stay fresh
+        """
+        expires_at = time.time() + ttl
+        rows = [(key, orjson.dumps(value), expires_at) for key, value in items]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", rows)
+            self.connection.commit()
+
+    def pop(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def purge_expired(self):
+        """
+        Delete every expired entry from the database.
+        
+        :return: int: Number of deleted entries
+        """
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            self.connection.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ResponseCache:
+    """
+    A class to cache upstream responses in an in-memory LRU tier and an optional on-disk tier.
+    Concurrent lookups of the same key share a single upstream call. The disk tier is read and written
+    in worker threads, so a slow or locked SQLite file does not stall the event loop.
+    """
+
+    def __init__(self, max_size=1024, ttls=None, default_ttl=600, disk_path=None):
+        """
+        Initialize the ResponseCache.
+        
+        :param max_size: int: Maximum number of entries kept in memory
+        :param ttls: dict: Freshness in seconds per namespace (e.g. per SerpAPI engine)
+        :param default_ttl: float: Freshness in seconds for namespaces without their own entry in ttls
+        :param disk_path: str: Path of a SQLite file for the on-disk tier, or None to keep everything in memory
+        """
+        self.memory = LRUCache(max_size)
+        self.disk = SQLiteCache(disk_path) if disk_path else None
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.in_flight = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.fetches = 0
+        self.fetch_seconds = 0.0
+
+    @staticmethod
+    def make_key(namespace, params, ignore=("api_key",)):
+        """
+        Build a cache key from normalized request parameters.
+        
+        :param namespace: str: Namespace of the key (e.g. the SerpAPI engine)
+        :param params: dict: Request parameters
+        :param ignore: tuple: Parameter names left out of the key
+        :return: str: Cache key
+        """
+        normalized = {
+            name: " ".join(value.split()).casefold() if isinstance(value, str) else value
+            for name, value in params.items() if name not in ignore
+        }
+        return f"{namespace}:{orjson.dumps(normalized, option=orjson.OPT_SORT_KEYS).decode()}"
+
+    def ttl_for(self, namespace):
+        return self.ttls.get(namespace, self.default_ttl)
+
+    async def get(self, key):
+        """
+        Look up a key in the memory tier and then in the disk tier.
+        
+        :param key: str: Cache key
+        :return: tuple: (True, value) on a hit or (False, None) on a miss
+        """
+        found, value = self.memory.get(key)
+        if found:
+            self.memory_hits += 1
+            return True, value
+        return await self.get_from_disk(key)
+
+    async def get_from_disk(self, key):
+        """
+        Look up a key in the disk tier and keep a hit in memory for the rest of its time to live.
+        
+        :param key: str: Cache key
+        :return: tuple: (True, value) on a hit or (False, None) on a miss or without a disk tier
+        """
+        if not self.disk:
+            return False, None
+        found, value, remaining = await asyncio.to_thread(self.disk.get, key)
+        if not found:
+            return False, None
+        self.disk_hits += 1
+        self.memory.set(key, value, remaining)
+        return True, value
+
+    async def set(self, namespace, key, value):
+        """
+        Store a value in every tier.
+        
+        :param namespace: str: Namespace of the key, which sets its freshness
+        :param key: str: Cache key
+        :param value: object: JSON-serializable value to store
+        """
+        ttl = self.ttl_for(namespace)
+        self.memory.set(key, value, ttl)
+        if self.disk:
+            await asyncio.to_thread(self.disk.set, key, value, ttl)
+
+    async def invalidate(self, key):
+        self.memory.pop(key)
+        if self.disk:
+            await asyncio.to_thread(self.disk.pop, key)
+
+    async def get_or_fetch(self, namespace, params, fetch):
+        """
+        Get a cached response, or fetch it once for all concurrent callers asking for the same key.
+        
+        :param namespace: str: Namespace of the key (e.g. the SerpAPI engine)
+        :param params: dict: Request parameters the key is built from
+        :param fetch: callable: Coroutine function that performs the upstream call
+        :return: object: Cached or freshly fetched response
+        """
+        key = self.make_key(namespace, params)
+        found, value = self.memory.get(key)
+        if found:
+            self.memory_hits += 1
+            return value
+
+        task = self.in_flight.get(key)
+        if task is None:
+            # The disk lookup is shared like the fetch, so concurrent callers read the file once
+            task = asyncio.ensure_future(self._load(namespace, key, fetch))
+            task.add_done_callback(self._consume_exception)
+            self.in_flight[key] = task
+        else:
+            self.coalesced += 1
+        # Shield the shared call, so a caller that gives up does not cancel it for the others.
+        return await asyncio.shield(task)
+
+    async def _load(self, namespace, key, fetch):
+        try:
+            found, value = await self.get_from_disk(key)
+            if found:
+                return value
+            self.misses += 1
+            started = time.perf_counter()
+            value = await fetch()
+            self.fetches += 1
+            self.fetch_seconds += time.perf_counter() - started
+            await self.set(namespace, key, value)
+            return value
+        finally:
+            self.in_flight.pop(key, None)
+
+    @staticmethod
+    def _consume_exception(task):
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        """
+        Get the cache counters.
+        
+        :return: dict: Hit, miss, coalescing and eviction counters, and the upstream time saved by hits
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses + self.coalesced
+        hits = self.memory_hits + self.disk_hits + self.coalesced
+        mean_fetch_seconds = self.fetch_seconds / self.fetches if self.fetches else 0.0
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.memory.evictions,
+            "expirations": self.memory.expirations,
+            "size": len(self.memory),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "mean_fetch_seconds": mean_fetch_seconds,
+            "saved_seconds": hits * mean_fetch_seconds
+        }
+
+    def collect(self, name):
+        """
+        Read the cache counters for the metrics endpoint.
+        
+        :param name: str: Name of the cache in the metric labels
+        :return: list: (name, type, labels, value) tuples
+        """
+        return [
+            ("cache_hits_total", "counter", {"cache": name, "tier": "memory"}, self.memory_hits),
+            ("cache_hits_total", "counter", {"cache": name, "tier": "disk"}, self.disk_hits),
+            ("cache_hits_total", "counter", {"cache": name, "tier": "coalesced"}, self.coalesced),
+            ("cache_misses_total", "counter", {"cache": name}, self.misses),
+            ("cache_evictions_total", "counter", {"cache": name}, self.memory.evictions),
+            ("cache_entries", "gauge", {"cache": name}, len(self.memory))
+        ]
+
+    def close(self):
+        if self.disk:
+            self.disk.close()
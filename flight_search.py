@@ -0,0 +1,142 @@
+from datetime import date, timedelta
+from models import Flight
+import numpy as np
+
+
+def date_window(day, flexible_days):
+    """
+    List the dates within flexible_days of a date.
+    
+    :param day: str: Date in YYYY-MM-DD format
+    :param flexible_days: int: Number of days the date may move in either direction
+    :return: list: Dates in YYYY-MM-DD format, in ascending order
+    """
+    center = date.fromisoformat(day)
+    return [(center + timedelta(days=offset)).isoformat() for offset in range(-flexible_days, flexible_days + 1)]
+
+
+def parse_time(value):
+    """
+    Parse a Google Flights time such as '2024-07-01 08:00' into a NumPy minute timestamp.
+    
+    :param value: str: Time from the API
+    :return: numpy.datetime64: Timestamp, or NaT if the time is missing or malformed
+    """
+    try:
+        return np.datetime64(value.replace(' ', 'T'), 'm')
+    except (AttributeError, ValueError):
+        return np.datetime64('NaT', 'm')
+
+
+class FlightTable:
+    """
+    A class to hold flight search results column by column, so they can be filtered and ranked with NumPy.
+    """
+
+    def __init__(self, origins, destinations, outbound_dates, return_dates, prices, durations, stops,
+                 departure_times, arrival_times, itineraries):
+        """
+        Initialize the FlightTable with one array per column. Row i of every column describes the same itinerary.
+        
+        :param origins: numpy.ndarray: IATA codes of the origin airports
+        :param destinations: numpy.ndarray: IATA codes of the destination airports
+        :param outbound_dates: numpy.ndarray: Outbound dates
+        :param return_dates: numpy.ndarray: Return dates
+        :param prices: numpy.ndarray: Round-trip prices
+        :param durations: numpy.ndarray: Outbound durations in minutes, including layovers
+        :param stops: numpy.ndarray: Number of outbound stops
+        :param departure_times: numpy.ndarray: Outbound departure times
+        :param arrival_times: numpy.ndarray: Outbound arrival times
+        :param itineraries: list: Raw itineraries, used to build Flight objects for the selected rows
+        """
+        self.origins = origins
+        self.destinations = destinations
+        self.outbound_dates = outbound_dates
+        self.return_dates = return_dates
+        self.prices = prices
+        self.durations = durations
+        self.stops = stops
+        self.departure_times = departure_times
+        self.arrival_times = arrival_times
+        self.itineraries = itineraries
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        Build a table from Google Flights search results, with one row per itinerary in best_flights and other_flights.
+        
+        :param results: list: (origin, destination, outbound date, return date, raw results) tuples
+        :return: FlightTable: Table of every itinerary with a price
+        """
+        columns = {name: [] for name in ("origins", "destinations", "outbound_dates", "return_dates", "prices",
+                                         "durations", "stops", "departure_times", "arrival_times")}
+        itineraries = []
+        for origin, destination, date_out, date_return, data in results:
+            for itinerary in data.get("best_flights", []) + data.get("other_flights", []):
+                segments = itinerary.get('flights')
+                if not segments or not isinstance(itinerary.get('price'), (int, float)):
+                    continue
+                columns["origins"].append(origin)
+                columns["destinations"].append(destination)
+                columns["outbound_dates"].append(date_out)
+                columns["return_dates"].append(date_return)
+                columns["prices"].append(itinerary['price'])
+                columns["durations"].append(itinerary.get('total_duration') or sum(segment.get('duration', 0) for segment in segments))
+                columns["stops"].append(len(segments) - 1)
+                columns["departure_times"].append(parse_time(segments[0]['departure_airport'].get('time')))
+                columns["arrival_times"].append(parse_time(segments[-1]['arrival_airport'].get('time')))
+                itineraries.append(itinerary)
+
+        return cls(
+            origins=np.array(columns["origins"], dtype='U3'),
+            destinations=np.array(columns["destinations"], dtype='U3'),
+            outbound_dates=np.array(columns["outbound_dates"], dtype='datetime64[D]'),
+            return_dates=np.array(columns["return_dates"], dtype='datetime64[D]'),
+            prices=np.array(columns["prices"], dtype=np.float64),
+            durations=np.array(columns["durations"], dtype=np.int32),
+            stops=np.array(columns["stops"], dtype=np.int16),
+            departure_times=np.array(columns["departure_times"], dtype='datetime64[m]'),
+            arrival_times=np.array(columns["arrival_times"], dtype='datetime64[m]'),
+            itineraries=itineraries
+        )
+
+    def __len__(self):
+        return len(self.prices)
+
+    def rank(self, budget=float('inf'), max_duration=None, max_stops=None):
+        """
+        Pick the cheapest itinerary per destination within budget and limits, preferring shorter flights on equal price.
+        
+        :param budget: float: Maximum round-trip price
+        :param max_duration: int: Maximum outbound duration in minutes, or None for no limit
+        :param max_stops: int: Maximum number of outbound stops, or None for no limit
+        :return: dict: Destination IATA code to the row of its best itinerary
+        """
+        mask = self.prices <= budget
+        if max_duration is not None:
+            mask &= self.durations <= max_duration
+        if max_stops is not None:
+            mask &= self.stops <= max_stops
+        rows = np.flatnonzero(mask)
+        if not len(rows):
+            return {}
+
+        # Sort by destination, then price, then duration, and keep the first row of every destination.
+        rows = rows[np.lexsort((self.durations[rows], self.prices[rows], self.destinations[rows]))]
+        destinations = self.destinations[rows]
+        firsts = np.flatnonzero(np.r_[True, destinations[1:] != destinations[:-1]])
+        return {str(destinations[first]): int(rows[first]) for first in firsts}
+
+    def flight(self, row):
+        """
+        Build the Flight of a row, including its origin and dates.
+        
+        :param row: int: Row of the table
+        :return: Flight: Parsed Flight object
+        """
+        return Flight.from_itinerary(
+            self.itineraries[row],
+            origin=str(self.origins[row]),
+            outbound_date=str(self.outbound_dates[row]),
+            return_date=str(self.return_dates[row])
+        )
@@ -0,0 +1,51 @@
+import httpx
+
+
+class HTTPPool:
+    """
+    A class to keep long-lived pooled HTTP connections to the upstream APIs, with one client per upstream host.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0, timeout=30.0, transport=None):
+        """
+        Initialize the HTTPPool with its connection limits.
+        
+        :param max_connections: int: Maximum number of open connections per upstream host
+        :param max_keepalive_connections: int: Maximum number of idle connections kept alive per upstream host
+        :param keepalive_expiry: float: Time in seconds an idle connection is kept alive
+        :param timeout: float: Default timeout in seconds for a single request
+        :param transport: httpx.AsyncBaseTransport: Transport shared by every client instead of direct connections,
+            e.g. a RecordingTransport or ReplayTransport. The connection limits do not apply to it.
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout)
+        self.transport = transport
+        self.clients = {}
+
+    def client(self, base_url):
+        """
+        Get the pooled client for an upstream host, creating it on first use.
+        
+        :param base_url: str: Base URL of the upstream host
+        :return: httpx.AsyncClient: Client whose connections are reused across requests
+        """
+        base_url = base_url.rstrip('/')
+        client = self.clients.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(base_url=base_url, limits=self.limits, timeout=self.timeout, transport=self.transport)
+            self.clients[base_url] = client
+        return client
+
+    async def aclose(self):
+        """
+        Close every pooled client and its connections.
+        """
+        clients, self.clients = list(self.clients.values()), {}
+        for client in clients:
+            await client.aclose()
+        if self.transport is not None:
+            await self.transport.aclose()
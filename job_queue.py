@@ -0,0 +1,395 @@
+from functools import wraps
+from metrics import Metrics
+import asyncio
+import orjson
+import sqlite3
+import threading
+import time
+import uuid
+
+# Jobs that are final are kept for polling until their result expires
+FINAL_STATUSES = ("done", "failed")
+
+
+def locked(method):
+    """
+    Decorate a method of an object with a lock attribute, so calls from worker threads do not interleave
+    their statements on the shared connection.
+    
+    :param method: callable: Method to run under the lock
+    :return: callable: Wrapped method
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue already holds its maximum number of waiting jobs.
+    """
+
+
+class SQLiteJobQueue:
+    """
+    A class to keep background jobs in a SQLite file, so queued jobs survive a restart and several server workers
+    can share one queue. Jobs run in priority order, and first in first out within a priority. Its methods block
+    on the database, so async callers run them in a thread.
+    """
+
+    def __init__(self, path, max_queued=1000, lease=600, max_attempts=3, result_ttl=3600):
+        """
+        Initialize the SQLiteJobQueue and create its table if needed.
+        
+        :param path: str: Path of the SQLite database file shared by the workers
+        :param max_queued: int: Maximum number of waiting jobs, further submissions are rejected
+        :param lease: float: Time in seconds a claimed job may run before another worker may take it over
+        :param max_attempts: int: Number of times a job is started before it is given up
+        :param result_ttl: float: Time in seconds a finished job and its result are kept
+        """
+        self.path = path
+        self.max_queued = max_queued
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, "
+            "kind TEXT NOT NULL, priority INTEGER NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+            "started_at REAL, updated_at REAL NOT NULL, lease_until REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, priority DESC, seq)")
+        self.connection.commit()
+
+    @locked
+    def put(self, kind, payload, priority=0):
+        """
+        Add a job to the queue.
+        
+        :param kind: str: Kind of the job, which selects its handler
+        :param payload: dict: JSON-serializable arguments of the handler
+        :param priority: int: Jobs with a higher priority run first
+        :return: str: ID of the new job
+        """
+        if self.count("queued") >= self.max_queued:
+            raise QueueFullError(f"The job queue is full ({self.max_queued} jobs waiting).")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.connection.execute(
+            "INSERT INTO jobs (id, kind, priority, status, payload, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, priority, orjson.dumps(payload), now, now)
+        )
+        self.connection.commit()
+        return job_id
+
+    @locked
+    def claim(self):
+        """
+        Take the next job to run, including jobs whose worker stopped without finishing them.
+        
+        :return: dict: Job with its ID, kind, payload, attempts and creation time, or None if no job is waiting
+        """
+        now = time.time()
+        # Jobs that keep stopping their worker are given up instead of taken over again
+        self.connection.execute(
+            "UPDATE jobs SET status = 'failed', error = 'The job was interrupted too many times.', updated_at = ? "
+            "WHERE status = 'running' AND lease_until <= ? AND attempts >= ?",
+            (now, now, self.max_attempts)
+        )
+        # A single statement, so two workers never claim the same job
+        row = self.connection.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, updated_at = ?, lease_until = ? "
+            "WHERE seq = (SELECT seq FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until <= ?) "
+            "ORDER BY priority DESC, seq LIMIT 1) "
+            "RETURNING id, kind, payload, attempts, created_at",
+            (now, now, now + self.lease, now)
+        ).fetchone()
+        self.connection.commit()
+        if row is None:
+            return None
+        job_id, kind, payload, attempts, created_at = row
+        return {"job_id": job_id, "kind": kind, "payload": orjson.loads(payload), "attempts": attempts, "created_at": created_at}
+
+    def complete(self, job_id, result):
+        """
+        Store the result of a finished job.
+        
+        :param job_id: str: ID of the job
+        :param result: object: JSON-serializable result (dataclasses included)
+        """
+        self._finish(job_id, "done", orjson.dumps(result), None)
+
+    def fail(self, job_id, error):
+        """
+        Mark a job as failed.
+        
+        :param job_id: str: ID of the job
+        :param error: str: Error message shown to the client
+        """
+        self._finish(job_id, "failed", None, error)
+
+    @locked
+    def release(self, job_id):
+        """
+        Put a running job back in the queue, e.g. when its worker is shut down.
+        
+        :param job_id: str: ID of the job
+        """
+        self.connection.execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND status = 'running'",
+            (time.time(), job_id)
+        )
+        self.connection.commit()
+
+    @locked
+    def _finish(self, job_id, status, result, error):
+        self.connection.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+            (status, result, error, time.time(), job_id)
+        )
+        self.connection.commit()
+
+    @locked
+    def get(self, job_id):
+        """
+        Get the state of a job.
+        
+        :param job_id: str: ID of the job
+        :return: dict: Job ID, kind, status, priority, attempts, result and error, and the number of jobs ahead of it
+            while it is queued, or None if the job is unknown or expired
+        """
+        row = self.connection.execute(
+            "SELECT seq, kind, priority, status, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        seq, kind, priority, status, result, error, attempts, created_at, updated_at = row
+        if status in FINAL_STATUSES and updated_at + self.result_ttl <= time.time():
+            return None
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "priority": priority,
+            "attempts": attempts,
+            "created_at": created_at,
+            "result": orjson.loads(result) if result is not None else None,
+            "error": error
+        }
+        if status == "queued":
+            job["position"] = self.connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND seq < ?))",
+                (priority, priority, seq)
+            ).fetchone()[0]
+        return job
+
+    @locked
+    def count(self, status):
+        return self.connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    @locked
+    def counts(self):
+        """
+        Count the jobs per status.
+        
+        :return: dict: Status to number of jobs
+        """
+        counts = dict.fromkeys(("queued", "running") + FINAL_STATUSES, 0)
+        counts.update(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return counts
+
+    @locked
+    def purge_expired(self):
+        """
+        Delete the finished jobs whose results expired.
+        
+        :return: int: Number of deleted jobs
+        """
+        cursor = self.connection.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at <= ?",
+            (time.time() - self.result_ttl,)
+        )
+        self.connection.commit()
+        return cursor.rowcount
+
+    @locked
+    def close(self):
+        self.connection.close()
+
+
+class JobWorkers:
+    """
+    A class to run the jobs of a queue in a bounded number of worker tasks, so long generations do not hold
+    the requests that asked for them. Submitting wakes an idle worker; jobs submitted by other server workers
+    are picked up on the next poll.
+    """
+
+    def __init__(self, queue, handlers, concurrency=4, poll_interval=1.0, purge_every=500, metrics=None):
+        """
+        Initialize the JobWorkers.
+        
+        :param queue: SQLiteJobQueue: Queue the jobs are kept in
+        :param handlers: dict: Job kind to coroutine function that takes the payload and returns the result
+        :param concurrency: int: Maximum number of jobs running at the same time in this process
+        :param poll_interval: float: Time in seconds between checks of the queue while idle
+        :param purge_every: int: Number of finished jobs between purges of expired results
+        :param metrics: Metrics: Registry the queue wait and run times are recorded in
+        """
+        self.queue = queue
+        self.handlers = dict(handlers)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.purge_every = purge_every
+        self.metrics = metrics or Metrics()
+        self.tasks = []
+        self.wakeup = None
+        self.finished = {}
+        self.running = set()
+        self.counts = dict.fromkeys(("queued", "running") + FINAL_STATUSES, 0)
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        """
+        Start the worker tasks, if they are not running yet. Needs a running event loop.
+        """
+        if self.tasks:
+            return
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """
+        Stop the worker tasks. Jobs they were running go back to the queue for the next start.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for job_id in list(self.running):
+            await asyncio.to_thread(self.queue.release, job_id)
+        self.running.clear()
+
+    async def submit(self, kind, payload, priority=0):
+        """
+        Queue a job and wake a worker for it.
+        
+        :param kind: str: Kind of the job, one of the handler keys
+        :param payload: dict: JSON-serializable arguments of the handler
+        :param priority: int: Jobs with a higher priority run first
+        :return: str: ID of the job
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        try:
+            job_id = await asyncio.to_thread(self.queue.put, kind, payload, priority)
+        except QueueFullError:
+            self.rejected += 1
+            raise
+        self.start()
+        self.wakeup.set()
+        return job_id
+
+    async def work(self):
+        while True:
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run(job)
+
+    async def run(self, job):
+        """
+        Run one claimed job and store its result or error.
+        
+        :param job: dict: Job as returned by the queue
+        """
+        self.metrics.observe("job_queue_wait_seconds", max(time.time() - job["created_at"], 0.0), kind=job["kind"])
+        # A job cancelled with its worker stays in running, and stop() puts it back in the queue
+        self.running.add(job["job_id"])
+        try:
+            with self.metrics.stage(f"job_{job['kind']}"):
+                result = await self.handlers[job["kind"]](job["payload"])
+        except Exception as e:
+            print(f"Job {job['job_id']} ({job['kind']}) failed: {e}")
+            await asyncio.to_thread(self.queue.fail, job["job_id"], getattr(e, "detail", None) or str(e))
+            self.failed += 1
+        else:
+            await asyncio.to_thread(self.queue.complete, job["job_id"], result)
+            self.completed += 1
+        self.running.discard(job["job_id"])
+        if (self.completed + self.failed) % self.purge_every == 0:
+            await asyncio.to_thread(self.queue.purge_expired)
+        event = self.finished.pop(job["job_id"], None)
+        if event:
+            event.set()
+
+    async def wait(self, job_id, timeout):
+        """
+        Wait until a job is finished or the timeout passes, for long polling.
+        
+        :param job_id: str: ID of the job
+        :param timeout: float: Maximum time in seconds to wait
+        :return: dict: State of the job, or None if the job is unknown or expired
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.queue.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINAL_STATUSES:
+                self.finished.pop(job_id, None)
+                return job
+            if remaining <= 0:
+                return job
+            # Jobs run by other server workers only show up in the queue, so check it again after a poll interval
+            event = self.finished.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    async def refresh(self):
+        """
+        Count the jobs per status in the queue for collect and stats, in a thread since it reads the database.
+        """
+        self.counts = await asyncio.to_thread(self.queue.counts)
+
+    def collect(self):
+        """
+        Read the queue length and job counters for the metrics endpoint. The queue length is the one of the last refresh.
+        
+        :return: list: (name, type, labels, value) tuples
+        """
+        return [("job_queue_jobs", "gauge", {"status": status}, count) for status, count in self.counts.items()] + [
+            ("jobs_finished_total", "counter", {"result": "done"}, self.completed),
+            ("jobs_finished_total", "counter", {"result": "failed"}, self.failed),
+            ("jobs_rejected_total", "counter", {}, self.rejected),
+            ("job_workers", "gauge", {}, len(self.tasks))
+        ]
+
+    def stats(self):
+        """
+        Get the job counters.
+        
+        :return: dict: Jobs per status in the queue at the last refresh, jobs finished and failed in this process,
+            submissions rejected because the queue was full, and the number of worker tasks
+        """
+        return {
+            "jobs": dict(self.counts),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "workers": len(self.tasks)
+        }
@@ -1,12 +1,45 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from datetime import datetime
+from blob_store import BLOB_NAME, BlobStore
+from cache import ResponseCache, SQLiteCache
+from http_pool import HTTPPool
+from job_queue import JobWorkers, QueueFullError, SQLiteJobQueue
+from metrics import Metrics, MetricsMiddleware
+from session_store import MemorySessionStore
+from speculation import Speculator
+from upstream import CircuitOpenError, Upstream, UpstreamError, time_budget
 from trip_planner import TripPlanner
+import asyncio
+import httpx
+import orjson
 import logging
+import os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Resume the queued jobs when the server starts, and close the pooled upstream connections when it shuts down.
+    """
+    job_workers.start()
+    yield
+    speculator.cancel_all()
+    await job_workers.stop()
+    await trip_planner.aclose()
+    response_cache.close()
+    suggestion_cache.close()
+    content_cache.close()
+    session_store.close()
+    job_queue.close()
+    bulk_checkpoints.close()
+
+# Responses are serialized with orjson, which writes the Flight and Hotel dataclasses directly. Endpoints returning
+# trip options or jobs return an ORJSONResponse themselves, since FastAPI would first run jsonable_encoder on a dict.
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configure CORS
 app.add_middleware(
@@ -15,13 +48,96 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Latency histograms and counters per stage, upstream and route, served on /metrics.
+# Send an X-Trace header to get the stage timings of a request back in its Server-Timing header.
+metrics = Metrics()
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 # Replace these with your actual API keys
 OPENAI_API_KEY = "you api key"
 SERPAPI_KEY = "your serpapi key"
 
-trip_planner = TripPlanner(OPENAI_API_KEY, SERPAPI_KEY)
+# Directory of the local databases and the image store. Benchmarks point it at a temporary directory.
+DATA_DIR = os.environ.get("TRIP_PLANNER_DATA_DIR", ".")
+
+# Connection pool limits per upstream host (OpenAI and SerpAPI)
+http_pool = HTTPPool(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+# Request rate limits, retries and circuit breakers per provider, shared by every request in this process.
+# Attempts time out at three times the recent p99 latency of their endpoint, and SerpAPI searches still running
+# after the recent p95 latency send a second copy when the rate limit has room for it.
+openai_upstream = Upstream("openai", "https://api.openai.com", http_pool, rate=5, burst=10, max_retries=3, metrics=metrics)
+serpapi_upstream = Upstream("serpapi", "https://serpapi.com", http_pool, rate=10, burst=20, max_retries=3, metrics=metrics,
+                            hedge_quantile=0.95)
+
+# Time budgets in seconds of planning a trip and of generating a chosen one. Every upstream call and stage
+# of a request gets the time left in its budget as deadline, so a stalled upstream cannot hold a request.
+PLAN_TRIP_TIME_BUDGET = 55
+CHOOSE_TRIP_TIME_BUDGET = 180
+
+# Freshness in seconds of cached SerpAPI responses per engine. Set disk_path to keep them across restarts.
+response_cache = ResponseCache(
+    max_size=2048,
+    ttls={"google_flights": 15 * 60, "google_hotels": 30 * 60, "google_hotels_index": 30 * 60},
+    disk_path=None
+)
+
+# Destination suggestions per (vacation type, month). Fill it ahead of time with warm_cache.py.
+WARMUP_VACATION_TYPES = ["ski", "beach", "city"]
+suggestion_cache = ResponseCache(max_size=512, default_ttl=7 * 24 * 3600, disk_path=os.path.join(DATA_DIR, "suggestion_cache.db"))
+
+# Daily plans and images keyed on their normalized prompts, so repeat choices skip OpenAI. Images are downloaded
+# once into a local store served on /images, and the least recently used ones are deleted past max_bytes.
+content_cache = ResponseCache(max_size=2048, ttls={"daily_plan": 7 * 24 * 3600, "image": 30 * 24 * 3600}, disk_path=os.path.join(DATA_DIR, "content_cache.db"))
+blob_store = BlobStore(os.path.join(DATA_DIR, "image_store"), max_bytes=1024 * 1024 * 1024)
+IMAGE_BASE_URL = "http://localhost:8000/images"
+
+# Results of /plan_trip and job IDs of /choose_trip per normalized request, so a burst of identical requests runs
+# one computation and its followers attach to it. Kept briefly, since the upstream responses have their own cache.
+request_cache = ResponseCache(max_size=1024, ttls={"plan_trip": 60, "choose_trip": 120})
+
+# Results of /plan_trips/bulk per batch and line, so a batch sent again with the same batch_id resumes where it stopped.
+# At most BULK_CONCURRENCY distinct searches of a batch are planned at once, under the same upstream rate limits as other traffic.
+bulk_checkpoints = SQLiteCache(os.path.join(DATA_DIR, "bulk_checkpoints.db"))
+BULK_CHECKPOINT_TTL = 24 * 3600
+BULK_CHECKPOINT_BATCH = 50
+BULK_CONCURRENCY = 4
+BULK_MAX_REQUESTS = 5000
+BULK_MAX_BYTES = 10 * 1024 * 1024
+
+# Planning sessions shared by /plan_trip and /choose_trip. When running several workers,
+# use a shared backend instead, e.g. SQLiteSessionStore("sessions.db", ttl=3600).
+session_store = MemorySessionStore(ttl=3600, max_size=10000)
+
+# Hotels are searched once per destination and dates, and the budget is applied locally
+trip_planner = TripPlanner(OPENAI_API_KEY, SERPAPI_KEY, pool=http_pool, cache=response_cache, budget_independent_hotels=True,
+                           suggestion_cache=suggestion_cache, openai_upstream=openai_upstream, serpapi_upstream=serpapi_upstream,
+                           metrics=metrics, content_cache=content_cache, blob_store=blob_store, image_base_url=IMAGE_BASE_URL)
+
+# Write the daily plans of the first options in the background as soon as a plan is ready, so choosing one of them
+# is answered from memory. Set top_k to 0 to turn it off, or include_images to also generate their images.
+speculator = Speculator(trip_planner, top_k=2, include_images=False, hourly_budget=5.0)
+
+metrics.add_collector(lambda: response_cache.collect("serpapi") + suggestion_cache.collect("suggestions") + content_cache.collect("content")
+                      + request_cache.collect("requests"))
+metrics.add_collector(blob_store.collect)
+metrics.add_collector(speculator.collect)
+metrics.add_collector(lambda: openai_upstream.collect() + serpapi_upstream.collect())
+
+# Daily plans and images of chosen trips are generated by background workers, so /choose_trip answers with a job ID
+# right away. Jobs are kept in a SQLite file and resume after a restart; submissions past max_queued are rejected.
+# Chosen itineraries run before the images of itineraries returned with defer_images.
+CHOOSE_TRIP_PRIORITY = 10
+TRIP_IMAGES_PRIORITY = 0
+job_queue = SQLiteJobQueue(os.path.join(DATA_DIR, "jobs.db"), max_queued=1000, lease=600, max_attempts=3, result_ttl=3600)
+job_workers = JobWorkers(job_queue, {
+    "choose_trip": lambda payload: run_choose_trip(**payload),
+    "trip_images": lambda payload: fill_trip_images(**payload)
+}, concurrency=8, metrics=metrics)
+metrics.add_collector(job_workers.collect)
 
 class TripRequest(BaseModel):
     """
@@ -31,12 +147,34 @@ class TripRequest(BaseModel):
     start_date: str
     end_date: str
     budget: float
+    # Bounded here so out-of-range values are rejected with 422, since each extra origin, day or city multiplies the searches
+    origins: Optional[List[str]] = Field(None, max_length=trip_planner.max_origins)
+    flexible_days: int = Field(0, ge=0, le=trip_planner.max_flexible_days)
+    cities: int = Field(1, ge=1, le=trip_planner.max_route_cities)
+
+    @field_validator("origins")
+    @classmethod
+    def check_origins(cls, origins):
+        """
+        Check the origins against the airport index, so unknown codes are rejected before any search is sent.
+        
+        :param origins: list: IATA codes of the airports the trip may start from
+        :return: list: The codes in upper case
+        """
+        if origins is None:
+            return None
+        unknown = [origin for origin in origins if not trip_planner.client.airport_index.get(origin)]
+        if unknown:
+            raise ValueError(f"Unknown origin airport codes: {', '.join(unknown)}")
+        return [origin.strip().upper() for origin in origins]
 
 class TripChoice(BaseModel):
     """
     Model for trip choice input.
     """
+    plan_id: str
     choice: int
+    defer_images: bool = False
 
 @app.post("/plan_trip")
 async def plan_trip(trip_request: TripRequest):
@@ -44,54 +182,569 @@ async def plan_trip(trip_request: TripRequest):
     Endpoint to plan a trip based on user input.
     
     :param trip_request: TripRequest: User input for planning a trip
-    :return: dict: Planned trip options
+    :return: ORJSONResponse: Plan ID and the planned trip options
     """
     try:
-        trip_options = trip_planner.plan_trip(
+        try:
+            with time_budget(PLAN_TRIP_TIME_BUDGET):
+                trip_options = await shared_trip_options(trip_request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except (UpstreamError, httpx.HTTPError, asyncio.TimeoutError) as e:
+            logging.error(f"Error planning trip: {e}")
+            raise HTTPException(status_code=upstream_error_status(e), detail=str(e) or "Timed out planning the trip.")
+        session = {
+            "vacation_type": trip_request.vacation_type,
+            "start_date": trip_request.start_date,
+            "end_date": trip_request.end_date,
+            "trip_options": trip_options
+        }
+        plan_id = await session_store.create(session)
+        speculator.speculate(plan_id, session)
+        return ORJSONResponse({"plan_id": plan_id, "trip_options": trip_options})
+    except HTTPException:
+        raise
+    except Exception:
+        logging.exception("Error planning trip")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+def upstream_error_status(error):
+    """
+    Get the status code answered for a failed upstream call: 503 while its circuit breaker is open,
+    504 when it ran out of time, and 502 for any other failure or unusable answer.
+    
+    :param error: Exception: Upstream error, or an UpstreamError caused by one
+    :return: int: HTTP status code
+    """
+    cause = error.__cause__ if isinstance(error, UpstreamError) and error.__cause__ else error
+    if isinstance(cause, CircuitOpenError):
+        return 503
+    if isinstance(cause, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return 504
+    return 502
+
+def trip_request_params(trip_request):
+    """
+    Get the normalized fields that identify the shared planning run of a trip request. Multi-city routes are
+    searched within the budget, so for them the budget is part of the key.
+    
+    :param trip_request: TripRequest: User input for planning a trip
+    :return: dict: Parameters of the request cache key
+    """
+    params = {
+        "vacation_type": trip_request.vacation_type,
+        "start_date": trip_request.start_date,
+        "end_date": trip_request.end_date,
+        "origins": sorted({origin.strip().upper() for origin in trip_request.origins}) if trip_request.origins else None,
+        "flexible_days": trip_request.flexible_days,
+        "cities": trip_request.cities
+    }
+    if trip_request.cities > 1 or not trip_planner.budget_independent_hotels:
+        params["budget"] = trip_request.budget
+    return params
+
+async def shared_trip_options(trip_request):
+    """
+    Plan a trip once for all identical requests in flight or answered within the last minute. Requests are identical
+    when their normalized fields other than the budget match, and each one applies its own budget to the shared result.
+    
+    :param trip_request: TripRequest: User input for planning a trip
+    :return: list: Trip options within the budget of this request
+    """
+    params = trip_request_params(trip_request)
+    if "budget" not in params:
+        candidates = await request_cache.get_or_fetch("plan_trip", params, lambda: trip_planner.plan_trip_candidates(
+            trip_request.vacation_type,
+            trip_request.start_date,
+            trip_request.end_date,
+            params["origins"],
+            trip_request.flexible_days
+        ))
+        return trip_planner.apply_budget(candidates, trip_request.budget)
+
+    async def plan():
+        return await trip_planner.collect_trip_options(
             trip_request.vacation_type,
             trip_request.start_date,
             trip_request.end_date,
-            trip_request.budget
+            trip_request.budget,
+            params["origins"],
+            trip_request.flexible_days,
+            trip_request.cities
         )
-        if isinstance(trip_options, dict) and 'error' in trip_options:
-            raise HTTPException(status_code=400, detail=trip_options['error'])
-        return trip_options
-    except Exception as e:
-        logging.error(f"Error planning trip: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/choose_trip")
+    return list(await request_cache.get_or_fetch("plan_trip", params, plan))
+
+@app.post("/plan_trip/stream")
+async def plan_trip_stream(trip_request: TripRequest):
+    """
+    Endpoint to plan a trip and stream each trip option as newline-delimited JSON as soon as it is priced.
+    Options are stored in the session in the order they are sent, so a choice refers to that order.
+    
+    :param trip_request: TripRequest: User input for planning a trip
+    :return: StreamingResponse: A "plan" event with the plan ID, "option" events, and finally a "summary" or "error" event
+    """
+    session = {
+        "vacation_type": trip_request.vacation_type,
+        "start_date": trip_request.start_date,
+        "end_date": trip_request.end_date,
+        "trip_options": []
+    }
+    plan_id = await session_store.create(session)
+
+    async def events():
+        yield orjson.dumps({"event": "plan", "plan_id": plan_id}) + b"\n"
+        try:
+            with time_budget(PLAN_TRIP_TIME_BUDGET):
+                async for event in trip_planner.iter_trip_options(
+                    trip_request.vacation_type,
+                    trip_request.start_date,
+                    trip_request.end_date,
+                    trip_request.budget,
+                    trip_request.origins,
+                    trip_request.flexible_days,
+                    trip_request.cities
+                ):
+                    if event["event"] == "option":
+                        session["trip_options"].append(event["option"])
+                        await session_store.put(plan_id, session)
+                        event = {"event": "option", "choice": len(session["trip_options"]), "option": event["option"]}
+                    yield orjson.dumps(event) + b"\n"
+            speculator.speculate(plan_id, session)
+        except Exception as e:
+            logging.error(f"Error planning trip: {e}")
+            yield orjson.dumps({"event": "error", "detail": str(e)}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.post("/plan_trips/bulk")
+async def plan_trips_bulk(request: Request, batch_id: Optional[str] = None):
+    """
+    Endpoint to plan many trips in one call. The body is newline-delimited JSON with one TripRequest per line,
+    optionally with an "id" echoed back and an "index" that defaults to the line number. Requests that share a search
+    share one planning run, and destination, flight and hotel lookups are shared through the caches. With a batch_id,
+    every result is checkpointed, and sending the batch again answers finished lines from the checkpoint.
+    
+    :param request: Request: Request with the JSON lines body
+    :param batch_id: str: ID of the batch for checkpointing, or None to not checkpoint
+    :return: StreamingResponse: A "result" event per request in completion order, and finally a "summary" event
+    """
+    too_large = HTTPException(status_code=413, detail=f"A bulk request body is limited to {BULK_MAX_BYTES} bytes.")
+    if int(request.headers.get("content-length") or 0) > BULK_MAX_BYTES:
+        raise too_large
+    await asyncio.to_thread(bulk_checkpoints.purge_expired)
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    leaders = {}
+    results = asyncio.Queue()
+    counts = {"requests": 0, "succeeded": 0, "failed": 0, "resumed": 0}
+
+    async def lead(trip_request):
+        async with semaphore:
+            with time_budget(PLAN_TRIP_TIME_BUDGET):
+                return await shared_trip_options(trip_request)
+
+    async def plan(index, request_id, trip_request):
+        key = request_cache.make_key("bulk", trip_request_params(trip_request))
+        try:
+            leader = leaders.get(key)
+            if leader is None:
+                leader = leaders[key] = asyncio.ensure_future(lead(trip_request))
+                trip_options = await leader
+            else:
+                # Followers wait for the first request of their search, then apply their own budget to its cached result
+                await asyncio.wait([leader])
+                trip_options = await lead(trip_request)
+            session = {
+                "vacation_type": trip_request.vacation_type,
+                "start_date": trip_request.start_date,
+                "end_date": trip_request.end_date,
+                "trip_options": trip_options
+            }
+            result = {"event": "result", "index": index, "id": request_id, "status": "ok",
+                      "plan_id": await session_store.create(session), "trip_options": trip_options}
+        except Exception as e:
+            logging.error(f"Error planning trip {index} of a bulk request: {e}")
+            result = {"event": "result", "index": index, "id": request_id, "status": "error", "detail": str(e)}
+        await results.put(result)
+
+    async def schedule(number, line, tasks):
+        try:
+            item = orjson.loads(line)
+            index = item.pop("index", number)
+            request_id = item.pop("id", None)
+        except (orjson.JSONDecodeError, AttributeError) as e:
+            results.put_nowait({"event": "result", "index": number, "id": None, "status": "error", "detail": f"Invalid JSON: {e}"})
+            return
+        if counts["requests"] > BULK_MAX_REQUESTS:
+            results.put_nowait({"event": "result", "index": index, "id": request_id, "status": "error",
+                                "detail": f"A bulk request is limited to {BULK_MAX_REQUESTS} trips."})
+            return
+        if batch_id:
+            found, result, _ = await asyncio.to_thread(bulk_checkpoints.get, f"{batch_id}:{index}")
+            if found:
+                counts["resumed"] += 1
+                results.put_nowait(dict(result, resumed=True))
+                return
+        try:
+            trip_request = TripRequest(**item)
+        except (ValidationError, TypeError) as e:
+            results.put_nowait({"event": "result", "index": index, "id": request_id, "status": "error", "detail": str(e)})
+            return
+        tasks.append(asyncio.create_task(plan(index, request_id, trip_request)))
+
+    async def finish(tasks):
+        await asyncio.gather(*tasks)
+        await results.put(None)
+
+    # The body is read before the response starts, since the streaming response then listens on the connection too.
+    # Planning starts as soon as each line arrives, and only the line being received is kept.
+    tasks = []
+    pending = []
+    received = 0
+    number = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > BULK_MAX_BYTES:
+            for task in tasks + list(leaders.values()):
+                task.cancel()
+            raise too_large
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            lines[0] = b"".join(pending) + lines[0]
+            pending = []
+        for line in lines:
+            if line.strip():
+                counts["requests"] += 1
+                await schedule(number, line, tasks)
+                number += 1
+        if rest:
+            pending.append(rest)
+    buffer = b"".join(pending)
+    if buffer.strip():
+        counts["requests"] += 1
+        await schedule(number, buffer, tasks)
+    finisher = asyncio.create_task(finish(tasks))
+
+    # Successful results are checkpointed in batches, in a thread, so a large batch does not commit once per line
+    checkpoints = []
+
+    async def save_checkpoints():
+        items = [(f"{batch_id}:{result['index']}", result) for result in checkpoints]
+        checkpoints.clear()
+        if items:
+            await asyncio.to_thread(bulk_checkpoints.set_many, items, BULK_CHECKPOINT_TTL)
+
+    def checkpoint(result):
+        if batch_id and result["status"] == "ok" and not result.get("resumed"):
+            checkpoints.append(result)
+
+    async def events():
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                counts["succeeded" if result["status"] == "ok" else "failed"] += 1
+                checkpoint(result)
+                if len(checkpoints) >= BULK_CHECKPOINT_BATCH:
+                    await save_checkpoints()
+                yield orjson.dumps(result) + b"\n"
+            await save_checkpoints()
+            yield orjson.dumps(dict(counts, event="summary", searches=len(leaders))) + b"\n"
+        finally:
+            finisher.cancel()
+            for task in tasks + list(leaders.values()):
+                task.cancel()
+            # Results finished but not sent before the client went away are still checkpointed
+            while not results.empty():
+                result = results.get_nowait()
+                if result is not None:
+                    checkpoint(result)
+            await save_checkpoints()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.post("/choose_trip", status_code=202)
 async def choose_trip(trip_choice: TripChoice):
     """
-    Endpoint to choose a trip option and generate detailed plan and images.
+    Endpoint to choose a trip option and queue the generation of its detailed plan and images.
+    Poll /jobs/{job_id} or follow /jobs/{job_id}/events for the result.
     
     :param trip_choice: TripChoice: User's choice of trip option
-    :return: dict: Selected trip details with daily plan and images
+    :return: ORJSONResponse: Job ID, status and number of jobs ahead of it, with a Location header pointing at the job
     """
+    session = await session_store.get(trip_choice.plan_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Unknown or expired plan. Please plan a trip first.")
+    if not session["trip_options"]:
+        raise HTTPException(status_code=400, detail="No trip options available. Please plan a trip first.")
+    selected_trip = trip_planner.choose_trip_option(session["trip_options"], trip_choice.choice)
+    if not selected_trip:
+        raise HTTPException(status_code=400, detail="Invalid choice")
+
+    # The job carries the chosen option, so it does not depend on the session surviving until it runs
+    payload = {
+        "plan_id": trip_choice.plan_id,
+        "choice": trip_choice.choice,
+        "trip": selected_trip,
+        "vacation_type": session["vacation_type"],
+        "start_date": session["start_date"],
+        "end_date": session["end_date"],
+        "defer_images": trip_choice.defer_images
+    }
+
+    async def submit():
+        return await job_workers.submit("choose_trip", payload, priority=CHOOSE_TRIP_PRIORITY)
+
     try:
-        trip_options = trip_planner.current_trip_options
-        if not trip_options:
-            raise HTTPException(status_code=400, detail="No trip options available. Please plan a trip first.")
+        if trip_choice.defer_images:
+            job_id = await submit()
+            job = await asyncio.to_thread(job_queue.get, job_id)
+        else:
+            # Users choosing the same option of the same search share one job while it runs and shortly after.
+            # Concurrent choices wait for the first one to be queued, and a failed job is queued again.
+            params = {
+                "vacation_type": session["vacation_type"],
+                "start_date": session["start_date"],
+                "end_date": session["end_date"],
+                "option": orjson.dumps(selected_trip, option=orjson.OPT_SORT_KEYS).decode()
+            }
+            job_id = await request_cache.get_or_fetch("choose_trip", params, submit)
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            if job is None or job["status"] == "failed":
+                await request_cache.invalidate(request_cache.make_key("choose_trip", params))
+                job_id = await request_cache.get_or_fetch("choose_trip", params, submit)
+                job = await asyncio.to_thread(job_queue.get, job_id)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return ORJSONResponse({"job_id": job_id, "status": job["status"], "position": job.get("position", 0)},
+                          status_code=202, headers={"Location": f"/jobs/{job_id}"})
 
-        selected_trip = trip_planner.choose_trip_option(trip_options, trip_choice.choice)
-        if not selected_trip:
-            raise HTTPException(status_code=400, detail="Invalid choice")
+async def run_choose_trip(plan_id, choice, trip, vacation_type, start_date, end_date, defer_images=False):
+    """
+    Generate the detailed plan and images of a chosen trip option, as a background job. The job holds the option
+    and the search, so it also runs after a restart or in another server worker sharing the queue.
+    
+    :param plan_id: str: ID of the planning session
+    :param choice: int: Chosen trip option
+    :param trip: dict: Chosen trip option
+    :param vacation_type: str: Type of vacation of the search
+    :param start_date: str: Start date of the search in YYYY-MM-DD format
+    :param end_date: str: End date of the search in YYYY-MM-DD format
+    :param defer_images: bool: Return the itinerary without waiting for the images, which are queued as another job
+    :return: dict: Selected trip details with daily plan and images
+    """
+    with time_budget(CHOOSE_TRIP_TIME_BUDGET):
+        return await create_trip_details(plan_id, choice, trip, vacation_type, start_date, end_date, defer_images)
 
-        # Generate the detailed plan and images
-        month = datetime.strptime(trip_planner.current_start_date, "%Y-%m-%d").strftime('%B')
-        daily_plan = trip_planner.create_daily_plan(
+async def create_trip_details(plan_id, choice, selected_trip, vacation_type, start_date, end_date, defer_images):
+    """
+    Generate the detailed plan and images of a chosen trip option, reusing the work prepared in the background.
+    
+    :param plan_id: str: ID of the planning session
+    :param choice: int: Chosen trip option
+    :param selected_trip: dict: Chosen trip option
+    :param vacation_type: str: Type of vacation of the search
+    :param start_date: str: Start date of the search in YYYY-MM-DD format
+    :param end_date: str: End date of the search in YYYY-MM-DD format
+    :param defer_images: bool: Return the itinerary without waiting for the images, which are queued as another job
+    :return: dict: Selected trip details with daily plan and images
+    """
+    # Use the daily plan prepared in the background if there is one, otherwise generate it now.
+    # Options from a flexible search carry their own dates.
+    prepared = await speculator.claim(plan_id, choice)
+    if prepared:
+        daily_plan = prepared["daily_plan"]
+    else:
+        start_date = selected_trip.get('start_date', start_date)
+        end_date = selected_trip.get('end_date', end_date)
+        month = datetime.strptime(start_date, "%Y-%m-%d").strftime('%B')
+        daily_plan = await trip_planner.create_daily_plan(
             selected_trip['destination'],
-            trip_planner.current_vacation_type,
-            trip_planner.current_start_date,
-            trip_planner.current_end_date,
+            vacation_type,
+            start_date,
+            end_date,
             month
         )
-        selected_trip['daily_plan'] = daily_plan
-        activities = trip_planner.extract_activities(daily_plan)
-        image_urls = trip_planner.create_images(activities)
-        selected_trip['image_urls'] = image_urls
-
+    selected_trip = dict(selected_trip, daily_plan=daily_plan)
+    activities = trip_planner.extract_activities(daily_plan)
+    # Deferred images are polled from the session, so without it they are generated with the itinerary
+    session = await session_store.get(plan_id) if defer_images else None
+    if session:
+        # Return the itinerary now and let the client poll /trip_images for the images
+        session["images"] = {"choice": choice, "image_urls": [None] * len(activities), "complete": not activities}
+        await session_store.put(plan_id, session)
+        if activities:
+            await job_workers.submit("trip_images", {"plan_id": plan_id, "choice": choice, "activities": activities},
+                               priority=TRIP_IMAGES_PRIORITY)
+        selected_trip['image_urls'] = list(session["images"]["image_urls"])
+        selected_trip['images_pending'] = bool(activities)
         return selected_trip
+
+    if prepared and prepared["image_urls"] is not None:
+        image_urls = prepared["image_urls"]
+    else:
+        image_urls = await trip_planner.create_images(activities)
+    selected_trip['image_urls'] = image_urls
+
+    return selected_trip
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = 0):
+    """
+    Endpoint to poll a job. With wait, the request is held until the job is finished or the time passes.
+    
+    :param job_id: str: ID of the job
+    :param wait: float: Maximum time in seconds to wait for the job to finish, at most 30
+    :return: ORJSONResponse: Job status ("queued", "running", "done" or "failed"), position while queued, result or error
+    """
+    job = await job_workers.wait(job_id, min(max(wait, 0), 30))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return ORJSONResponse(job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Endpoint to follow a job as newline-delimited JSON events until it is finished.
+    
+    :param job_id: str: ID of the job
+    :return: StreamingResponse: A "status" event whenever the status or position changes, and finally a "done" or "failed" event
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+
+    async def events():
+        nonlocal job
+        last = None
+        while job is not None:
+            if job["status"] in ("done", "failed"):
+                yield orjson.dumps(dict(job, event=job["status"])) + b"\n"
+                return
+            state = (job["status"], job.get("position"))
+            if state != last:
+                yield orjson.dumps({"event": "status", "job_id": job_id, "status": job["status"], "position": job.get("position")}) + b"\n"
+                last = state
+            job = await job_workers.wait(job_id, 15)
+        yield orjson.dumps({"event": "failed", "job_id": job_id, "error": "Unknown or expired job."}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """
+    Endpoint to report the counters of the SerpAPI response cache, the destination suggestion cache, the daily plan
+    and image cache, the request deduplication cache, the image store, speculation and the job queue.
+    
+    :return: ORJSONResponse: Hit, miss, coalescing and eviction counters and saved upstream time per cache, image store size,
+        speculation counters, and jobs per status
+    """
+    await job_workers.refresh()
+    return ORJSONResponse({
+        "serpapi": response_cache.stats(),
+        "suggestions": suggestion_cache.stats(),
+        "content": content_cache.stats(),
+        "requests": request_cache.stats(),
+        "images": blob_store.stats(),
+        "speculation": speculator.stats(),
+        "jobs": job_workers.stats()
+    })
+
+@app.get("/images/{name}")
+async def image(name: str):
+    """
+    Endpoint to serve a generated image from the local image store. Names are content hashes, so the files never change.
+    
+    :param name: str: Name of the image
+    :return: FileResponse: The image
+    """
+    path = blob_store.path(name) if BLOB_NAME.match(name) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Endpoint to expose stage, upstream, request and cache metrics in the Prometheus text format.
+    
+    :return: PlainTextResponse: Metrics text
+    """
+    await job_workers.refresh()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/choose_trip/stream")
+async def choose_trip_stream(trip_choice: TripChoice):
+    """
+    Endpoint to choose a trip option and stream its daily plan and images as newline-delimited JSON events.
+    Image generation for each activity starts while the rest of the plan is still being written.
+    
+    :param trip_choice: TripChoice: User's choice of trip option
+    :return: StreamingResponse: "trip", "day", "activity", "image" and finally "done" or "error" events
+    """
+    session = await session_store.get(trip_choice.plan_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Unknown or expired plan. Please plan a trip first.")
+
+    selected_trip = trip_planner.choose_trip_option(session["trip_options"], trip_choice.choice)
+    if not selected_trip:
+        raise HTTPException(status_code=400, detail="Invalid choice")
+    # The plan is streamed as it is written, so work prepared in the background is not needed
+    speculator.cancel(trip_choice.plan_id)
+
+    async def events():
+        yield orjson.dumps({"event": "trip", "trip": selected_trip}) + b"\n"
+        try:
+            start_date = selected_trip.get('start_date', session["start_date"])
+            end_date = selected_trip.get('end_date', session["end_date"])
+            month = datetime.strptime(start_date, "%Y-%m-%d").strftime('%B')
+            with time_budget(CHOOSE_TRIP_TIME_BUDGET):
+                async for event in trip_planner.stream_trip_details(
+                    selected_trip['destination'],
+                    session["vacation_type"],
+                    start_date,
+                    end_date,
+                    month
+                ):
+                    yield orjson.dumps(event) + b"\n"
+        except Exception as e:
+            logging.error(f"Error choosing trip: {e}")
+            yield orjson.dumps({"event": "error", "detail": str(e)}) + b"\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+async def fill_trip_images(plan_id, choice, activities):
+    """
+    Generate the images of a chosen trip and store each one in its session slot as soon as it is ready, as a background job.
+    
+    :param plan_id: str: ID of the planning session
+    :param choice: int: Chosen trip option the images belong to
+    :param activities: list: Activities to illustrate
+    """
+    try:
+        async for position, image_url in trip_planner.iter_images(activities):
+            session = await session_store.get(plan_id)
+            if not session or session.get("images", {}).get("choice") != choice:
+                return
+            session["images"]["image_urls"][position] = image_url
+            await session_store.put(plan_id, session)
+        session = await session_store.get(plan_id)
+        if session and session.get("images", {}).get("choice") == choice:
+            session["images"]["complete"] = True
+            await session_store.put(plan_id, session)
     except Exception as e:
-        logging.error(f"Error choosing trip: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        logging.error(f"Error creating trip images: {e}")
+
+@app.get("/trip_images/{plan_id}")
+async def trip_images(plan_id: str):
+    """
+    Endpoint to poll the images of a trip chosen with deferred images.
+    
+    :param plan_id: str: ID of the planning session
+    :return: ORJSONResponse: Chosen option, image URLs with None for images not ready or failed, and whether all are done
+    """
+    session = await session_store.get(plan_id)
+    if not session or "images" not in session:
+        raise HTTPException(status_code=404, detail="No images requested for this plan.")
+    return ORJSONResponse(session["images"])
@@ -0,0 +1,255 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import asyncio
+import inspect
+import time
+
+# Upper bounds in seconds of the latency histogram buckets, from fast parsing to slow image generation
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Spans of the current request, or None when the request is not traced
+trace_spans = ContextVar("trace_spans", default=None)
+
+
+def format_labels(labels):
+    """
+    Format labels for the Prometheus text format.
+    
+    :param labels: tuple: (name, value) pairs
+    :return: str: Labels in braces, or an empty string without labels
+    """
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """
+    A class to count observations in cumulative buckets, as in a Prometheus histogram.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the Histogram empty.
+        
+        :param buckets: tuple: Sorted upper bounds of the buckets
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation within its bucket.
+        
+        :param q: float: Quantile between 0 and 1
+        :return: float: Estimated value, or 0.0 without observations
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    A class to record latency histograms and counters of the planner's stages and upstreams, and render them
+    in the Prometheus text format. Recording is a few dictionary lookups, so it can stay on in production.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the Metrics registry empty.
+        
+        :param buckets: tuple: Upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+
+    def observe(self, name, value, **labels):
+        """
+        Record an observation in a histogram.
+        
+        :param name: str: Metric name
+        :param value: float: Observed value
+        :param labels: dict: Labels of the series
+        """
+        key = (name, tuple(labels.items()))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Add to a counter.
+        
+        :param name: str: Metric name
+        :param amount: float: Amount to add
+        :param labels: dict: Labels of the series
+        """
+        key = (name, tuple(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(labels.items())))
+
+    def add_collector(self, collect):
+        """
+        Register a function whose values are read when the metrics are rendered, e.g. cache and circuit breaker state.
+        
+        :param collect: callable: Function returning (name, type, labels dict, value) tuples, where type is counter or gauge
+        """
+        self.collectors.append(collect)
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Time a stage, count its failures, and add a span to the current request trace.
+        
+        :param stage: str: Name of the stage (e.g. fetch_flights)
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if not isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+                self.increment("trip_planner_stage_errors_total", stage=stage)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("trip_planner_stage_duration_seconds", elapsed, stage=stage)
+            spans = trace_spans.get()
+            if spans is not None:
+                spans.append((stage, elapsed))
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        
+        :return: str: Metrics text
+        """
+        families = {}
+        for (name, labels), value in self.counters.items():
+            families.setdefault(name, ("counter", []))[1].append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in self.histograms.items():
+            lines = families.setdefault(name, ("histogram", []))[1]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                families.setdefault(name, (kind, []))[1].append(f"{name}{format_labels(tuple(labels.items()))} {value}")
+
+        output = []
+        for name, (kind, lines) in families.items():
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+
+def timed(stage):
+    """
+    Decorate a method of an object with a metrics attribute, so every call is timed as a stage.
+    Works for plain and coroutine methods.
+    
+    :param stage: str: Name of the stage
+    :return: callable: Decorator
+    """
+    def decorator(method):
+        if inspect.iscoroutinefunction(method):
+            @wraps(method)
+            async def wrapper(self, *args, **kwargs):
+                with self.metrics.stage(stage):
+                    return await method(self, *args, **kwargs)
+        else:
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                with self.metrics.stage(stage):
+                    return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    An ASGI middleware to time every request per route and status and count the bytes sent and received.
+    Requests sent with an X-Trace header get their stage spans back in a Server-Timing header. Streamed
+    responses only carry the spans finished before their first byte.
+    """
+
+    def __init__(self, app, metrics):
+        """
+        Initialize the MetricsMiddleware.
+        
+        :param app: ASGI application to wrap
+        :param metrics: Metrics: Registry the requests are recorded in
+        """
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        traced = any(name == b"x-trace" for name, _ in scope["headers"])
+        token = trace_spans.set([]) if traced else None
+        status = 500
+        received = 0
+        sent = 0
+
+        async def receive_counted():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if traced:
+                    timing = ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in trace_spans.get())
+                    if timing:
+                        message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", timing.encode())])
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = {"method": scope["method"], "route": route, "status": status}
+            self.metrics.observe("http_request_duration_seconds", time.perf_counter() - started, **labels)
+            self.metrics.increment("http_request_bytes_total", received, method=scope["method"], route=route)
+            self.metrics.increment("http_response_bytes_total", sent, method=scope["method"], route=route)
+            if token is not None:
+                trace_spans.reset(token)
@@ -1,33 +1,67 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True, slots=True, repr=False)
 class Flight:
     """
-    A class to represent a flight.
-    """
+    A class to represent a flight. Instances are immutable and slotted, and serialize directly to JSON with orjson.
     
-    def __init__(self, departure, arrival, price, airline, departure_time, arrival_time, duration, airplane, travel_class, flight_number):
+    :param departure: str: Departure airport name
+    :param arrival: str: Arrival airport name
+    :param price: float: Flight price
+    :param airline: str: Airline name
+    :param departure_time: str: Departure time
+    :param arrival_time: str: Arrival time
+    :param duration: int: Flight duration in minutes
+    :param airplane: str: Airplane type
+    :param travel_class: str: Travel class (e.g., Economy, Business)
+    :param flight_number: str: Flight number
+    :param origin: str: IATA code of the origin airport, set by the flexible flight search
+    :param outbound_date: str: Outbound date in YYYY-MM-DD format, set by the flexible flight search
+    :param return_date: str: Return date in YYYY-MM-DD format, set by the flexible flight search
+    """
+    departure: str
+    arrival: str
+    price: float
+    airline: str
+    departure_time: str
+    arrival_time: str
+    duration: int
+    airplane: str
+    travel_class: str
+    flight_number: str
+    origin: Optional[str] = None
+    outbound_date: Optional[str] = None
+    return_date: Optional[str] = None
+
+    @classmethod
+    def from_itinerary(cls, itinerary, **kwargs):
         """
-        Initialize the Flight object with the necessary details.
+        Build a Flight from a single itinerary of a Google Flights search.
         
-        :param departure: str: Departure airport name
-        :param arrival: str: Arrival airport name
-        :param price: float: Flight price
-        :param airline: str: Airline name
-        :param departure_time: str: Departure time
-        :param arrival_time: str: Arrival time
-        :param duration: int: Flight duration in minutes
-        :param airplane: str: Airplane type
-        :param travel_class: str: Travel class (e.g., Economy, Business)
-        :param flight_number: str: Flight number
-        """
-        self.departure = departure
-        self.arrival = arrival
-        self.price = price
-        self.airline = airline
-        self.departure_time = departure_time
-        self.arrival_time = arrival_time
-        self.duration = duration
-        self.airplane = airplane
-        self.travel_class = travel_class
-        self.flight_number = flight_number
+        :param itinerary: dict: Raw itinerary from the API, with its flight segments
+        :param kwargs: dict: Extra Flight fields such as origin and dates
+        :return: Flight: Parsed Flight object
+        """
+        flight_segments = itinerary['flights']
+        first_segment = flight_segments[0]
+        last_segment = flight_segments[-1]
+
+        return cls(
+            price=itinerary.get('price', 'Unknown'),
+            airline=first_segment.get('airline', 'Unknown'),
+            departure=first_segment['departure_airport'].get('name', 'Unknown'),
+            arrival=last_segment['arrival_airport'].get('name', 'Unknown'),
+            departure_time=first_segment['departure_airport'].get('time', 'Unknown'),
+            arrival_time=last_segment['arrival_airport'].get('time', 'Unknown'),
+            duration=sum(segment.get('duration', 0) for segment in flight_segments),
+            airplane=first_segment.get('airplane', 'Unknown'),
+            travel_class=first_segment.get('travel_class', 'Unknown'),
+            flight_number=first_segment.get('flight_number', 'Unknown'),
+            **kwargs
+        )
     
     def __repr__(self):
         """
@@ -41,25 +75,203 @@ class Flight:
                 f"flight number {self.flight_number}")
 
 
+@dataclass(frozen=True, slots=True, repr=False)
 class Hotel:
     """
-    A class to represent a hotel.
+    A class to represent a hotel. Instances are immutable and slotted, and serialize directly to JSON with orjson.
+    
+    :param name: str: Hotel name
+    :param price: float: Hotel price for the stay
     """
+    name: str
+    price: float
     
-    def __init__(self, name, price):
+    def __repr__(self):
         """
-        Initialize the Hotel object with the necessary details.
+        Return a string representation of the Hotel object.
         
-        :param name: str: Hotel name
-        :param price: float: Hotel price per night
+        :return: str: String representation of the Hotel
         """
-        self.name = name
-        self.price = price
+        return f"Hotel {self.name} at ${self.price}"
+
+
+class HotelIndex:
+    """
+    A class to represent the hotels found for a destination and dates, sorted by price.
+    """
     
+    __slots__ = ("prices", "names")
+
+    def __init__(self, prices, names):
+        """
+        Initialize the HotelIndex with hotel prices and names sorted by ascending price.
+        
+        :param prices: list: Hotel prices in ascending order
+        :param names: list: Hotel names in the same order as the prices
+        """
+        self.prices = prices
+        self.names = names
+
+    @classmethod
+    def from_properties(cls, properties):
+        """
+        Build an index from the properties of a Google Hotels search, skipping hotels without a price.
+        
+        :param properties: list: Raw hotel properties from the API
+        :return: HotelIndex: Index sorted by price
+        """
+        rows = sorted(
+            (hotel['total_rate']['extracted_lowest'], hotel['name'])
+            for hotel in properties
+            if hotel.get('total_rate', {}).get('extracted_lowest') is not None and 'name' in hotel
+        )
+        return cls([price for price, _ in rows], [name for _, name in rows])
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build an index from (price, name) rows that are already sorted by price.
+        
+        :param rows: list: Rows as produced by to_rows
+        :return: HotelIndex: Index sorted by price
+        """
+        return cls([row[0] for row in rows], [row[1] for row in rows])
+
+    def to_rows(self):
+        """
+        Convert the index to compact, JSON-serializable (price, name) rows.
+        
+        :return: list: Rows sorted by price
+        """
+        return [[price, name] for price, name in zip(self.prices, self.names)]
+
+    def best_within(self, budget):
+        """
+        Find the most expensive hotel that is still within budget.
+        
+        :param budget: float: Maximum price for the hotel
+        :return: Hotel: The matching hotel or None if every hotel is over budget
+        """
+        position = bisect_right(self.prices, budget)
+        if position == 0:
+            return None
+        return Hotel(price=self.prices[position - 1], name=self.names[position - 1])
+
+    def __len__(self):
+        return len(self.prices)
+
     def __repr__(self):
+        return f"HotelIndex of {len(self.prices)} hotels"
+
+
+def require_text(data, field, max_length=200):
+    """
+    Read a required, non-empty string field of structured model output.
+    
+    :param data: dict: Object from the model output
+    :param field: str: Name of the field
+    :param max_length: int: Longest accepted value
+    :return: str: The stripped value
+    """
+    value = data.get(field) if isinstance(data, dict) else None
+    if not isinstance(value, str) or not value.strip() or len(value) > max_length:
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return value.strip()
+
+
+@dataclass(frozen=True, slots=True)
+class Destination:
+    """
+    A class to represent a suggested destination and its nearest airport.
+    Its string form is the 'Destination - Airport (IATA)' label shown to users.
+    
+    :param name: str: Destination city and country
+    :param airport: str: Name of the nearest airport
+    :param iata_code: str: IATA code of the airport as suggested, checked against the airport index before use
+    """
+    name: str
+    airport: str
+    iata_code: str
+
+    @classmethod
+    def from_dict(cls, data):
         """
-        Return a string representation of the Hotel object.
+        Build and validate a Destination from structured model output.
         
-        :return: str: String representation of the Hotel
+        :param data: dict: Object with name, airport and iata_code
+        :return: Destination: Parsed Destination object
         """
-        return f"Hotel {self.name} at ${self.price}"
+        iata_code = require_text(data, 'iata_code', 3).upper()
+        if not iata_code.isalpha() or len(iata_code) != 3:
+            raise ValueError(f"Invalid iata_code: {iata_code!r}")
+        return cls(name=require_text(data, 'name'), airport=require_text(data, 'airport'), iata_code=iata_code)
+
+    def __str__(self):
+        return f"{self.name} - {self.airport} ({self.iata_code})"
+
+
+@dataclass(frozen=True, slots=True)
+class DayPlan:
+    """
+    A class to represent one day of a daily plan.
+    
+    :param day: int: Number of the day, starting at 1
+    :param date: str: Date in YYYY-MM-DD format
+    :param title: str: Short title of the day
+    :param activities: tuple: Short activity titles in the order of the day
+    """
+    day: int
+    date: str
+    title: str
+    activities: tuple
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build and validate a DayPlan from structured model output.
+        
+        :param data: dict: Object with day, date, title and activities
+        :return: DayPlan: Parsed DayPlan object
+        """
+        if not isinstance(data, dict) or not isinstance(data.get('day'), int) or not isinstance(data.get('activities'), list):
+            raise ValueError(f"Invalid day: {data!r}")
+        activities = tuple(activity.strip() for activity in data['activities'] if isinstance(activity, str) and activity.strip())
+        if not activities:
+            raise ValueError(f"Day {data['day']} has no activities")
+        return cls(day=data['day'], date=require_text(data, 'date', 10), title=require_text(data, 'title'), activities=activities)
+
+
+@dataclass(frozen=True, slots=True)
+class DailyPlan:
+    """
+    A class to represent the daily plan of a trip, one DayPlan per day.
+    
+    :param days: tuple: Days of the trip in order
+    """
+    days: tuple
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build and validate a DailyPlan from structured model output.
+        
+        :param data: dict: Object with a list of days
+        :return: DailyPlan: Parsed DailyPlan object
+        """
+        if not isinstance(data, dict) or not isinstance(data.get('days'), list) or not data['days']:
+            raise ValueError("The daily plan has no days")
+        return cls(days=tuple(sorted((DayPlan.from_dict(day) for day in data['days']), key=lambda day: day.day)))
+
+    def image_activities(self, limit=4):
+        """
+        Pick distinct activities to illustrate: the first activity of every day, then the second ones, and so on.
+        
+        :param limit: int: Maximum number of activities
+        :return: list: Activity titles
+        """
+        picked = []
+        for rank in range(max(len(day.activities) for day in self.days)):
+            for day in self.days:
+                if rank < len(day.activities) and len(picked) < limit and day.activities[rank] not in picked:
+                    picked.append(day.activities[rank])
+        return picked
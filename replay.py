@@ -0,0 +1,168 @@
+from urllib.parse import parse_qsl
+import asyncio
+import base64
+import hashlib
+import httpx
+import orjson
+import os
+import random
+
+# Request parameters and headers that identify the caller rather than the request, left out of fixtures
+IGNORED_PARAMS = {"api_key"}
+KEPT_HEADERS = ("content-type", "retry-after")
+
+
+def fixture_key(request):
+    """
+    Build the fixture name of a request from its method, path, query and JSON body, ignoring host and credentials,
+    so responses recorded against one host (e.g. the stub server) replay for another.
+    
+    :param request: httpx.Request: Outgoing request
+    :return: str: File name of the fixture
+    """
+    query = sorted((name, value) for name, value in parse_qsl(request.url.query.decode()) if name not in IGNORED_PARAMS)
+    try:
+        body = orjson.loads(request.content) if request.content else None
+    except orjson.JSONDecodeError:
+        body = request.content.decode(errors="replace")
+    material = orjson.dumps([request.method, request.url.path, query, body], option=orjson.OPT_SORT_KEYS)
+    slug = request.url.path.strip('/').replace('/', '_') or "root"
+    return f"{slug}-{hashlib.sha256(material).hexdigest()[:20]}.json"
+
+
+class FixtureMissingError(httpx.HTTPError):
+    """
+    Raised when a request has no recorded response to replay.
+    """
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that sends requests through another transport and saves every response to a fixture file.
+    """
+
+    def __init__(self, directory, transport=None):
+        """
+        Initialize the RecordingTransport.
+        
+        :param directory: str: Directory the fixtures are written to, created if needed
+        :param transport: httpx.AsyncBaseTransport: Transport that sends the requests, a default one if not given
+        """
+        self.directory = directory
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.recorded = 0
+        os.makedirs(directory, exist_ok=True)
+
+    async def handle_async_request(self, request):
+        response = await self.transport.handle_async_request(request)
+        # The body is decoded by aread, so content-encoding and length are not passed on
+        body = await response.aread()
+        await response.aclose()
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        fixture = {
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "headers": headers
+        }
+        try:
+            fixture["body"] = body.decode()
+        except UnicodeDecodeError:
+            fixture["body_base64"] = base64.b64encode(body).decode()
+        with open(os.path.join(self.directory, fixture_key(request)), "wb") as file:
+            file.write(orjson.dumps(fixture, option=orjson.OPT_INDENT_2))
+        self.recorded += 1
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ReplayStream(httpx.AsyncByteStream):
+    """
+    A response body that is sent line by line with the latency spread over the lines, like a streamed completion.
+    """
+
+    def __init__(self, body, delay):
+        """
+        Initialize the ReplayStream.
+        
+        :param body: bytes: Recorded body
+        :param delay: float: Total time in seconds spread over the lines
+        """
+        self.lines = body.splitlines(keepends=True)
+        self.delay = delay / max(len(self.lines), 1)
+
+    async def __aiter__(self):
+        for line in self.lines:
+            await asyncio.sleep(self.delay)
+            yield line
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that answers requests from recorded fixtures, with artificial latency and injected errors.
+    """
+
+    def __init__(self, directory, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        """
+        Initialize the ReplayTransport.
+        
+        :param directory: str: Directory of the fixtures written by RecordingTransport
+        :param latency: float: Base latency in seconds added to every response
+        :param jitter: float: Maximum random latency in seconds added on top of the base latency
+        :param error_rate: float: Share of requests, between 0 and 1, answered with an error instead of the fixture
+        :param error_status: int: Status of the injected errors, or None to inject connection errors
+        :param seed: int: Seed of the latency and error randomness, for repeatable runs
+        """
+        self.directory = directory
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.fixtures = {}
+        self.replayed = 0
+        self.injected_errors = 0
+
+    def load(self, name):
+        """
+        Read a fixture, keeping it in memory after the first read.
+        
+        :param name: str: File name of the fixture
+        :return: dict: Fixture, or None if it was never recorded
+        """
+        fixture = self.fixtures.get(name)
+        if fixture is None:
+            try:
+                with open(os.path.join(self.directory, name), "rb") as file:
+                    fixture = orjson.loads(file.read())
+            except FileNotFoundError:
+                return None
+            if "body_base64" in fixture:
+                fixture["content"] = base64.b64decode(fixture["body_base64"])
+            else:
+                fixture["content"] = fixture["body"].encode()
+            self.fixtures[name] = fixture
+        return fixture
+
+    async def handle_async_request(self, request):
+        name = fixture_key(request)
+        fixture = self.load(name)
+        if fixture is None:
+            raise FixtureMissingError(f"No recorded response for {request.method} {request.url.path} ({name})")
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.injected_errors += 1
+            await asyncio.sleep(delay)
+            if self.error_status is None:
+                raise httpx.ConnectError("Injected connection error", request=request)
+            return httpx.Response(self.error_status, json={"error": "Injected error"}, request=request)
+
+        self.replayed += 1
+        if fixture["headers"].get("content-type", "").startswith("text/event-stream"):
+            return httpx.Response(fixture["status"], headers=fixture["headers"],
+                                  stream=ReplayStream(fixture["content"], delay), request=request)
+        await asyncio.sleep(delay)
+        return httpx.Response(fixture["status"], headers=fixture["headers"], content=fixture["content"], request=request)
@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+import math
+
+
+@dataclass(frozen=True, slots=True)
+class Route:
+    """
+    A class to represent a multi-city route found by the route search.
+    
+    :param stops: tuple: Indices of the cities in visiting order
+    :param nights: tuple: Nights spent in each city, in the same order
+    :param cost: float: Estimated price of the flights and hotels of the route
+    """
+    stops: tuple
+    nights: tuple
+    cost: float
+
+
+class RouteSearch:
+    """
+    A class to find the cheapest ordered routes through several cities and the split of the nights between them,
+    from a price matrix of one-way legs and nightly hotel prices. The search is a depth-first branch and bound:
+    a partial route is dropped as soon as a lower bound on its cheapest completion is over the budget or no better
+    than the routes already found, so it stays fast as the number of cities and nights grows.
+    """
+
+    def __init__(self, outbound, inbound, legs, nightly):
+        """
+        Initialize the RouteSearch. Missing prices (None) mark flights or hotels that were not found.
+        
+        :param outbound: list: Price of the flight from the origin to each city
+        :param inbound: list: Price of the flight from each city back to the origin
+        :param legs: list: legs[i][j] is the price of the flight from city i to city j
+        :param nightly: list: Price of one night in a hotel of each city
+        """
+        self.size = len(nightly)
+        self.outbound = [math.inf if price is None else price for price in outbound]
+        self.inbound = [math.inf if price is None else price for price in inbound]
+        self.legs = [[math.inf if price is None or i == j else price for j, price in enumerate(row)] for i, row in enumerate(legs)]
+        self.nightly = [math.inf if price is None else price for price in nightly]
+        # Cheapest way to arrive in each city, from the origin or from any other city, for the lower bounds
+        self.cheapest_arrival = [
+            min([self.outbound[j]] + [self.legs[i][j] for i in range(self.size)]) for j in range(self.size)
+        ]
+
+    def search(self, stops, total_nights, budget=math.inf, limit=5, min_nights=1):
+        """
+        Find the cheapest routes visiting a number of distinct cities, keeping the best night split of each ordered route.
+        
+        :param stops: int: Number of cities to visit
+        :param total_nights: int: Nights of the whole trip
+        :param budget: float: Maximum estimated price of a route
+        :param limit: int: Maximum number of routes returned
+        :param min_nights: int: Fewest nights spent in each city
+        :return: list: Route objects sorted by estimated price
+        """
+        if stops < 1 or stops > self.size or total_nights < stops * min_nights:
+            return []
+        best = {}
+        order = sorted(range(self.size), key=lambda city: self.nightly[city])
+
+        def threshold():
+            if len(best) < limit:
+                return budget
+            return sorted(route.cost for route in best.values())[limit - 1]
+
+        def lower_bound(cost, visited, last, nights_left, stops_left):
+            if stops_left == 0:
+                return cost + self.inbound[last]
+            candidates = [city for city in order if city not in visited]
+            arrivals = sorted(self.cheapest_arrival[city] for city in candidates)[:stops_left]
+            rate = min(self.nightly[city] for city in candidates)
+            return cost + sum(arrivals) + nights_left * rate + min(self.inbound[city] for city in candidates)
+
+        def extend(cost, path, nights, nights_left):
+            last = path[-1] if path else None
+            stops_left = stops - len(path)
+            if stops_left == 0:
+                total = cost + self.inbound[last]
+                if total <= threshold() and total < math.inf:
+                    key = tuple(path)
+                    if key not in best or total < best[key].cost:
+                        best[key] = Route(key, tuple(nights), total)
+                        if len(best) > limit:
+                            del best[max(best, key=lambda key: best[key].cost)]
+                return
+            if lower_bound(cost, path, last, nights_left, stops_left) > threshold():
+                return
+            for city in order:
+                if city in path:
+                    continue
+                leg = self.outbound[city] if last is None else self.legs[last][city]
+                if leg == math.inf or self.nightly[city] == math.inf:
+                    continue
+                # The last city takes every remaining night, the others leave enough for the cities after them
+                if stops_left == 1:
+                    choices = [nights_left]
+                else:
+                    choices = range(min_nights, nights_left - (stops_left - 1) * min_nights + 1)
+                for stay in choices:
+                    next_cost = cost + leg + stay * self.nightly[city]
+                    if lower_bound(next_cost, path + [city], city, nights_left - stay, stops_left - 1) > threshold():
+                        # Longer stays here cost more, but can make the rest cheaper, so keep trying them
+                        continue
+                    extend(next_cost, path + [city], nights + [stay], nights_left - stay)
+
+        extend(0.0, [], [], total_nights)
+        return sorted(best.values(), key=lambda route: route.cost)[:limit]
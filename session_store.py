@@ -0,0 +1,115 @@
+from cache import LRUCache, SQLiteCache
+import asyncio
+import uuid
+
+
+class MemorySessionStore:
+    """
+    A class to keep planning sessions in process memory, with TTL eviction and a size cap.
+    Its methods never wait, so a session read and written back by one caller is not interleaved with another.
+    """
+    
+    def __init__(self, ttl=3600, max_size=10000):
+        """
+        Initialize the MemorySessionStore.
+        
+        :param ttl: float: Time in seconds a session is kept after it was last written
+        :param max_size: int: Maximum number of sessions, the least recently used ones are evicted first
+        """
+        self.ttl = ttl
+        self.sessions = LRUCache(max_size)
+
+    async def create(self, data):
+        """
+        Store a new session.
+        
+        :param data: dict: Session state
+        :return: str: ID of the new session
+        """
+        session_id = uuid.uuid4().hex
+        await self.put(session_id, data)
+        return session_id
+
+    async def get(self, session_id):
+        """
+        Get the state of a session.
+        
+        :param session_id: str: ID of the session
+        :return: dict: Session state or None if the session is unknown or expired
+        """
+        found, data = self.sessions.get(session_id)
+        return data if found else None
+
+    async def put(self, session_id, data):
+        """
+        Store the state of a session, replacing any previous state.
+        
+        :param session_id: str: ID of the session
+        :param data: dict: Session state
+        """
+        self.sessions.set(session_id, data, self.ttl)
+
+    async def delete(self, session_id):
+        self.sessions.pop(session_id)
+
+    def close(self):
+        self.sessions.clear()
+
+
+class SQLiteSessionStore:
+    """
+    A class to keep planning sessions in a SQLite file that several server workers can share.
+    Reads and writes run in worker threads, so waiting on the file lock of another worker does not stall the event loop.
+    """
+    
+    def __init__(self, path, ttl=3600, purge_every=1000):
+        """
+        Initialize the SQLiteSessionStore.
+        
+        :param path: str: Path of the SQLite database file shared by the workers
+        :param ttl: float: Time in seconds a session is kept after it was last written
+        :param purge_every: int: Number of writes between purges of expired sessions
+        """
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self.writes = 0
+        self.sessions = SQLiteCache(path)
+
+    async def create(self, data):
+        """
+        Store a new session.
+        
+        :param data: dict: JSON-serializable session state
+        :return: str: ID of the new session
+        """
+        session_id = uuid.uuid4().hex
+        await self.put(session_id, data)
+        return session_id
+
+    async def get(self, session_id):
+        """
+        Get the state of a session.
+        
+        :param session_id: str: ID of the session
+        :return: dict: Session state or None if the session is unknown or expired
+        """
+        found, data, _ = await asyncio.to_thread(self.sessions.get, session_id)
+        return data if found else None
+
+    async def put(self, session_id, data):
+        """
+        Store the state of a session, replacing any previous state.
+        
+        :param session_id: str: ID of the session
+        :param data: dict: JSON-serializable session state
+        """
+        await asyncio.to_thread(self.sessions.set, session_id, data, self.ttl)
+        self.writes += 1
+        if self.writes % self.purge_every == 0:
+            await asyncio.to_thread(self.sessions.purge_expired)
+
+    async def delete(self, session_id):
+        await asyncio.to_thread(self.sessions.pop, session_id)
+
+    def close(self):
+        self.sessions.close()
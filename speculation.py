@@ -0,0 +1,190 @@
+from cache import LRUCache
+from collections import deque
+from datetime import datetime
+import asyncio
+import time
+
+
+class Speculator:
+    """
+    A class to write the daily plan, and optionally the images, of the top trip options in the background right
+    after planning, so choosing one of them is answered from memory. Work for the options that are not chosen is
+    cancelled, and the estimated OpenAI spend of speculative work is capped per hour.
+    """
+
+    def __init__(self, trip_planner, top_k=2, include_images=False, hourly_budget=5.0, plan_cost=0.006,
+                 image_cost=0.02, images_per_plan=4, ttl=1800, max_size=1000):
+        """
+        Initialize the Speculator.
+        
+        :param trip_planner: TripPlanner: Planner that writes the daily plans and images
+        :param top_k: int: Number of leading trip options prepared per plan, 0 turns speculation off
+        :param include_images: bool: Also generate the images of the prepared daily plans
+        :param hourly_budget: float: Estimated cost in USD that speculative work may spend in any hour
+        :param plan_cost: float: Estimated cost in USD of one daily plan
+        :param image_cost: float: Estimated cost in USD of one image
+        :param images_per_plan: int: Number of images a daily plan is expected to need
+        :param ttl: float: Time in seconds a prepared result is kept
+        :param max_size: int: Maximum number of prepared results kept
+        """
+        self.trip_planner = trip_planner
+        self.top_k = top_k
+        self.include_images = include_images
+        self.hourly_budget = hourly_budget
+        self.plan_cost = plan_cost
+        self.image_cost = image_cost
+        self.images_per_plan = images_per_plan
+        self.results = LRUCache(max_size)
+        self.ttl = ttl
+        self.tasks = {}
+        self.charges = deque()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.over_budget = 0
+
+    def spent_last_hour(self):
+        """
+        Get the estimated cost of the speculative work started in the last hour.
+        
+        :return: float: Cost in USD
+        """
+        cutoff = time.monotonic() - 3600
+        while self.charges and self.charges[0][0] <= cutoff:
+            self.charges.popleft()
+        return sum(cost for _, cost in self.charges)
+
+    def speculate(self, plan_id, session):
+        """
+        Start preparing the top options of a planning session, as far as the hourly budget allows.
+        
+        :param plan_id: str: ID of the planning session
+        :param session: dict: Session state with the vacation type, dates and trip options
+        """
+        cost = self.plan_cost + (self.image_cost * self.images_per_plan if self.include_images else 0)
+        tasks = self.tasks.setdefault(plan_id, {})
+        for choice, option in enumerate(session["trip_options"][:self.top_k], start=1):
+            if choice in tasks:
+                continue
+            if self.spent_last_hour() + cost > self.hourly_budget:
+                self.over_budget += 1
+                break
+            self.charges.append((time.monotonic(), cost))
+            self.started += 1
+            task = asyncio.create_task(self.prepare(plan_id, choice, option, session))
+            task.add_done_callback(lambda task, plan_id=plan_id, choice=choice: self._forget(plan_id, choice, task))
+            tasks[choice] = task
+        if not tasks:
+            del self.tasks[plan_id]
+
+    async def prepare(self, plan_id, choice, option, session):
+        """
+        Write the daily plan, and optionally the images, of one trip option and keep the result.
+        
+        :param plan_id: str: ID of the planning session
+        :param choice: int: Number of the trip option
+        :param option: dict: Trip option
+        :param session: dict: Session state with the vacation type and dates
+        :return: dict: Daily plan and image URLs, or None for the images if they were not generated
+        """
+        start_date = option.get('start_date', session["start_date"])
+        end_date = option.get('end_date', session["end_date"])
+        month = datetime.strptime(start_date, "%Y-%m-%d").strftime('%B')
+        daily_plan = await self.trip_planner.create_daily_plan(
+            option['destination'], session["vacation_type"], start_date, end_date, month
+        )
+        image_urls = None
+        if self.include_images:
+            image_urls = await self.trip_planner.create_images(self.trip_planner.extract_activities(daily_plan))
+        result = {"daily_plan": daily_plan, "image_urls": image_urls}
+        self.results.set((plan_id, choice), result, self.ttl)
+        return result
+
+    async def claim(self, plan_id, choice):
+        """
+        Get the prepared result of the chosen option, waiting for it if it is still running,
+        and cancel the work for every other option of the plan.
+        
+        :param plan_id: str: ID of the planning session
+        :param choice: int: Chosen trip option
+        :return: dict: Daily plan and image URLs, or None if the option was not prepared or its preparation failed
+        """
+        tasks = self.tasks.pop(plan_id, {})
+        for other, task in tasks.items():
+            if other != choice and not task.done():
+                task.cancel()
+                self.cancelled += 1
+        for other in range(1, self.top_k + 1):
+            if other != choice:
+                self.results.pop((plan_id, other))
+
+        found, result = self.results.get((plan_id, choice))
+        if not found and choice in tasks:
+            try:
+                result = await tasks[choice]
+                found = True
+            except Exception:
+                pass
+        self.results.pop((plan_id, choice))
+        if found:
+            self.hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    def cancel(self, plan_id):
+        """
+        Cancel every speculative task of a planning session.
+        
+        :param plan_id: str: ID of the planning session
+        """
+        for task in self.tasks.pop(plan_id, {}).values():
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+
+    def cancel_all(self):
+        for plan_id in list(self.tasks):
+            self.cancel(plan_id)
+
+    def _forget(self, plan_id, choice, task):
+        # Finished results live in self.results, so only running work is tracked per plan
+        tasks = self.tasks.get(plan_id)
+        if tasks and tasks.get(choice) is task:
+            del tasks[choice]
+            if not tasks:
+                del self.tasks[plan_id]
+        if not task.cancelled() and task.exception():
+            print(f"Speculative daily plan failed: {task.exception()}")
+
+    def collect(self):
+        """
+        Read the speculation counters for the metrics endpoint.
+        
+        :return: list: (name, type, labels, value) tuples
+        """
+        return [
+            ("speculation_started_total", "counter", {}, self.started),
+            ("speculation_claims_total", "counter", {"result": "hit"}, self.hits),
+            ("speculation_claims_total", "counter", {"result": "miss"}, self.misses),
+            ("speculation_cancelled_total", "counter", {}, self.cancelled),
+            ("speculation_over_budget_total", "counter", {}, self.over_budget),
+            ("speculation_spent_last_hour_usd", "gauge", {}, self.spent_last_hour())
+        ]
+
+    def stats(self):
+        """
+        Get the speculation counters.
+        
+        :return: dict: Options prepared, choices answered from a prepared result or not, work cancelled,
+            options skipped because of the budget, and the estimated spend of the last hour
+        """
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+            "over_budget": self.over_budget,
+            "spent_last_hour": self.spent_last_hour()
+        }
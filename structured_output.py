@@ -0,0 +1,167 @@
+import orjson
+
+# Function-calling tools that make the chat completions answer with JSON arguments instead of free text
+DESTINATIONS_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "suggest_destinations",
+        "description": "Return the suggested travel destinations.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "destinations": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string", "description": "City and country, e.g. 'Barcelona, Spain'"},
+                            "airport": {"type": "string", "description": "Name of the nearest airport"},
+                            "iata_code": {"type": "string", "description": "IATA code of that airport"}
+                        },
+                        "required": ["name", "airport", "iata_code"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["destinations"],
+            "additionalProperties": False
+        }
+    }
+}
+
+DAILY_PLAN_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "daily_plan",
+        "description": "Return the daily plan of the trip, one object per day.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "days": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "day": {"type": "integer", "description": "Number of the day, starting at 1"},
+                            "date": {"type": "string", "description": "Date in YYYY-MM-DD format"},
+                            "title": {"type": "string", "description": "Title of the day, at most five words"},
+                            "activities": {
+                                "type": "array",
+                                "items": {"type": "string", "description": "Activity title, at most six words"},
+                                "maxItems": 4
+                            }
+                        },
+                        "required": ["day", "date", "title", "activities"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["days"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Output tokens per day of a daily plan (a short title and up to four short activities, as JSON) and for the rest
+DAILY_PLAN_TOKENS_PER_DAY = 100
+DAILY_PLAN_BASE_TOKENS = 60
+DAILY_PLAN_MAX_TOKENS = 3000
+
+
+def force_tool(data, tool):
+    """
+    Make a chat completion request answer by calling a tool.
+    
+    :param data: dict: OpenAI chat completion request, changed in place
+    :param tool: dict: Tool definition
+    :return: dict: The request
+    """
+    data["tools"] = [tool]
+    data["tool_choice"] = {"type": "function", "function": {"name": tool["function"]["name"]}}
+    return data
+
+
+def daily_plan_max_tokens(days):
+    """
+    Size the output limit of a daily plan to the length of the trip.
+    
+    :param days: int: Number of days of the trip
+    :return: int: max_tokens for the request
+    """
+    return min(DAILY_PLAN_BASE_TOKENS + DAILY_PLAN_TOKENS_PER_DAY * max(days, 1), DAILY_PLAN_MAX_TOKENS)
+
+
+def tool_arguments(completion):
+    """
+    Read the JSON arguments of the tool call of a chat completion.
+    
+    :param completion: dict: Chat completion response
+    :return: dict: Parsed arguments
+    """
+    try:
+        call = completion['choices'][0]['message']['tool_calls'][0]
+        return orjson.loads(call['function']['arguments'])
+    except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
+        raise ValueError(f"The response has no valid tool call: {e}")
+
+
+def tool_arguments_delta(chunk):
+    """
+    Read the piece of tool call arguments in a streamed chat completion chunk.
+    
+    :param chunk: dict: Streamed chat completion chunk
+    :return: str: Piece of the JSON arguments, empty if the chunk has none
+    """
+    choices = chunk.get('choices') or [{}]
+    calls = choices[0].get('delta', {}).get('tool_calls') or []
+    return "".join(call.get('function', {}).get('arguments') or "" for call in calls)
+
+
+class ArrayItemScanner:
+    """
+    A class to find the complete items of a JSON array while the JSON text is still being streamed,
+    e.g. each day of {"days": [{...}, {...}]} as soon as its closing brace arrives.
+    """
+
+    def __init__(self, depth=2):
+        """
+        Initialize the ArrayItemScanner.
+        
+        :param depth: int: Nesting depth of the items, 2 for the objects of an array in the top-level object
+        """
+        self.depth = depth
+        self.level = 0
+        self.in_string = False
+        self.escaped = False
+        self.item = []
+
+    def feed(self, text):
+        """
+        Scan the next piece of JSON text.
+        
+        :param text: str: Piece of JSON text
+        :return: list: Items completed within this piece, parsed
+        """
+        items = []
+        for character in text:
+            if self.level >= self.depth:
+                self.item.append(character)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif character == '\\':
+                    self.escaped = True
+                elif character == '"':
+                    self.in_string = False
+            elif character == '"':
+                self.in_string = True
+            elif character in '{[':
+                self.level += 1
+                if self.level == self.depth + 1 and character == '{':
+                    self.item = [character]
+            elif character in '}]':
+                self.level -= 1
+                if self.level == self.depth and character == '}' and self.item:
+                    items.append(orjson.loads("".join(self.item)))
+                    self.item = []
+        return items
@@ -0,0 +1,120 @@
+from benchmarks.stub_server import StubUpstreamServer
+from http_pool import HTTPPool
+from replay import RecordingTransport, ReplayTransport
+from trip_planner import TripPlanner
+from upstream import Upstream
+import asyncio
+import httpx
+import os
+import pytest
+
+# Trips planned against the stub server to record the fixtures, and replayed by the tests
+SINGLE_CITY = ("beach", "2024-07-01", "2024-07-08", 5000)
+MULTI_CITY = ("city", "2024-07-01", "2024-07-09", 6000)
+FLEXIBLE = {"origins": ["TLV", "LHR"], "flexible_days": 1}
+DAILY_PLAN = ("Barcelona, Spain", "beach", "2024-07-01", "2024-07-04", "July")
+
+
+def make_planner(transport, url="http://upstream.test", **upstream_options):
+    """
+    Create a TripPlanner whose upstream requests all go through one transport, without rate limits
+    and with short backoffs, so the tests do not wait on them.
+    
+    :param transport: httpx.AsyncBaseTransport: Transport of the upstream requests
+    :param url: str: Base URL of both upstream APIs, which the fixtures do not depend on
+    :param upstream_options: dict: Further arguments for both Upstreams
+    :return: TripPlanner: The planner
+    """
+    pool = HTTPPool(transport=transport)
+    options = dict({"rate": 1000, "burst": 1000, "backoff_base": 0.001}, **upstream_options)
+    return TripPlanner("test", "test", openai_url=url, serpapi_url=url, pool=pool, budget_independent_hotels=True,
+                       openai_upstream=Upstream("openai", url, pool, **options),
+                       serpapi_upstream=Upstream("serpapi", url, pool, **options))
+
+
+async def plan_trips(planner, single_city=SINGLE_CITY, multi_city=MULTI_CITY):
+    """
+    Plan a single-city and a multi-city trip, by default those of the fixtures.
+    
+    :param planner: TripPlanner: Planner to plan them with, closed afterwards
+    :param single_city: tuple: Vacation type, start date, end date and budget of the single-city trip
+    :param multi_city: tuple: Vacation type, start date, end date and budget of the two-city trip
+    :return: tuple: (single-city trip options, multi-city trip options)
+    """
+    try:
+        single_city = await planner.collect_trip_options(*single_city)
+        multi_city = await planner.collect_trip_options(*multi_city, cities=2)
+        return single_city, multi_city
+    finally:
+        await planner.aclose()
+
+
+async def record(planner):
+    """
+    Plan the fixture trips, also with flexible dates and origins, and stream the fixture daily plan.
+    
+    :param planner: TripPlanner: Planner to run them with, closed afterwards
+    :return: dict: Single-city, flexible and multi-city trip options, and the streamed days
+    """
+    days = [day async for day in planner.stream_daily_plan(*DAILY_PLAN)]
+    flexible = await planner.collect_trip_options(*SINGLE_CITY, **FLEXIBLE)
+    single_city, multi_city = await plan_trips(planner)
+    return {"single_city": single_city, "flexible": flexible, "multi_city": multi_city, "days": days}
+
+
+@pytest.fixture(scope="session")
+def recording(tmp_path_factory):
+    """
+    Record the upstream responses of the fixture trips and daily plan from the stub server, once per test session.
+    
+    :return: dict: Fixture directory, and the results recorded with them
+    """
+    directory = str(tmp_path_factory.mktemp("fixtures"))
+    server = StubUpstreamServer(latency=0).start()
+    try:
+        results = asyncio.run(record(make_planner(RecordingTransport(directory), server.url)))
+    finally:
+        server.shutdown()
+    return dict(results, directory=directory)
+
+
+@pytest.fixture
+def replay(recording):
+    """
+    Get a factory of transports that replay the recorded fixtures.
+    
+    :return: callable: Takes the arguments of ReplayTransport after its directory
+    """
+    return lambda **kwargs: ReplayTransport(recording["directory"], **kwargs)
+
+
+@pytest.fixture(scope="session")
+def app(recording, tmp_path_factory):
+    """
+    Import the app with its databases and image store in a temporary directory, answering upstream calls from the fixtures.
+    
+    :return: module: The main module
+    """
+    os.environ["TRIP_PLANNER_DATA_DIR"] = str(tmp_path_factory.mktemp("data"))
+    import main
+    main.http_pool.transport = ReplayTransport(recording["directory"])
+    yield main
+    asyncio.run(main.trip_planner.aclose())
+    main.job_queue.close()
+    main.bulk_checkpoints.close()
+    for cache in (main.suggestion_cache, main.content_cache):
+        cache.close()
+
+
+def call(app, requests):
+    """
+    Send requests to the app in process, without its lifespan.
+    
+    :param app: module: The main module
+    :param requests: callable: Coroutine function that takes an httpx.AsyncClient and sends the requests
+    :return: object: What requests returns
+    """
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://test", timeout=None) as client:
+            return await requests(client)
+    return asyncio.run(run())
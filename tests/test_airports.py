@@ -0,0 +1,53 @@
+from airports import AirportIndex, matches_destination
+import pytest
+
+
+@pytest.fixture(scope="module")
+def index():
+    index = AirportIndex()
+    yield index
+    index.close()
+
+
+def test_get(index):
+    airport = index.get(" mad ")
+    assert (airport.code, airport.city, airport.country) == ("MAD", "Madrid", "ES")
+    assert index.get("AAA") is not None and index.get("ZZZ") is None
+    for code in ("XQX", "MADR", "", None):
+        assert index.get(code) is None
+
+
+def test_find_city(index):
+    assert index.find_city("barcelona").code == "BCN"
+    assert index.find_city("Tel-Aviv").code == "TLV"
+    assert index.find_city("Atlantis") is None and index.find_city("") is None
+
+
+def test_find_by_name(index):
+    assert index.find_by_name("Madrid Barajas").code == "MAD"
+    assert index.find_by_name("Heathrow").code == "LHR"
+    assert index.find_by_name("Ben Gurion International Airport").code == "TLV"
+    assert index.find_by_name("Nowhere Field") is None and index.find_by_name(" - ") is None
+
+
+@pytest.mark.parametrize("destination, code, expected", [
+    ("Barcelona, Spain - Barcelona El Prat Airport (BCN)", "BCN", "BCN"),
+    ("Bali, Indonesia - Ngurah Rai International Airport (DPS)", "DPS", "DPS"),
+    ("Barcelona, Spain - El Prat (MAD)", "MAD", "BCN"),
+    ("Madrid, Spain - Barajas Airport (XQX)", "XQX", "MAD"),
+    ("London, United Kingdom - Heathrow Airport", None, "LHR"),
+    ("Barcelona, Spain", None, "BCN"),
+    ("Atlantis, Nowhere - Lost Airport (MAD)", "MAD", None),
+    ("Atlantis, Nowhere", None, None),
+])
+def test_resolve(index, destination, code, expected):
+    airport = index.resolve(destination, code)
+    assert (airport.code if airport else None) == expected
+
+
+def test_matches_destination(index):
+    madrid = index.get("MAD")
+    assert matches_destination(madrid, "Madrid, Spain")
+    assert matches_destination(madrid, "Castile, Spain", "Barajas International Airport")
+    assert not matches_destination(madrid, "Barcelona, Spain", "El Prat")
+    assert not matches_destination(madrid, "Barcelona, Spain", "Airport")
@@ -0,0 +1,30 @@
+from conftest import SINGLE_CITY, call
+import pytest
+
+TRIP = dict(zip(("vacation_type", "start_date", "end_date", "budget"), SINGLE_CITY))
+
+
+@pytest.mark.parametrize("fields", [
+    {"origins": ["xx"]},
+    {"origins": ["TLV", "ZZZ"]},
+    {"origins": ["TLV", "LHR", "JFK", "CDG"]},
+    {"flexible_days": -1},
+    {"flexible_days": 4},
+    {"cities": 0},
+    {"cities": 4}
+])
+def test_out_of_range_requests_are_rejected_before_any_search(app, fields):
+    """
+    Unknown origins and too many origins, flexible days or cities are answered with 422 without calling an upstream.
+    """
+    replayed = app.http_pool.transport.replayed
+    response = call(app, lambda client: client.post("/plan_trip", json=dict(TRIP, **fields)))
+    assert response.status_code == 422
+    assert app.http_pool.transport.replayed == replayed
+
+
+def test_origins_are_normalized(app):
+    """
+    Known origin codes are accepted in any case and with spaces.
+    """
+    assert app.TripRequest(**TRIP, origins=[" tlv", "LHR"]).origins == ["TLV", "LHR"]
@@ -0,0 +1,43 @@
+from blob_store import BlobStore
+import hashlib
+import os
+import time
+
+
+def test_files_are_named_by_their_content(tmp_path):
+    store = BlobStore(str(tmp_path))
+    name = store.put(b"image", "jpg")
+    assert name == hashlib.sha256(b"image").hexdigest() + ".jpg"
+    assert store.put(b"image", "jpg") == name
+    assert len(store) == 1 and store.total_bytes == 5
+    with open(store.path(name), "rb") as file:
+        assert file.read() == b"image"
+    assert store.path("0" * 64 + ".png") is None
+    assert os.listdir(tmp_path) == [name]
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=25)
+    first, second = store.put(b"1" * 10), store.put(b"2" * 10)
+    store.path(first)
+    third = store.put(b"3" * 10)
+    assert second not in store and first in store and third in store
+    assert not os.path.exists(os.path.join(tmp_path, second))
+    assert store.stats() == {"files": 2, "bytes": 20, "max_bytes": 25, "evictions": 1}
+
+
+def test_existing_files_are_indexed_by_last_access(tmp_path):
+    """
+    A restarted store indexes the files it finds, keeps their recency from their modification time
+    and evicts down to its limit.
+    """
+    store = BlobStore(str(tmp_path))
+    names = [store.put(bytes([index]) * 10) for index in range(3)]
+    now = time.time()
+    for age, name in zip((30, 10, 20), names):
+        os.utime(os.path.join(tmp_path, name), (now - age, now - age))
+    with open(os.path.join(tmp_path, "notes.txt"), "w") as file:
+        file.write("not a blob")
+    restarted = BlobStore(str(tmp_path), max_bytes=20)
+    assert names[0] not in restarted and names[1] in restarted and names[2] in restarted
+    assert restarted.total_bytes == 20 and os.path.exists(os.path.join(tmp_path, "notes.txt"))
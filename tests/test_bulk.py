@@ -0,0 +1,65 @@
+from conftest import SINGLE_CITY, call
+import orjson
+import pytest
+
+TRIP = dict(zip(("vacation_type", "start_date", "end_date", "budget"), SINGLE_CITY))
+
+
+def bulk(app, lines, **params):
+    """
+    Send a bulk request and read its events.
+    
+    :param lines: list: Request objects, or raw lines
+    :return: tuple: (result events sorted by index, summary event)
+    """
+    body = b"".join((line if isinstance(line, bytes) else orjson.dumps(line)) + b"\n" for line in lines)
+    response = call(app, lambda client: client.post("/plan_trips/bulk", content=body, params=params))
+    assert response.status_code == 200
+    events = [orjson.loads(line) for line in response.text.splitlines()]
+    assert events[-1]["event"] == "summary"
+    return sorted(events[:-1], key=lambda event: event["index"]), events[-1]
+
+
+def test_requests_of_one_search_follow_its_leader(app):
+    """
+    Requests that differ only in their budget share one planning run, and each gets the options within its own budget.
+    """
+    budgets = [5000, 1500, 800]
+    results, summary = bulk(app, [dict(TRIP, budget=budget, id=f"trip-{budget}") for budget in budgets] + [b"not json"])
+    assert summary["searches"] == 1
+    assert (summary["requests"], summary["succeeded"], summary["failed"]) == (4, 3, 1)
+    assert [result["id"] for result in results[:3]] == ["trip-5000", "trip-1500", "trip-800"]
+    assert results[3]["detail"].startswith("Invalid JSON")
+    for result, budget in zip(results, budgets):
+        assert all(option["total_price"] <= budget for option in result["trip_options"])
+
+
+def test_batch_resumes_from_its_checkpoints(app):
+    """
+    Sending a batch again answers the finished lines from their checkpoints, and plans only the others.
+    """
+    first, _ = bulk(app, [TRIP, dict(TRIP, start_date="bad")], batch_id="resume")
+    assert [result["status"] for result in first] == ["ok", "error"]
+    again, summary = bulk(app, [TRIP, dict(TRIP, start_date="bad")], batch_id="resume")
+    assert (summary["resumed"], summary["searches"]) == (1, 1)
+    assert again[0]["resumed"] and again[0]["trip_options"] == first[0]["trip_options"]
+    assert again[1]["status"] == "error"
+    _, other = bulk(app, [TRIP], batch_id="other")
+    assert other["resumed"] == 0
+
+
+def test_large_bodies_are_rejected(app, monkeypatch):
+    """
+    Bodies over BULK_MAX_BYTES are answered with 413, whether or not they announce their length.
+    """
+    monkeypatch.setattr(app, "BULK_MAX_BYTES", 200)
+    body = orjson.dumps(TRIP) + b"\n"
+
+    async def chunks():
+        for _ in range(5):
+            yield body
+
+    for content in (body * 5, chunks()):
+        response = call(app, lambda client: client.post("/plan_trips/bulk", content=content))
+        assert response.status_code == 413
+    assert bulk(app, [TRIP])[1]["succeeded"] == 1
@@ -0,0 +1,96 @@
+from cache import ResponseCache
+import asyncio
+import pytest
+
+
+def test_concurrent_lookups_share_one_fetch():
+    """
+    Concurrent lookups of one key call the upstream once, and later lookups are answered from memory.
+    """
+    cache = ResponseCache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"price": 100}
+
+    async def lookups():
+        results = await asyncio.gather(*(cache.get_or_fetch("search", {"q": "Nice"}, fetch) for _ in range(10)))
+        return results + [await cache.get_or_fetch("search", {"q": " NICE "}, fetch)]
+
+    assert asyncio.run(lookups()) == [{"price": 100}] * 11
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["memory_hits"]) == (1, 9, 1)
+
+
+def test_failed_fetch_is_shared_but_not_cached():
+    """
+    A failed fetch fails every caller waiting for it, and the next lookup fetches again.
+    """
+    cache = ResponseCache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise ValueError("upstream down")
+        return "ok"
+
+    async def lookups():
+        results = await asyncio.gather(*(cache.get_or_fetch("search", {"q": "x"}, fetch) for _ in range(3)), return_exceptions=True)
+        return results, await cache.get_or_fetch("search", {"q": "x"}, fetch)
+
+    failures, result = asyncio.run(lookups())
+    assert all(isinstance(failure, ValueError) for failure in failures)
+    assert result == "ok" and len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_fetch():
+    """
+    A caller that gives up leaves the shared fetch running for the others.
+    """
+    cache = ResponseCache()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    async def lookups():
+        impatient = asyncio.ensure_future(cache.get_or_fetch("search", {"q": "x"}, fetch))
+        patient = asyncio.ensure_future(cache.get_or_fetch("search", {"q": "x"}, fetch))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        return await patient
+
+    assert asyncio.run(lookups()) == "ok"
+    assert cache.stats()["coalesced"] == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    """
+    Values written to the disk tier are found by a new cache on the same file, and concurrent lookups read it once.
+    """
+    path = str(tmp_path / "cache.db")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return {"price": 100}
+
+    async def lookups(cache):
+        try:
+            return await asyncio.gather(*(cache.get_or_fetch("search", {"q": "Nice"}, fetch) for _ in range(5)))
+        finally:
+            cache.close()
+
+    first, restarted = ResponseCache(disk_path=path), ResponseCache(disk_path=path)
+    assert asyncio.run(lookups(first)) == [{"price": 100}] * 5
+    assert asyncio.run(lookups(restarted)) == [{"price": 100}] * 5
+    assert len(calls) == 1
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["coalesced"], stats["misses"], stats["size"]) == (1, 4, 0, 1)
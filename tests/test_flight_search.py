@@ -0,0 +1,107 @@
+from conftest import FLEXIBLE, SINGLE_CITY, make_planner
+from flight_search import FlightTable, date_window
+from models import Destination
+import asyncio
+import numpy as np
+
+
+def itinerary(price, duration=240, stops=0, departure="2024-07-01 08:00"):
+    """
+    Build a Google Flights itinerary with one segment per flight.
+    """
+    segments = [{"departure_airport": {"time": departure}, "arrival_airport": {"time": "2024-07-01 12:00"}, "duration": duration // (stops + 1)}
+                for _ in range(stops + 1)]
+    return {"price": price, "flights": segments, "total_duration": duration}
+
+
+def table(*rows):
+    """
+    Build a FlightTable from (origin, destination, outbound date, return date, itineraries) rows.
+    """
+    return FlightTable.from_results([row[:4] + ({"best_flights": row[4]},) for row in rows])
+
+
+def test_date_window():
+    """
+    The window lists every date within flexible_days, across month ends.
+    """
+    assert date_window("2024-07-01", 0) == ["2024-07-01"]
+    assert date_window("2024-07-01", 2) == ["2024-06-29", "2024-06-30", "2024-07-01", "2024-07-02", "2024-07-03"]
+
+
+def test_from_results_keeps_priced_itineraries():
+    """
+    Itineraries without a price or flights are left out, and missing durations are summed from the segments.
+    """
+    results = [("TLV", "BCN", "2024-07-01", "2024-07-08", {
+        "best_flights": [itinerary(300), {"price": "n/a", "flights": [{}]}, {"price": 200, "flights": []}],
+        "other_flights": [dict(itinerary(250, 300, stops=1), total_duration=None), {"price": 100}]
+    })]
+    flights = FlightTable.from_results(results)
+    assert len(flights) == 2
+    assert flights.prices.tolist() == [300, 250]
+    assert flights.durations.tolist() == [240, 300] and flights.stops.tolist() == [0, 1]
+    assert str(flights.outbound_dates[1]) == "2024-07-01" and flights.origins[1] == "TLV"
+
+
+def test_rank_picks_the_cheapest_per_destination_within_limits():
+    """
+    Each destination gets its cheapest itinerary within budget, duration and stops.
+    """
+    flights = table(
+        ("TLV", "BCN", "2024-07-01", "2024-07-08", [itinerary(500), itinerary(300, 600, stops=2)]),
+        ("LHR", "BCN", "2024-07-02", "2024-07-08", [itinerary(400, 300, stops=1)]),
+        ("TLV", "NCE", "2024-07-01", "2024-07-08", [itinerary(700)])
+    )
+    assert flights.rank() == {"BCN": 1, "NCE": 3}
+    assert flights.rank(budget=600) == {"BCN": 1}
+    assert flights.rank(max_duration=400) == {"BCN": 2, "NCE": 3}
+    assert flights.rank(max_stops=0) == {"BCN": 0, "NCE": 3}
+    assert flights.rank(budget=450, max_stops=1, max_duration=250) == {}
+    flight = flights.flight(2)
+    assert (flight.origin, flight.outbound_date, flight.return_date, flight.price) == ("LHR", "2024-07-02", "2024-07-08", 400)
+
+
+def test_rank_breaks_ties_on_duration_then_order():
+    """
+    On equal price the shorter flight wins, and on equal price and duration the first one found.
+    """
+    flights = table(("TLV", "BCN", "2024-07-01", "2024-07-08", [itinerary(300, 500), itinerary(300, 400), itinerary(300, 400)]))
+    assert flights.rank() == {"BCN": 1}
+
+
+def test_empty_table():
+    """
+    No results, or none with a price, give an empty table and no ranking.
+    """
+    for results in ([], [("TLV", "BCN", "2024-07-01", "2024-07-08", {})]):
+        flights = FlightTable.from_results(results)
+        assert len(flights) == 0 and flights.rank() == {}
+        assert flights.prices.dtype == np.float64
+
+
+def test_flexible_flight_is_the_cheapest_combination(recording, replay):
+    """
+    The flexible search sends one search per origin and date pair, and keeps the cheapest of them within budget.
+    """
+    vacation_type, start_date, end_date, _ = SINGLE_CITY
+    transport = replay()
+    planner = make_planner(transport)
+    destination = Destination("Barcelona, Spain", "Barcelona El Prat Airport", "BCN")
+
+    async def search():
+        try:
+            flights = await planner.client.search_flight_combinations(["BCN"], FLEXIBLE["origins"], start_date, end_date, FLEXIBLE["flexible_days"])
+            searches = transport.replayed
+            best = await planner.fetch_flexible_flight(destination, start_date, end_date, 5000, **FLEXIBLE)
+            too_cheap = await planner.fetch_flexible_flight(destination, start_date, end_date, flights.prices.min() - 1, **FLEXIBLE)
+            return flights, searches, best, too_cheap
+        finally:
+            await planner.aclose()
+
+    flights, searches, best, too_cheap = asyncio.run(search())
+    assert searches == 2 * 3 * 3
+    assert best.price == flights.prices.min()
+    assert best.origin in FLEXIBLE["origins"] and best.outbound_date in date_window(start_date, 1)
+    assert too_cheap is None
+    assert any(option["flight"].price == best.price for option in recording["flexible"] if "Barcelona" in option["destination"])
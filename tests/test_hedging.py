@@ -0,0 +1,125 @@
+from conftest import make_planner
+from replay import ReplayTransport
+import asyncio
+import httpx
+import pytest
+import time
+
+ENDPOINT = ("GET", "/search", "response")
+
+
+class SlowReplayTransport(ReplayTransport):
+    """
+    A ReplayTransport whose requests take the given latencies in turn, the last one repeated, and time out
+    at the read timeout of the request like a network transport.
+    """
+
+    def __init__(self, directory, latencies):
+        super().__init__(directory)
+        self.latencies = latencies
+        self.sent = []
+        self.timeouts = []
+        self.cancelled = 0
+
+    async def handle_async_request(self, request):
+        latency = self.latencies[min(len(self.sent), len(self.latencies) - 1)]
+        timeout = request.extensions["timeout"]["read"]
+        self.sent.append(time.perf_counter())
+        self.timeouts.append(timeout)
+        try:
+            await asyncio.sleep(min(latency, timeout))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if latency > timeout:
+            raise httpx.ReadTimeout("Timed out", request=request)
+        return await super().handle_async_request(request)
+
+
+def make_search(recording, latencies, **upstream_options):
+    """
+    Create a planner whose searches take the given latencies, and a recorded flight search to send with it.
+    
+    :param latencies: list: Latency in seconds of each request in turn
+    :return: tuple: (TripPlanner, SlowReplayTransport, coroutine function running the search)
+    """
+    transport = SlowReplayTransport(recording["directory"], latencies)
+    planner = make_planner(transport, **upstream_options)
+    params = planner.client.flight_search_params("TLV", "BCN", "2024-07-01", "2024-07-08")
+    return planner, transport, lambda: planner.client.search(params)
+
+
+async def warm_up(search, count=20):
+    await asyncio.gather(*(search() for _ in range(count)))
+
+
+def test_slow_searches_are_hedged_after_the_p95(recording):
+    """
+    A second copy is only sent once a search is slower than the recent p95, the first answer wins
+    and the losing copy is cancelled.
+    """
+    latencies = [0.05] * 20 + [0.04, 1.0, 0.01]
+    planner, transport, search = make_search(recording, latencies, hedge_quantile=0.95)
+    serpapi = planner.client.serpapi
+
+    async def searches():
+        try:
+            await warm_up(search)
+            fast = await search()
+            started = time.perf_counter()
+            slow = await search()
+            return fast, slow, time.perf_counter() - started
+        finally:
+            await planner.aclose()
+
+    fast, slow, elapsed = asyncio.run(searches())
+    assert fast == slow and fast["best_flights"]
+    assert len(transport.sent) == 23 and serpapi.stats()["requests"] == 23
+    assert (serpapi.hedges, serpapi.hedge_wins) == (1, 1)
+    assert transport.sent[22] - transport.sent[21] >= 0.05 * 0.9
+    assert elapsed < 0.5
+    assert transport.cancelled == 1
+
+
+def test_hedges_wait_for_enough_latencies(recording):
+    """
+    Without enough recent latencies there is no p95, so a slow search is never hedged.
+    """
+    planner, transport, search = make_search(recording, [0.2], hedge_quantile=0.95)
+
+    async def slow_search():
+        try:
+            return await search()
+        finally:
+            await planner.aclose()
+
+    assert asyncio.run(slow_search())["best_flights"]
+    assert len(transport.sent) == 1 and planner.client.serpapi.hedges == 0
+
+
+def test_timeouts_follow_three_times_the_p99(recording):
+    """
+    Once the latency window is full, attempts time out at 3x the recent p99, so a stuck search is retried
+    long before the timeout given with the request.
+    """
+    latencies = [0.02] * 19 + [0.05] + [1.0, 0.02]
+    planner, transport, search = make_search(recording, latencies, min_timeout=0.01, max_retries=1)
+    serpapi = planner.client.serpapi
+
+    async def searches():
+        try:
+            await warm_up(search)
+            started = time.perf_counter()
+            result = await search()
+            return result, time.perf_counter() - started
+        finally:
+            await planner.aclose()
+
+    result, elapsed = asyncio.run(searches())
+    assert result["best_flights"]
+    assert len(transport.sent) == 22 and serpapi.stats()["retries"] == 1
+    assert transport.timeouts[:20] == [planner.client.request_timeout] * 20
+    assert transport.timeouts[20] == pytest.approx(3 * 0.05, rel=0.3)
+    # The timed out attempt counts as a latency of its timeout, so the retry waits longer
+    assert transport.timeouts[21] == pytest.approx(3 * transport.timeouts[20])
+    assert elapsed < 1.0
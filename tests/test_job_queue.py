@@ -0,0 +1,112 @@
+from job_queue import JobWorkers, QueueFullError, SQLiteJobQueue
+import asyncio
+import pytest
+import time
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / "jobs.db"), max_queued=3, lease=60, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def expire_leases(queue):
+    queue.connection.execute("UPDATE jobs SET lease_until = ? WHERE status = 'running'", (time.time() - 1,))
+    queue.connection.commit()
+
+
+def test_claims_by_priority_then_order(queue):
+    """
+    Jobs are claimed by priority, first in first out within a priority, and each only once while its lease runs.
+    """
+    first = queue.put("choose_trip", {"n": 1})
+    second = queue.put("choose_trip", {"n": 2})
+    urgent = queue.put("choose_trip", {"n": 3}, priority=1)
+    assert queue.get(second)["position"] == 2
+    assert [queue.claim()["job_id"] for _ in range(3)] == [urgent, first, second]
+    assert queue.claim() is None
+    assert queue.counts()["running"] == 3
+
+
+def test_expired_lease_is_taken_over_then_given_up(queue):
+    """
+    A job whose worker stopped is claimed again once its lease expires, and failed after max_attempts.
+    """
+    job_id = queue.put("choose_trip", {"n": 1})
+    assert queue.claim()["attempts"] == 1
+    assert queue.claim() is None
+    expire_leases(queue)
+    job = queue.claim()
+    assert job["job_id"] == job_id and job["attempts"] == 2 and job["payload"] == {"n": 1}
+    expire_leases(queue)
+    assert queue.claim() is None
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_release_puts_the_job_back_without_an_attempt(queue):
+    """
+    A job released on shutdown is queued again, and its interrupted run is not counted.
+    """
+    job_id = queue.put("choose_trip", {})
+    queue.claim()
+    queue.release(job_id)
+    assert queue.get(job_id)["status"] == "queued"
+    assert queue.claim()["attempts"] == 1
+
+
+def test_results_and_limits(queue):
+    """
+    Finished jobs keep their result until it expires, and a full queue rejects new jobs.
+    """
+    done = queue.put("choose_trip", {})
+    failed = queue.put("choose_trip", {})
+    queue.claim()
+    queue.claim()
+    queue.complete(done, {"trip": "ok"})
+    queue.fail(failed, "No luck")
+    assert queue.get(done)["result"] == {"trip": "ok"}
+    assert queue.get(failed)["error"] == "No luck"
+
+    for _ in range(3):
+        queue.put("choose_trip", {})
+    with pytest.raises(QueueFullError):
+        queue.put("choose_trip", {})
+
+    queue.result_ttl = 0
+    assert queue.get(done) is None
+    assert queue.purge_expired() == 2
+
+
+def test_workers_run_jobs_and_release_them_when_stopped(queue):
+    """
+    Workers store results and errors, count jobs without blocking the loop, and put cancelled jobs back in the queue.
+    """
+    started = asyncio.Event()
+
+    async def slow(payload):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def echo(payload):
+        if payload.get("fail"):
+            raise ValueError("No luck")
+        return payload
+
+    async def run():
+        workers = JobWorkers(queue, {"echo": echo, "slow": slow}, concurrency=2, poll_interval=0.01)
+        done = await workers.submit("echo", {"n": 1})
+        failed = await workers.submit("echo", {"fail": True})
+        assert (await workers.wait(done, 5))["result"] == {"n": 1}
+        assert (await workers.wait(failed, 5))["error"] == "No luck"
+        slow_id = await workers.submit("slow", {})
+        await asyncio.wait_for(started.wait(), 5)
+        await workers.refresh()
+        assert workers.stats()["jobs"]["running"] == 1
+        assert ("job_queue_jobs", "gauge", {"status": "done"}, 1) in workers.collect()
+        await workers.stop()
+        return slow_id, workers
+
+    slow_id, workers = asyncio.run(run())
+    assert queue.get(slow_id)["status"] == "queued" and queue.get(slow_id)["attempts"] == 0
+    assert workers.running == set() and (workers.completed, workers.failed) == (1, 1)
@@ -0,0 +1,74 @@
+from metrics import Histogram, Metrics, MetricsMiddleware, timed
+import asyncio
+import httpx
+import pytest
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram((0.1, 0.5, 1.0))
+    assert histogram.quantile(0.5) == 0.0
+    for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert (histogram.count, histogram.sum) == (5, pytest.approx(3.15))
+    assert histogram.quantile(0.4) == pytest.approx(0.1)
+    assert histogram.quantile(0.5) == pytest.approx(0.1 + 0.4 * 0.5)
+    assert histogram.quantile(1.0) == 1.0
+
+
+class Stages:
+    def __init__(self):
+        self.metrics = Metrics()
+
+    @timed("parse")
+    def parse(self, text):
+        return int(text)
+
+    @timed("fetch")
+    async def fetch(self, delay):
+        await asyncio.sleep(delay)
+        return delay
+
+
+def test_timed_records_stages_and_errors():
+    """
+    Plain and coroutine methods are timed, and failures are counted without hiding the error.
+    """
+    stages = Stages()
+    assert stages.parse("3") == 3
+    with pytest.raises(ValueError):
+        stages.parse("three")
+    assert asyncio.run(stages.fetch(0.02)) == 0.02
+    assert stages.metrics.histogram("trip_planner_stage_duration_seconds", stage="parse").count == 2
+    fetch = stages.metrics.histogram("trip_planner_stage_duration_seconds", stage="fetch")
+    assert fetch.count == 1 and fetch.sum >= 0.02
+    assert stages.metrics.counters == {("trip_planner_stage_errors_total", (("stage", "parse"),)): 1}
+    rendered = stages.metrics.render()
+    assert '# TYPE trip_planner_stage_errors_total counter' in rendered
+    assert 'trip_planner_stage_duration_seconds_bucket{stage="parse",le="+Inf"} 2' in rendered
+
+
+def test_traced_requests_get_server_timing():
+    """
+    Requests with an X-Trace header get the spans of their stages in a Server-Timing header, others do not.
+    """
+    stages = Stages()
+
+    async def app(scope, receive, send):
+        await stages.fetch(0.01)
+        stages.parse("1")
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def requests():
+        transport = httpx.ASGITransport(app=MetricsMiddleware(app, stages.metrics))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/", headers={"X-Trace": "1"}), await client.get("/")
+
+    traced, untraced = asyncio.run(requests())
+    spans = [span.split(";dur=") for span in traced.headers["server-timing"].split(", ")]
+    assert [stage for stage, _ in spans] == ["fetch", "parse"]
+    assert float(spans[0][1]) >= 10
+    assert "server-timing" not in untraced.headers
+    requests_seen = stages.metrics.histogram("http_request_duration_seconds", method="GET", route="unmatched", status=200)
+    assert requests_seen.count == 2
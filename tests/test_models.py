@@ -0,0 +1,42 @@
+from models import DailyPlan, DayPlan, Hotel, HotelIndex
+import pytest
+
+DAY = {"day": 1, "date": "2024-07-01", "title": "Old town", "activities": ["Walking tour", " ", 3]}
+
+
+def test_day_plan_keeps_valid_activities():
+    """
+    Blank and non-text activities are dropped from a valid day.
+    """
+    assert DayPlan.from_dict(DAY) == DayPlan(day=1, date="2024-07-01", title="Old town", activities=("Walking tour",))
+
+
+@pytest.mark.parametrize("day", [None, 1, "Day 1", ["Walking tour"], dict(DAY, day="1"), dict(DAY, activities=[]), dict(DAY, title=None)])
+def test_invalid_days_raise_value_error(day):
+    """
+    Days that are not objects or miss a field are rejected with ValueError, which the parsers report or skip.
+    """
+    with pytest.raises(ValueError):
+        DayPlan.from_dict(day)
+    with pytest.raises(ValueError):
+        DailyPlan.from_dict({"days": [DAY, day]})
+
+
+def test_best_hotel_within_budget():
+    """
+    The most expensive hotel within the budget is chosen, hotels without a price are skipped.
+    """
+    index = HotelIndex.from_properties([
+        {"name": "Grand", "total_rate": {"extracted_lowest": 900}},
+        {"name": "Hostel", "total_rate": {"extracted_lowest": 100}},
+        {"name": "No price", "total_rate": {}},
+        {"name": "Inn", "total_rate": {"extracted_lowest": 400}},
+        {"total_rate": {"extracted_lowest": 50}}
+    ])
+    assert index.names == ["Hostel", "Inn", "Grand"]
+    assert index.best_within(400) == Hotel(price=400, name="Inn")
+    assert index.best_within(899.99) == Hotel(price=400, name="Inn")
+    assert index.best_within(10000) == Hotel(price=900, name="Grand")
+    assert index.best_within(99) is None
+    assert HotelIndex.from_properties([]).best_within(1000) is None
+    assert HotelIndex.from_rows(index.to_rows()).best_within(500) == Hotel(price=400, name="Inn")
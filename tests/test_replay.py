@@ -0,0 +1,38 @@
+from conftest import SINGLE_CITY, make_planner, plan_trips
+from replay import FixtureMissingError
+from upstream import UpstreamError
+import asyncio
+import pytest
+
+
+def test_replay_plans_the_recorded_trips(recording, replay):
+    """
+    Replaying the fixtures plans the same trips as the stub server did.
+    """
+    single_city, multi_city = recording["single_city"], recording["multi_city"]
+    assert single_city and multi_city
+    assert all(len(option["stops"]) == 2 for option in multi_city)
+    transport = replay()
+    assert asyncio.run(plan_trips(make_planner(transport))) == (single_city, multi_city)
+    assert transport.replayed > 0 and transport.injected_errors == 0
+
+
+def test_replay_retries_injected_errors(recording, replay):
+    """
+    Injected 503s are retried by the upstreams, so the plans do not change.
+    """
+    single_city, multi_city = recording["single_city"], recording["multi_city"]
+    transport = replay(error_rate=0.2, seed=7)
+    planner = make_planner(transport, max_retries=5, failure_threshold=100)
+    assert asyncio.run(plan_trips(planner)) == (single_city, multi_city)
+    assert transport.injected_errors > 0
+    assert planner.client.serpapi.stats()["retries"] + planner.client.openai.stats()["retries"] == transport.injected_errors
+
+
+def test_replay_without_fixture_fails(replay):
+    """
+    A request that was never recorded fails instead of reaching the network.
+    """
+    with pytest.raises(UpstreamError) as error:
+        asyncio.run(plan_trips(make_planner(replay()), ("desert",) + SINGLE_CITY[1:]))
+    assert isinstance(error.value.__cause__, FixtureMissingError)
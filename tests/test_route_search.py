@@ -0,0 +1,98 @@
+from conftest import plan_trips, make_planner
+from itertools import permutations
+from route_search import RouteSearch
+import asyncio
+import math
+import pytest
+import random
+import trip_planner
+
+
+def brute_force(search, stops, total_nights, budget=math.inf, min_nights=1):
+    """
+    Price every ordered route with every night split, for comparison with the pruned search.
+    
+    :return: dict: Cheapest price of each ordered route within budget
+    """
+    def splits(cities, nights):
+        if cities == 1:
+            yield (nights,)
+            return
+        for stay in range(min_nights, nights - (cities - 1) * min_nights + 1):
+            for rest in splits(cities - 1, nights - stay):
+                yield (stay,) + rest
+
+    best = {}
+    for path in permutations(range(search.size), stops):
+        flights = search.outbound[path[0]] + sum(search.legs[i][j] for i, j in zip(path, path[1:])) + search.inbound[path[-1]]
+        for nights in splits(stops, total_nights):
+            cost = flights + sum(stay * search.nightly[city] for city, stay in zip(path, nights))
+            if cost <= budget and cost < best.get(path, math.inf):
+                best[path] = cost
+    return best
+
+
+def assert_optimal(search, stops, total_nights, budget=math.inf, limit=5, min_nights=1):
+    """
+    Check that the pruned search returns the cheapest routes, each with its cheapest night split.
+    """
+    best = brute_force(search, stops, total_nights, budget, min_nights)
+    routes = search.search(stops, total_nights, budget, limit, min_nights)
+    assert [route.cost for route in routes] == pytest.approx(sorted(best.values())[:limit])
+    for route in routes:
+        assert sum(route.nights) == total_nights and min(route.nights) >= min_nights
+        assert route.cost == pytest.approx(best[route.stops])
+
+
+def test_search_is_optimal_on_the_recorded_prices(recording, replay, monkeypatch):
+    """
+    On the route matrix of the replayed multi-city trip, pruning keeps the cheapest routes for any number of cities and budget.
+    """
+    searches = []
+
+    class RecordedRouteSearch(RouteSearch):
+        def search(self, *args, **kwargs):
+            searches.append(self)
+            return super().search(*args, **kwargs)
+
+    monkeypatch.setattr(trip_planner, "RouteSearch", RecordedRouteSearch)
+    asyncio.run(plan_trips(make_planner(replay())))
+    search = searches[-1]
+    assert search.size == 5
+    cheapest = min(brute_force(search, 2, 8).values())
+    for stops in (1, 2, 3):
+        for budget in (math.inf, cheapest, cheapest + 100, cheapest - 1):
+            assert_optimal(search, stops, 8, budget)
+    assert_optimal(search, 3, 8, min_nights=2, limit=3)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_search_is_optimal_on_random_prices(seed):
+    """
+    Pruning keeps the cheapest routes on random prices, with missing flights and hotels.
+    """
+    rng = random.Random(seed)
+    size = rng.randint(2, 6)
+
+    def price(low, high):
+        return None if rng.random() < 0.1 else rng.uniform(low, high)
+
+    search = RouteSearch(
+        outbound=[price(100, 600) for _ in range(size)],
+        inbound=[price(100, 600) for _ in range(size)],
+        legs=[[price(30, 300) for _ in range(size)] for _ in range(size)],
+        nightly=[price(40, 300) for _ in range(size)]
+    )
+    for stops in range(1, min(size, 3) + 1):
+        assert_optimal(search, stops, rng.randint(stops, 10), limit=rng.randint(1, 5))
+        assert_optimal(search, stops, 2 * stops + 2, budget=rng.uniform(500, 3000), min_nights=2)
+
+
+def test_search_without_enough_nights_or_cities():
+    """
+    Asking for more cities than there are, or than the nights allow, finds no route.
+    """
+    search = RouteSearch(outbound=[100, 200], inbound=[100, 200], legs=[[None, 50], [50, None]], nightly=[80, 90])
+    assert search.search(3, 6) == []
+    assert search.search(2, 3, min_nights=2) == []
+    assert [route.stops for route in search.search(2, 4)] == [(0, 1), (1, 0)]
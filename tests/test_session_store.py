@@ -0,0 +1,113 @@
+from session_store import MemorySessionStore, SQLiteSessionStore
+import asyncio
+import pytest
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            store = MemorySessionStore(**kwargs)
+        else:
+            store = SQLiteSessionStore(str(tmp_path / "sessions.db"), **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_sessions_are_stored_replaced_and_deleted(make_store):
+    store = make_store()
+    session = {"vacation_type": "beach", "trip_options": [{"destination": "Nice, France", "total_price": 1200}]}
+
+    async def use():
+        first, second = await store.create(session), await store.create({"vacation_type": "city"})
+        assert first != second
+        assert await store.get(first) == session and await store.get(second) == {"vacation_type": "city"}
+        await store.put(first, {"vacation_type": "ski"})
+        assert await store.get(first) == {"vacation_type": "ski"}
+        await store.delete(first)
+        assert await store.get(first) is None and await store.get(second) is not None
+        assert await store.get("unknown") is None
+
+    asyncio.run(use())
+
+
+def test_sessions_expire(make_store):
+    store = make_store(ttl=0.05)
+
+    async def use():
+        session_id = await store.create({"vacation_type": "beach"})
+        assert await store.get(session_id) is not None
+        await asyncio.sleep(0.1)
+        assert await store.get(session_id) is None
+
+    asyncio.run(use())
+
+
+def test_memory_store_evicts_the_least_recently_used():
+    store = MemorySessionStore(max_size=2)
+
+    async def use():
+        first, second = await store.create({"n": 1}), await store.create({"n": 2})
+        await store.get(first)
+        third = await store.create({"n": 3})
+        assert await store.get(second) is None
+        assert await store.get(first) == {"n": 1} and await store.get(third) == {"n": 3}
+
+    asyncio.run(use())
+
+
+def test_sqlite_store_is_shared_and_purged(tmp_path):
+    """
+    Workers opening the same file see each other's sessions, and expired rows are purged every purge_every writes.
+    """
+    path = str(tmp_path / "sessions.db")
+    writer, reader = SQLiteSessionStore(path, ttl=0.05, purge_every=3), SQLiteSessionStore(path)
+    stored = lambda session_id: writer.sessions.connection.execute("SELECT COUNT(*) FROM cache WHERE key = ?", (session_id,)).fetchone()[0]
+
+    async def use():
+        session_id = await writer.create({"vacation_type": "beach"})
+        assert await reader.get(session_id) == {"vacation_type": "beach"}
+        await asyncio.sleep(0.1)
+        await writer.create({"n": 2})
+        assert stored(session_id) == 1
+        await writer.create({"n": 3})
+        assert stored(session_id) == 0
+
+    try:
+        asyncio.run(use())
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_sqlite_store_does_not_block_the_event_loop(tmp_path):
+    """
+    While another worker holds the write lock of the file, a write waits in a thread and the event loop keeps running.
+    """
+    path = str(tmp_path / "sessions.db")
+    store, other = SQLiteSessionStore(path), SQLiteSessionStore(path)
+
+    async def write_while_locked():
+        other.sessions.connection.execute("BEGIN IMMEDIATE")
+        write = asyncio.ensure_future(store.create({"vacation_type": "beach"}))
+        ticks = 0
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not write.done()
+        other.sessions.connection.commit()
+        return ticks, await write
+
+    try:
+        ticks, session_id = asyncio.run(write_while_locked())
+        assert ticks == 10
+        assert asyncio.run(other.get(session_id)) == {"vacation_type": "beach"}
+    finally:
+        store.close()
+        other.close()
@@ -0,0 +1,78 @@
+from speculation import Speculator
+import asyncio
+
+SESSION = {
+    "vacation_type": "beach", "start_date": "2024-07-01", "end_date": "2024-07-04",
+    "trip_options": [{"destination": f"City {number}"} for number in range(1, 4)]
+}
+
+
+class SlowPlanner:
+    """
+    Stand-in for the TripPlanner that writes a daily plan after a delay and counts the plans it finished.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.started = []
+        self.finished = []
+
+    async def create_daily_plan(self, destination, vacation_type, start_date, end_date, month):
+        self.started.append(destination)
+        await asyncio.sleep(self.delay)
+        self.finished.append(destination)
+        return f"Plan for {destination} in {month}"
+
+
+def test_claim_waits_for_the_choice_and_cancels_the_others():
+    planner = SlowPlanner()
+    speculator = Speculator(planner, top_k=3)
+
+    async def plan_and_choose():
+        speculator.speculate("plan", SESSION)
+        await asyncio.sleep(0)
+        result = await speculator.claim("plan", 2)
+        await asyncio.sleep(planner.delay * 2)
+        return result, await speculator.claim("other", 1)
+
+    result, missing = asyncio.run(plan_and_choose())
+    assert result == {"daily_plan": "Plan for City 2 in July", "image_urls": None}
+    assert missing is None
+    assert planner.started == ["City 1", "City 2", "City 3"] and planner.finished == ["City 2"]
+    assert speculator.stats() | {"spent_last_hour": 0} == {
+        "started": 3, "hits": 1, "misses": 1, "cancelled": 2, "over_budget": 0, "spent_last_hour": 0
+    }
+    assert not speculator.tasks and len(speculator.results) == 0
+
+
+def test_finished_results_are_answered_from_memory():
+    planner = SlowPlanner(delay=0)
+    speculator = Speculator(planner, top_k=2)
+
+    async def plan_and_choose_later():
+        speculator.speculate("plan", SESSION)
+        await asyncio.sleep(0.01)
+        return await speculator.claim("plan", 1)
+
+    assert asyncio.run(plan_and_choose_later())["daily_plan"] == "Plan for City 1 in July"
+    assert planner.finished == ["City 1", "City 2"] and speculator.cancelled == 0
+
+
+def test_spend_is_capped_per_hour():
+    """
+    Options are only prepared while their estimated cost fits in the hourly budget, images included.
+    """
+    planner = SlowPlanner(delay=0)
+    speculator = Speculator(planner, top_k=3, include_images=True, hourly_budget=0.2, plan_cost=0.01,
+                            image_cost=0.02, images_per_plan=4)
+
+    async def plan_twice():
+        speculator.speculate("first", SESSION)
+        speculator.speculate("second", SESSION)
+        speculator.cancel_all()
+
+    asyncio.run(plan_twice())
+    assert speculator.started == 2
+    assert speculator.over_budget == 2
+    assert abs(speculator.spent_last_hour() - 0.18) < 1e-9
+    assert "second" not in speculator.tasks
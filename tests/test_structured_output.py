@@ -0,0 +1,62 @@
+from structured_output import ArrayItemScanner, tool_arguments_delta
+import orjson
+import os
+
+
+def recorded_arguments(directory):
+    """
+    Read the tool call arguments of the recorded streamed daily plan, piece by piece.
+    
+    :param directory: str: Fixture directory
+    :return: list: Pieces of the JSON arguments, as they were streamed
+    """
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as file:
+            fixture = orjson.loads(file.read())
+        if fixture["headers"].get("content-type", "").startswith("text/event-stream"):
+            return [
+                tool_arguments_delta(orjson.loads(line[len("data:"):]))
+                for line in fixture["body"].splitlines()
+                if line.startswith("data:") and line.strip() != "data: [DONE]"
+            ]
+    raise AssertionError("No streamed response was recorded")
+
+
+def scan(pieces):
+    scanner = ArrayItemScanner()
+    return [item for piece in pieces for item in scanner.feed(piece)]
+
+
+def test_scanner_finds_the_recorded_days(recording):
+    """
+    The days found while the recorded daily plan streams are the days of the complete plan, for any piece size.
+    """
+    pieces = recorded_arguments(recording["directory"])
+    text = "".join(pieces)
+    days = orjson.loads(text)["days"]
+    assert len(days) == len(recording["days"]) == 4
+    assert scan(pieces) == days
+    for size in (1, 2, 7, 64, len(text)):
+        assert scan([text[start:start + size] for start in range(0, len(text), size)]) == days
+
+
+def test_scanner_ignores_brackets_in_strings():
+    """
+    Braces, brackets and escaped quotes inside strings neither open nor close items.
+    """
+    days = [
+        {"day": 1, "title": 'Say "hi" {to} [everyone]', "activities": ["a}", "b]", "\\", '\\"']},
+        {"day": 2, "title": "Nested", "activities": [{"name": "c", "tags": ["x", "y"]}]}
+    ]
+    text = orjson.dumps({"days": days}).decode()
+    assert scan(text) == days
+
+
+def test_scanner_waits_for_the_closing_brace():
+    """
+    A day is only returned once its object is complete, and a truncated last day is never returned.
+    """
+    scanner = ArrayItemScanner()
+    assert scanner.feed('{"days": [{"day": 1, "activities": ["a"]') == []
+    assert scanner.feed('}, {"day": 2, "activ') == [{"day": 1, "activities": ["a"]}]
+    assert scanner.feed('ities": ["b"') == []
@@ -0,0 +1,126 @@
+from http_pool import HTTPPool
+from upstream import CircuitOpenError, DeadlineExceededError, LatencyWindow, Upstream, time_budget
+import asyncio
+import httpx
+import pytest
+
+
+def make_upstream(statuses, **kwargs):
+    """
+    Create an Upstream whose requests are answered with the given statuses in turn, the last one repeated.
+    
+    :param statuses: list: Statuses, or exceptions to raise, in the order of the requests
+    :param kwargs: dict: Further arguments for Upstream
+    :return: tuple: (Upstream, list of the requests it sent)
+    """
+    sent = []
+
+    def handle(request):
+        sent.append(request)
+        status = statuses[min(len(sent), len(statuses)) - 1]
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status, headers={"Retry-After": "0"} if status == 429 else {})
+
+    options = dict({"rate": 1000, "burst": 1000, "backoff_base": 0.001}, **kwargs)
+    pool = HTTPPool(transport=httpx.MockTransport(handle))
+    return Upstream("test", "http://upstream.test", pool, **options), sent
+
+
+def test_retries_until_success():
+    """
+    5xx, 429 and connection errors are retried, and the first good response is returned.
+    """
+    upstream, sent = make_upstream([503, httpx.ConnectError("refused"), 429, 200])
+    response = asyncio.run(upstream.get("/search"))
+    assert response.status_code == 200
+    assert len(sent) == 4
+    assert upstream.stats()["retries"] == 3
+    assert upstream.breaker.state == "closed"
+
+
+def test_gives_up_after_max_retries():
+    """
+    After max_retries, the last failed response is returned, and client errors are not retried.
+    """
+    upstream, sent = make_upstream([502], max_retries=2)
+    assert asyncio.run(upstream.get("/search")).status_code == 502
+    assert len(sent) == 3
+
+    upstream, sent = make_upstream([404])
+    assert asyncio.run(upstream.get("/search")).status_code == 404
+    assert len(sent) == 1
+
+
+def test_circuit_opens_and_recovers(monkeypatch):
+    """
+    Consecutive failures open the circuit, which rejects requests without sending them until a trial succeeds.
+    """
+    upstream, sent = make_upstream([503, 503, 503, 200], max_retries=0, failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        assert asyncio.run(upstream.get("/search")).status_code == 503
+    assert upstream.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(upstream.get("/search"))
+    assert len(sent) == 3 and upstream.stats()["rejected"] == 1
+
+    upstream.breaker.opened_at -= 60
+    assert upstream.breaker.state == "half_open"
+    assert asyncio.run(upstream.get("/search")).status_code == 200
+    assert upstream.breaker.state == "closed"
+
+
+def test_rate_limit_responses_do_not_open_the_circuit():
+    """
+    429 means the quota is used up, not that the upstream is down.
+    """
+    upstream, _ = make_upstream([429], max_retries=0, failure_threshold=1)
+    assert asyncio.run(upstream.get("/search")).status_code == 429
+    assert upstream.breaker.state == "closed"
+
+
+def test_spent_time_budget_stops_requests():
+    """
+    A request whose time budget has run out is not sent, and counts as deadline exceeded.
+    """
+    upstream, sent = make_upstream([200])
+
+    async def request():
+        with time_budget(0):
+            await upstream.get("/search")
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(request())
+    assert sent == [] and upstream.stats()["deadline_exceeded"] == 1
+
+
+def test_latency_window_keeps_the_recent_latencies():
+    window = LatencyWindow(size=100, min_samples=10)
+    for value in range(9):
+        window.observe(value / 100)
+    assert window.quantile(0.99) is None
+    for value in range(9, 300):
+        window.observe(value / 100)
+    assert len(window.samples) == 100
+    assert window.quantile(0) == 2.0
+    assert window.quantile(0.5) == 2.5
+    assert window.quantile(0.99) == 2.99 and window.quantile(1.0) == 2.99
+
+
+def test_timeouts_follow_the_recent_p99():
+    """
+    Attempts time out at a multiple of the recent p99 of their endpoint, within the minimum and the given timeout.
+    """
+    upstream, _ = make_upstream([200], min_timeout=0.5)
+    window = LatencyWindow(size=100, min_samples=20)
+    assert upstream.timeout(window, 10) == 10
+    for _ in range(100):
+        window.observe(0.3)
+    assert upstream.timeout(window, 10) == pytest.approx(0.9)
+    assert upstream.timeout(window, 0.6) == 0.6
+    for _ in range(100):
+        window.observe(0.1)
+    assert upstream.timeout(window, 10) == 0.5
+
+    upstream, _ = make_upstream([200], timeout_multiplier=None)
+    assert upstream.timeout(window, 10) == 10
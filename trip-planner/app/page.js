@@ -10,6 +10,7 @@ export default function Home() {
   const [budget, setBudget] = useState('');
   const [vacationType, setVacationType] = useState('');
   const [tripOptions, setTripOptions] = useState([]);
+  const [planId, setPlanId] = useState(null);
   const [selectedTrip, setSelectedTrip] = useState(null);
   const [loading, setLoading] = useState(false);
   const [minStartDate, setMinStartDate] = useState('');
@@ -60,7 +61,8 @@ export default function Home() {
         end_date: endDate,
         budget: parseFloat(budget),
       });
-      setTripOptions(response.data);
+      setPlanId(response.data.plan_id);
+      setTripOptions(response.data.trip_options);
       setLoading(false);
       setShowForm(false); // Hide form after receiving trip options
     } catch (error) {
@@ -74,9 +76,19 @@ export default function Home() {
     setLoading(true);
     try {
       const response = await axios.post('http://localhost:8000/choose_trip', {
+        plan_id: planId,
         choice: index + 1,
       });
-      setSelectedTrip(response.data);
+      // The plan is generated by a background job; long-poll it until it is finished
+      let job = response.data;
+      while (job.status === 'queued' || job.status === 'running') {
+        const poll = await axios.get(`http://localhost:8000/jobs/${job.job_id}`, { params: { wait: 25 } });
+        job = poll.data;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+      setSelectedTrip(job.result);
       setLoading(false);
     } catch (error) {
       console.error('Error selecting trip:', error);
@@ -196,8 +208,13 @@ export default function Home() {
                   <div className={styles.tripOptionDestination}>{option.destination}</div>
                   <div className={styles.tripOptionPrice}>${option.total_price}</div>
                   <div className={styles.tripOptionDetails}>
-                    <p><strong>Flight:</strong> {option.flight.airline} at ${option.flight.price}</p>
-                    <p><strong>Hotel:</strong> {option.hotel.name} at ${option.hotel.price} per night</p>
+                    {/* Multi-city options list one flight per leg and one hotel per stay */}
+                    {[].concat(option.flight).map((flight, leg) => (
+                      <p key={`flight-${leg}`}><strong>Flight:</strong> {flight.airline} at ${flight.price}</p>
+                    ))}
+                    {[].concat(option.hotel).map((hotel, stay) => (
+                      <p key={`hotel-${stay}`}><strong>Hotel:</strong> {hotel.name} at ${hotel.price} per stay</p>
+                    ))}
                   </div>
                 </button>
               </li>
@@ -221,17 +238,23 @@ export default function Home() {
           <h1 className={styles.title}>Trip Details</h1>
           <p className={styles.detail}><strong>Destination:</strong> {selectedTrip.destination}</p>
           <p className={styles.detail}><strong>Total Cost:</strong> ${selectedTrip.total_price}</p>
-          <p className={styles.detail}><strong>Flight:</strong> {selectedTrip.flight.airline} at ${selectedTrip.flight.price}</p>
-          <p className={styles.detail}><strong>Hotel:</strong> {selectedTrip.hotel.name} at ${selectedTrip.hotel.price} per stay</p>
+          {[].concat(selectedTrip.flight).map((flight, leg) => (
+            <p key={`flight-${leg}`} className={styles.detail}><strong>Flight:</strong> {flight.airline} at ${flight.price}</p>
+          ))}
+          {[].concat(selectedTrip.hotel).map((hotel, stay) => (
+            <p key={`hotel-${stay}`} className={styles.detail}><strong>Hotel:</strong> {hotel.name} at ${hotel.price} per stay</p>
+          ))}
           <h2 className={styles.subtitle}>Daily Plan</h2>
           <ul className={styles.dailyPlanList}>
-            {selectedTrip.daily_plan.split('\n').map((item, index) => (
-              <li key={index} className={styles.dailyPlanItem}>{item}</li>
+            {selectedTrip.daily_plan.days.map((day) => (
+              <li key={day.day} className={styles.dailyPlanItem}>
+                <strong>Day {day.day} ({day.date}): {day.title}</strong> - {day.activities.join(', ')}
+              </li>
             ))}
           </ul>
           <h2 className={styles.subtitle}>Images</h2>
           <div className={styles.imageContainer}>
-            {selectedTrip.image_urls.map((url, index) => (
+            {selectedTrip.image_urls.filter(Boolean).map((url, index) => (
               <img key={index} src={url} alt={`Trip image ${index + 1}`} className={styles.image} />
             ))}
           </div>
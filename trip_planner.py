@@ -1,29 +1,94 @@
-from api_client import APIClient
-from models import Flight, Hotel
-from datetime import datetime
-import requests
+from api_client import APIClient, DEFAULT_ORIGIN
+from http_pool import HTTPPool
+from metrics import timed
+from models import DailyPlan, DayPlan, Flight, Hotel
+from route_search import RouteSearch
+from structured_output import ArrayItemScanner, DAILY_PLAN_TOOL, daily_plan_max_tokens, force_tool, tool_arguments, tool_arguments_delta
+from upstream import remaining_time
+from datetime import date, datetime, timedelta
+import asyncio
+import httpx
+import math
+import orjson
+
+IMAGE_SIZE = "1024x1024"
+IMAGE_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
 
 class TripPlanner:
     """
     A class to plan trips by fetching flight and hotel information, creating daily plans, and generating images for activities.
     """
     
-    def __init__(self, openai_api_key, serpapi_key):
+    def __init__(self, openai_api_key, serpapi_key, openai_url="https://api.openai.com", serpapi_url="https://serpapi.com",
+                 request_timeout=30, destination_timeout=45, planning_deadline=60, pool=None, cache=None,
+                 budget_independent_hotels=False, image_concurrency=4, image_timeout=60, suggestion_cache=None,
+                 max_flexible_days=3, max_flight_duration=None, max_stops=None, openai_upstream=None, serpapi_upstream=None,
+                 metrics=None, content_cache=None, blob_store=None, image_base_url="/images", max_route_cities=3,
+                 min_nights_per_city=2, max_origins=3):
         """
         Initialize the TripPlanner with OpenAI and SerpAPI keys.
         
         :param openai_api_key: str: API key for OpenAI
         :param serpapi_key: str: API key for SerpAPI
+        :param openai_url: str: Base URL of the OpenAI API
+        :param serpapi_url: str: Base URL of SerpAPI
+        :param request_timeout: float: Timeout in seconds for a single upstream request
+        :param destination_timeout: float: Time in seconds allowed for the flight and hotel lookups of one destination
+        :param planning_deadline: float: Time in seconds allowed for pricing all destinations of a trip
+        :param pool: HTTPPool: Shared connection pool, a private one is created if not given
+        :param cache: ResponseCache: Cache for SerpAPI search responses, or None to always go upstream
+        :param budget_independent_hotels: bool: Search hotels without a price limit and pick within budget locally
+        :param image_concurrency: int: Maximum number of image generations running at once
+        :param image_timeout: float: Time in seconds allowed for a single image generation
+        :param suggestion_cache: ResponseCache: Cache for destination suggestions per vacation type and month
+        :param max_flexible_days: int: Upper bound on the flexible days of a request, which sets the number of flight searches
+        :param max_flight_duration: int: Longest outbound flight in minutes accepted by the flexible search, or None for no limit
+        :param max_stops: int: Most outbound stops accepted by the flexible search, or None for no limit
+        :param openai_upstream: Upstream: Rate limits, retries and circuit breaker for OpenAI, default ones if not given
+        :param serpapi_upstream: Upstream: Rate limits, retries and circuit breaker for SerpAPI, default ones if not given
+        :param metrics: Metrics: Registry the stage latencies and errors are recorded in, a private one if not given
+        :param content_cache: ResponseCache: Cache of daily plans and stored images keyed on their normalized prompts,
+            or None to generate them for every choice
+        :param blob_store: BlobStore: Local store the generated images are downloaded to once, used with content_cache.
+            Without it the temporary image URLs of the OpenAI API are returned.
+        :param image_base_url: str: URL the files of blob_store are served under
+        :param max_route_cities: int: Most cities a multi-city trip may visit
+        :param min_nights_per_city: int: Fewest nights a multi-city trip spends in each city
+        :param max_origins: int: Upper bound on the origins of a request, which multiplies the number of flight searches
         """
-        self.client = APIClient(openai_api_key, serpapi_key)
-        self.current_trip_options = []
-        self.current_vacation_type = ""
-        self.current_start_date = ""
-        self.current_end_date = ""
+        self.pool = pool or HTTPPool(timeout=request_timeout)
+        self.client = APIClient(openai_api_key, serpapi_key, openai_url, serpapi_url, request_timeout, self.pool, cache,
+                                budget_independent_hotels, suggestion_cache,
+                                openai_upstream=openai_upstream, serpapi_upstream=serpapi_upstream, metrics=metrics)
         self.openai_api_key = openai_api_key 
         self.serpapi_key = serpapi_key        
+        self.openai_url = openai_url.rstrip('/')
+        # OpenAI calls made here share the rate limiter and circuit breaker of the API client
+        self.openai = self.client.openai
+        self.metrics = self.client.metrics
+        self.request_timeout = request_timeout
+        self.destination_timeout = destination_timeout
+        self.planning_deadline = planning_deadline
+        self.image_timeout = image_timeout
+        self.max_flexible_days = max_flexible_days
+        self.max_flight_duration = max_flight_duration
+        self.max_stops = max_stops
+        self.image_semaphore = asyncio.Semaphore(image_concurrency)
+        self.content_cache = content_cache
+        self.blob_store = blob_store
+        self.image_base_url = image_base_url.rstrip('/')
+        self.budget_independent_hotels = budget_independent_hotels
+        self.max_route_cities = max_route_cities
+        self.min_nights_per_city = min_nights_per_city
+        self.max_origins = max_origins
+
+    async def aclose(self):
+        """
+        Close the pooled upstream connections.
+        """
+        await self.pool.aclose()
 
-    def plan_trip(self, vacation_type, start_date, end_date, budget):
+    async def plan_trip(self, vacation_type, start_date, end_date, budget, origins=None, flexible_days=0, cities=1):
         """
         Plan a trip based on the vacation type, dates, and budget.
         
@@ -31,70 +96,472 @@ class TripPlanner:
         :param start_date: str: Start date of the trip in YYYY-MM-DD format
         :param end_date: str: End date of the trip in YYYY-MM-DD format
         :param budget: float: Total budget for the trip
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :param cities: int: Number of cities to visit, more than one plans multi-city routes
         :return: list: List of trip options or a dictionary with an error message
         """
-        month = datetime.strptime(start_date, "%Y-%m-%d").strftime('%B')
-        self.current_vacation_type = vacation_type
-        self.current_start_date = start_date
-        self.current_end_date = end_date
         try:
-            destinations = self.client.suggest_destinations(vacation_type, month)
-            trip_options = []
-            for destination in destinations:
-                try:
-                    flight = self.client.fetch_flights(destination, start_date, end_date)
-                    if not flight:
-                        print(f"No flight found for destination: {destination}")
-                        continue
-
-                    remaining_budget = budget - flight.price
-                    hotel = self.client.fetch_hotel(destination, start_date, end_date, remaining_budget)
-                    if not hotel:
-                        print(f"No hotel found within budget for destination: {destination}")
-                        continue
-
-                    total_price = flight.price + hotel.price
-                    trip_options.append((destination, flight, hotel, total_price))
-                except Exception as e:
-                    print(f"Error planning trip to {destination}: {e}")
-                    continue
-
-            if not trip_options:
-                print("No suitable trip options found within the budget.")
-                return []
-
-            self.current_trip_options = self.show_trip_options(trip_options)
-            return self.current_trip_options
+            return await self.collect_trip_options(vacation_type, start_date, end_date, budget, origins, flexible_days, cities)
         except Exception as e:
             print(f"Error suggesting destinations: {e}")
             return {"error": str(e)}
 
+    async def collect_trip_options(self, vacation_type, start_date, end_date, budget, origins=None, flexible_days=0, cities=1):
+        """
+        Plan a trip like plan_trip, but raise its errors: ValueError for a request that cannot be planned,
+        UpstreamError when the destinations or a multi-city route could not be searched.
+        
+        :param vacation_type: str: Type of vacation (e.g., beach, adventure)
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param budget: float: Total budget for the trip
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :param cities: int: Number of cities to visit, more than one plans multi-city routes
+        :return: list: Trip options in the order of the suggested destinations
+        """
+        trip_options = []
+        async for event in self.iter_trip_options(vacation_type, start_date, end_date, budget, origins, flexible_days, cities):
+            if event["event"] == "option":
+                trip_options.append((event["position"], event["option"]))
+
+        if not trip_options:
+            print("No suitable trip options found within the budget.")
+            return []
+
+        return [option for _, option in sorted(trip_options, key=lambda item: item[0])]
+
+    async def iter_trip_options(self, vacation_type, start_date, end_date, budget, origins=None, flexible_days=0, cities=1):
+        """
+        Plan a trip and yield each trip option as soon as its flight and hotel are priced.
+        Multi-city options are yielded together once the routes are searched and priced.
+        
+        :param vacation_type: str: Type of vacation (e.g., beach, adventure)
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param budget: float: Total budget for the trip
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :param cities: int: Number of cities to visit, more than one plans multi-city routes
+        :return: async iterator: "option" events in completion order, then one "summary" event with the skipped destinations
+        """
+        if cities > 1:
+            if flexible_days:
+                raise ValueError("Flexible dates are not supported for multi-city trips.")
+            if cities > self.max_route_cities:
+                raise ValueError(f"A multi-city trip can visit at most {self.max_route_cities} cities.")
+        month = datetime.strptime(start_date, "%Y-%m-%d").strftime('%B')
+        destinations = await self.client.suggest_destinations(vacation_type, month)
+
+        if cities > 1:
+            origin = origins[0].strip().upper() if origins else DEFAULT_ORIGIN
+            trip_options, skipped = await asyncio.wait_for(
+                self.plan_routes(destinations, start_date, end_date, budget, cities, origin), remaining_time(self.planning_deadline)
+            )
+            for position, trip_option in enumerate(trip_options):
+                yield {"event": "option", "position": position, "option": trip_option}
+            yield {"event": "summary", "destinations": len(destinations), "options": len(trip_options), "skipped": skipped}
+            return
+
+        skipped = []
+        options = 0
+        async for position, destination, trip_option, reason in self.iter_priced_destinations(destinations, start_date, end_date, budget, origins, flexible_days):
+            if trip_option is None:
+                print(f"Skipped trip to {destination}: {reason}")
+                skipped.append({"destination": str(destination), "reason": reason})
+                continue
+            options += 1
+            yield {"event": "option", "position": position, "option": self.show_trip_options([trip_option])[0]}
+        yield {"event": "summary", "destinations": len(destinations), "options": options, "skipped": skipped}
+
+    @timed("price_destination")
+    async def price_destination(self, destination, start_date, end_date, budget, origins=None, flexible_days=0):
+        """
+        Look up the cheapest flight and the best hotel within budget for a single destination.
+        The hotel search starts as soon as the flight price is known, since it sets the hotel budget.
+        
+        :param destination: Destination: Destination as suggested by the API client
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param budget: float: Total budget for the trip
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :return: tuple: (destination, flight, hotel, total price)
+        """
+        flight = await self.fetch_destination_flight(destination, start_date, end_date, budget, origins, flexible_days)
+        if flight.outbound_date:
+            start_date, end_date = flight.outbound_date, flight.return_date
+
+        remaining_budget = budget - flight.price
+        hotel = await self.client.fetch_hotel(destination, start_date, end_date, remaining_budget)
+        if not hotel:
+            raise Exception(f"No hotel found within budget for destination: {destination}")
+
+        total_price = flight.price + hotel.price
+        return (destination, flight, hotel, total_price)
+
+    async def fetch_destination_flight(self, destination, start_date, end_date, budget=math.inf, origins=None, flexible_days=0):
+        """
+        Find the cheapest round trip to a destination, on the requested dates or within flexible_days of them.
+        
+        :param destination: Destination: Destination as suggested by the API client
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param budget: float: Maximum price of a flexible flight
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :return: Flight: Cheapest flight, with its origin and dates set by the flexible search
+        """
+        if origins or flexible_days:
+            flight = await self.fetch_flexible_flight(destination, start_date, end_date, budget, origins, flexible_days)
+        else:
+            flight = await self.client.fetch_flights(destination, start_date, end_date)
+        if not flight:
+            raise Exception(f"No flight found for destination: {destination}")
+        return flight
+
+    async def price_destination_candidate(self, destination, start_date, end_date, origins=None, flexible_days=0):
+        """
+        Look up the cheapest flight and every hotel of a destination, so any budget can be applied to them afterwards.
+        
+        :param destination: Destination: Destination as suggested by the API client
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :return: tuple: (destination, flight, hotel index)
+        """
+        flight = await self.fetch_destination_flight(destination, start_date, end_date, math.inf, origins, flexible_days)
+        if flight.outbound_date:
+            start_date, end_date = flight.outbound_date, flight.return_date
+        hotel_index = await self.client.fetch_hotel_index(destination, start_date, end_date)
+        return (destination, flight, hotel_index)
+
+    async def plan_trip_candidates(self, vacation_type, start_date, end_date, origins=None, flexible_days=0):
+        """
+        Plan a trip without a budget: the cheapest flight and every hotel of each destination that could be priced.
+        Requests that differ only in their budget can share the result and apply their budget with apply_budget.
+        Needs budget_independent_hotels, since hotels are searched without a price limit.
+        
+        :param vacation_type: str: Type of vacation (e.g., beach, adventure)
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :return: list: (destination, flight, hotel index) tuples in the order of the suggested destinations
+        """
+        month = datetime.strptime(start_date, "%Y-%m-%d").strftime('%B')
+        destinations = await self.client.suggest_destinations(vacation_type, month)
+
+        candidates = []
+        async for position, destination, candidate, reason in self.iter_priced_destinations(
+            destinations, start_date, end_date, math.inf, origins, flexible_days,
+            price=lambda destination: self.price_destination_candidate(destination, start_date, end_date, origins, flexible_days)
+        ):
+            if candidate is None:
+                print(f"Skipped trip to {destination}: {reason}")
+                continue
+            candidates.append((position, candidate))
+        return [candidate for _, candidate in sorted(candidates, key=lambda item: item[0])]
+
+    def apply_budget(self, candidates, budget):
+        """
+        Turn budget-independent candidates into trip options, picking the best hotel within the budget left after the flight.
+        
+        :param candidates: list: (destination, flight, hotel index) tuples as returned by plan_trip_candidates
+        :param budget: float: Total budget for the trip
+        :return: list: Formatted trip options within budget, in the order of the candidates
+        """
+        trip_options = []
+        for destination, flight, hotel_index in candidates:
+            hotel = hotel_index.best_within(budget - flight.price)
+            if hotel:
+                trip_options.append((destination, flight, hotel, flight.price + hotel.price))
+        return self.show_trip_options(trip_options)
+
+    async def fetch_flexible_flight(self, destination, start_date, end_date, budget, origins=None, flexible_days=0):
+        """
+        Find the cheapest round trip to a destination from any of the origins on any dates within flexible_days.
+        
+        :param destination: Destination: Destination as suggested by the API client
+        :param start_date: str: Requested start date of the trip in YYYY-MM-DD format
+        :param end_date: str: Requested end date of the trip in YYYY-MM-DD format
+        :param budget: float: Maximum price of the flight
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction
+        :return: Flight: Best flight, with its origin and dates set, or None if none fits
+        """
+        arrival_code = self.client.resolve_iata_code(destination)
+        if not arrival_code:
+            raise Exception(f"Unknown airport code for the destination city: {destination}")
+
+        flight_table = await self.client.search_flight_combinations(
+            [arrival_code],
+            [origin.strip().upper() for origin in origins[:self.max_origins]] if origins else [DEFAULT_ORIGIN],
+            start_date,
+            end_date,
+            min(flexible_days, self.max_flexible_days)
+        )
+        best_rows = flight_table.rank(budget=budget, max_duration=self.max_flight_duration, max_stops=self.max_stops)
+        if arrival_code not in best_rows:
+            return None
+        return flight_table.flight(best_rows[arrival_code])
+
+    async def iter_priced_destinations(self, destinations, start_date, end_date, budget, origins=None, flexible_days=0, price=None):
+        """
+        Price all destinations concurrently and yield each one as soon as it is done. Flight searches for
+        every destination are sent at once and each destination that misses its timeout or the planning
+        deadline is dropped.
+        
+        :param destinations: list: Destination strings as suggested by the API client
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param budget: float: Total budget for the trip
+        :param origins: list: IATA codes of the airports the trip may start from, or None for the default origin
+        :param flexible_days: int: Number of days the dates may move in either direction to find cheaper flights
+        :param price: callable: Coroutine function pricing one destination, price_destination with the arguments above if not given
+        :return: async iterator: (position, destination, trip option or None, reason it was skipped or None) tuples
+        """
+        if price is None:
+            price = lambda destination: self.price_destination(destination, start_date, end_date, budget, origins, flexible_days)
+        tasks = {
+            asyncio.create_task(price(destination)): (position, destination)
+            for position, destination in enumerate(destinations)
+        }
+        # Every destination starts at the same time, so its own timeout, the global deadline
+        # and the time budget of the request all expire relative to this moment.
+        deadline = asyncio.get_running_loop().time() + remaining_time(min(self.destination_timeout, self.planning_deadline))
+        pending = set(tasks)
+        try:
+            while pending:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: tasks[task][0]):
+                    position, destination = tasks[task]
+                    try:
+                        yield position, destination, task.result(), None
+                    except Exception as e:
+                        yield position, destination, None, str(e)
+            for task in sorted(pending, key=lambda task: tasks[task][0]):
+                position, destination = tasks[task]
+                yield position, destination, None, "Timed out"
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def plan_routes(self, destinations, start_date, end_date, budget, cities, origin=DEFAULT_ORIGIN, limit=5):
+        """
+        Plan multi-city trips: price every one-way leg between the origin and the destinations, search the cheapest
+        ordered routes and night splits on those prices, then price the best routes exactly on their own dates.
+        
+        :param destinations: list: Destinations as suggested by the API client
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param budget: float: Total budget for the trip
+        :param cities: int: Number of cities to visit
+        :param origin: str: IATA code of the airport the trip starts from and returns to
+        :param limit: int: Maximum number of trip options returned
+        :return: tuple: (trip options sorted by total price, skipped destinations with the reason)
+        """
+        total_nights = (date.fromisoformat(end_date) - date.fromisoformat(start_date)).days
+        if total_nights < cities * self.min_nights_per_city:
+            raise ValueError(f"A trip to {cities} cities needs at least {cities * self.min_nights_per_city} nights.")
+
+        skipped = []
+        resolved = []
+        for destination in destinations:
+            code = self.client.resolve_iata_code(destination)
+            if code:
+                resolved.append((destination, code))
+            else:
+                skipped.append({"destination": str(destination), "reason": "Unknown airport code"})
+        if len(resolved) < cities:
+            raise ValueError(f"Not enough destinations with a known airport for a trip to {cities} cities.")
+        destinations = [destination for destination, _ in resolved]
+        codes = [code for _, code in resolved]
+
+        matrix = await self.price_route_matrix(destinations, codes, origin, start_date, end_date)
+        for position, destination in enumerate(destinations):
+            if matrix["hotels"][position] is None:
+                skipped.append({"destination": str(destination), "reason": "No hotel found"})
+        # A few more candidates than needed, since exact prices on the transfer dates may push some over budget
+        routes = self.search_routes(matrix, cities, total_nights, budget, limit + 2)
+
+        results = await asyncio.gather(
+            *(self.price_route(route, destinations, codes, start_date, budget, matrix) for route in routes),
+            return_exceptions=True
+        )
+        trip_options = []
+        for route, result in zip(routes, results):
+            if isinstance(result, Exception):
+                print(f"Skipped route {' -> '.join(codes[city] for city in route.stops)}: {result}")
+                continue
+            trip_options.append(result)
+        trip_options.sort(key=lambda trip_option: trip_option["total_price"])
+        return trip_options[:limit], skipped
+
+    @timed("price_route_matrix")
+    async def price_route_matrix(self, destinations, codes, origin, start_date, end_date):
+        """
+        Price every one-way leg between the origin and the destinations and the hotels of each destination,
+        concurrently and through the response cache. Flights between destinations are priced on the middle day
+        of the trip, as an estimate for the search.
+        
+        :param destinations: list: Destinations as suggested by the API client
+        :param codes: list: IATA codes of the destinations, in the same order
+        :param origin: str: IATA code of the origin airport
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :return: dict: outbound and inbound Flights per destination, legs[i][j] Flights between destinations,
+            and a HotelIndex of the whole stay per destination, with None where nothing was found
+        """
+        start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+        transfer_date = (start + timedelta(days=(end - start).days // 2)).isoformat()
+
+        async def lookup(coroutine, description):
+            try:
+                return await coroutine
+            except Exception as e:
+                print(f"Failed to price {description}: {e}")
+                return None
+
+        size = len(codes)
+        pairs = [(i, j) for i in range(size) for j in range(size) if i != j]
+        results = await asyncio.gather(
+            *(lookup(self.client.fetch_one_way_flight(origin, code, start_date), f"{origin} -> {code}") for code in codes),
+            *(lookup(self.client.fetch_one_way_flight(code, origin, end_date), f"{code} -> {origin}") for code in codes),
+            *(lookup(self.client.fetch_one_way_flight(codes[i], codes[j], transfer_date), f"{codes[i]} -> {codes[j]}") for i, j in pairs),
+            *(lookup(self.client.fetch_hotel_index(destination, start_date, end_date), f"hotels in {destination}") for destination in destinations)
+        )
+        legs = [[None] * size for _ in range(size)]
+        for (i, j), flight in zip(pairs, results[2 * size:2 * size + len(pairs)]):
+            legs[i][j] = flight
+        return {
+            "outbound": list(results[:size]),
+            "inbound": list(results[size:2 * size]),
+            "legs": legs,
+            "hotels": [hotels if hotels else None for hotels in results[2 * size + len(pairs):]],
+            "nights": (end - start).days
+        }
+
+    @timed("search_routes")
+    def search_routes(self, matrix, cities, total_nights, budget, limit):
+        """
+        Search the cheapest routes on the estimated prices of a route matrix. Hotels are estimated at the nightly
+        price of the cheapest hotel found for the whole stay.
+        
+        :param matrix: dict: Prices as returned by price_route_matrix
+        :param cities: int: Number of cities to visit
+        :param total_nights: int: Nights of the whole trip
+        :param budget: float: Maximum estimated price of a route
+        :param limit: int: Maximum number of routes
+        :return: list: Route objects sorted by estimated price
+        """
+        def price(flight):
+            return flight.price if flight and isinstance(flight.price, (int, float)) else None
+
+        search = RouteSearch(
+            outbound=[price(flight) for flight in matrix["outbound"]],
+            inbound=[price(flight) for flight in matrix["inbound"]],
+            legs=[[price(flight) for flight in row] for row in matrix["legs"]],
+            nightly=[hotels.prices[0] / matrix["nights"] if hotels else None for hotels in matrix["hotels"]]
+        )
+        return search.search(cities, total_nights, budget, limit, self.min_nights_per_city)
+
+    async def price_route(self, route, destinations, codes, start_date, budget, matrix):
+        """
+        Price a route exactly: flights between destinations on their transfer dates, and a hotel for every stay
+        within its share of the budget left after the flights, in proportion to its nights.
+        
+        :param route: Route: Route found by the search
+        :param destinations: list: Destinations as suggested by the API client
+        :param codes: list: IATA codes of the destinations, in the same order
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param budget: float: Total budget for the trip
+        :param matrix: dict: Prices as returned by price_route_matrix, whose flights from and to the origin are exact
+        :return: dict: Trip option
+        """
+        stays = []
+        check_in = date.fromisoformat(start_date)
+        for city, nights in zip(route.stops, route.nights):
+            check_out = check_in + timedelta(days=nights)
+            stays.append((city, check_in.isoformat(), check_out.isoformat(), nights))
+            check_in = check_out
+
+        transfers = await asyncio.gather(*(
+            self.client.fetch_one_way_flight(codes[previous[0]], codes[city], check_in)
+            for previous, (city, check_in, _, _) in zip(stays, stays[1:])
+        ))
+        flights = [matrix["outbound"][route.stops[0]], *transfers, matrix["inbound"][route.stops[-1]]]
+        if not all(flights):
+            raise Exception("No flight found for a leg of the route")
+
+        remaining_budget = budget - sum(flight.price for flight in flights)
+        total_nights = sum(route.nights)
+        hotels = await asyncio.gather(*(
+            self.client.fetch_hotel(destinations[city], check_in, check_out, remaining_budget * nights / total_nights)
+            for city, check_in, check_out, nights in stays
+        ))
+        if not all(hotels):
+            raise Exception("No hotel found within budget for a stay of the route")
+        return self.show_route_option(destinations, stays, flights, hotels)
+
+    def show_route_option(self, destinations, stays, flights, hotels):
+        """
+        Format a multi-city route as a trip option. flight and hotel hold one entry per flight and per stay.
+        
+        :param destinations: list: Destinations as suggested by the API client
+        :param stays: list: (destination index, check-in date, check-out date, nights) per stay, in visiting order
+        :param flights: list: Flights from the origin, between the stays, and back
+        :param hotels: list: Hotels of the stays, in the same order
+        :return: dict: Trip option
+        """
+        return {
+            "destination": " -> ".join(f"{destinations[city]} ({nights} nights)" for city, _, _, nights in stays),
+            "flight": flights,
+            "hotel": hotels,
+            "total_price": sum(flight.price for flight in flights) + sum(hotel.price for hotel in hotels),
+            "start_date": stays[0][1],
+            "end_date": stays[-1][2],
+            "stops": [
+                {"destination": str(destinations[city]), "check_in": check_in, "check_out": check_out, "nights": nights}
+                for city, check_in, check_out, nights in stays
+            ]
+        }
+
+    @timed("extract_activities")
     def extract_activities(self, daily_plan):
         """
-        Extract a list of activities from a daily plan.
+        Pick the activities of a daily plan to illustrate: the first activity of every day, then the second ones, up to four.
         
-        :param daily_plan: str: The daily plan as a single string
-        :return: list: List of formatted activities
+        :param daily_plan: DailyPlan: The daily plan
+        :return: list: Activity titles
         """
-        activities = daily_plan.split('\n')
-        formatted_activities = [activity.strip() for activity in activities if activity.strip()]
-        return formatted_activities[:4]
+        return daily_plan.image_activities(4)
 
     def show_trip_options(self, trip_options):
         """
-        Format trip options for display.
+        Format trip options for display, keeping every flight and hotel detail.
         
         :param trip_options: list: List of trip options (destination, flight, hotel, total price)
         :return: list: List of formatted trip options
         """
         trip_options_data = []
         for destination, flight, hotel, total_price in trip_options:
+            # Flight and Hotel are serialized as a whole by the orjson response class
             option = {
-                "destination": destination,
-                "flight": {"airline": flight.airline, "price": flight.price},
-                "hotel": {"name": hotel.name, "price": hotel.price},
+                "destination": str(destination),
+                "flight": flight,
+                "hotel": hotel,
                 "total_price": total_price
             }
+            if flight.outbound_date:
+                # The flexible search may move the trip to other dates
+                option["start_date"] = flight.outbound_date
+                option["end_date"] = flight.return_date
             trip_options_data.append(option)
         return trip_options_data
 
@@ -111,26 +578,28 @@ class TripPlanner:
         else:
             return None
 
-    def create_daily_plan(self, destination, vacation_type, start_date, end_date, month):
+    def daily_plan_request(self, destination, vacation_type, start_date, end_date, month):
         """
-        Create a daily plan for the trip using OpenAI API.
+        Build the OpenAI chat completion request for a daily plan.
         
         :param destination: str: Destination city
         :param vacation_type: str: Type of vacation
         :param start_date: str: Start date of the trip in YYYY-MM-DD format
         :param end_date: str: End date of the trip in YYYY-MM-DD format
         :param month: str: Month of the trip
-        :return: str: Generated daily plan
+        :return: tuple: (headers, data) of the request
         """
+        days = (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
         prompt = (f"Create a daily plan for a {vacation_type} vacation in {destination} from {start_date} to {end_date}. "
-                  f"Include activities and suggestions suitable for the month of {month}, make each day a plan.")
+                  f"Include activities and suggestions suitable for the month of {month}. Plan every day of the trip "
+                  f"with a short title and up to four activities of at most six words each.")
 
         headers = {
             'Authorization': f'Bearer {self.openai_api_key}',  
             'Content-Type': 'application/json'
         }
 
-        data = {
+        data = force_tool({
             "model": "gpt-3.5-turbo",
             "messages": [
                 {
@@ -139,54 +608,305 @@ class TripPlanner:
                 }
             ],
             "temperature": 0.7,
-            "max_tokens": 3000
+            "max_tokens": daily_plan_max_tokens(days)
+        }, DAILY_PLAN_TOOL)
+        return headers, data
+
+    @timed("create_daily_plan")
+    async def create_daily_plan(self, destination, vacation_type, start_date, end_date, month):
+        """
+        Create a daily plan for the trip using OpenAI API.
+        
+        :param destination: str: Destination city
+        :param vacation_type: str: Type of vacation
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param month: str: Month of the trip
+        :return: DailyPlan: Generated daily plan
+        """
+        headers, data = self.daily_plan_request(destination, vacation_type, start_date, end_date, month)
+        if self.content_cache is None:
+            return DailyPlan.from_dict(await self.request_daily_plan(headers, data))
+        return DailyPlan.from_dict(await self.content_cache.get_or_fetch(
+            "daily_plan", self.daily_plan_key(data), lambda: self.request_daily_plan(headers, data)
+        ))
+
+    @staticmethod
+    def daily_plan_key(data):
+        """
+        Get the parameters that identify a daily plan in the content cache: the prompt and the generation settings.
+        
+        :param data: dict: OpenAI chat completion request
+        :return: dict: Parameters of the cache key
+        """
+        return {
+            "model": data["model"],
+            "tool": data["tool_choice"]["function"]["name"],
+            "prompt": data["messages"][0]["content"],
+            "temperature": data["temperature"],
+            "max_tokens": data["max_tokens"]
         }
 
+    async def request_daily_plan(self, headers, data):
+        """
+        Send a daily plan request to the OpenAI API.
+        
+        :param headers: dict: Request headers
+        :param data: dict: OpenAI chat completion request
+        :return: dict: Validated function call arguments with the days of the plan, ready to be cached
+        """
         try:
-            response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
-            if response.ok:
-                daily_plan = response.json()['choices'][0]['message']['content']
-                return daily_plan
-            else:
+            response = await self.openai.post('/v1/chat/completions', headers=headers, json=data, timeout=self.request_timeout)
+            if not response.is_success:
                 raise Exception(f"Failed to create daily plan: {response.status_code} - {response.text}")
-        except requests.RequestException as e:
+            arguments = tool_arguments(orjson.loads(response.content))
+            DailyPlan.from_dict(arguments)
+            return arguments
+        except httpx.HTTPError as e:
             raise Exception(f"Failed to create daily plan from the OpenAI API: {e}")
+        except ValueError as e:
+            raise Exception(f"Invalid daily plan from the OpenAI API: {e}")
 
-    def create_images(self, activities):
+    async def stream_daily_plan(self, destination, vacation_type, start_date, end_date, month):
         """
-        Create images for activities using the OpenAI API.
+        Stream a daily plan for the trip from the OpenAI API, one day as soon as its object is complete.
+        A daily plan found in the content cache is sent at once.
         
-        :param activities: list: List of activities
-        :return: list: List of image URLs
+        :param destination: str: Destination city
+        :param vacation_type: str: Type of vacation
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param month: str: Month of the trip
+        :return: async iterator: DayPlan objects in order
+        """
+        headers, data = self.daily_plan_request(destination, vacation_type, start_date, end_date, month)
+        key = None
+        if self.content_cache is not None:
+            key = self.content_cache.make_key("daily_plan", self.daily_plan_key(data))
+            found, arguments = await self.content_cache.get(key)
+            if found:
+                for day in DailyPlan.from_dict(arguments).days:
+                    yield day
+                return
+        data["stream"] = True
+
+        # Timed as one stage from the request until the last token
+        pieces = []
+        days = 0
+        scanner = ArrayItemScanner()
+        with self.metrics.stage("create_daily_plan"):
+            try:
+                async with self.openai.stream('POST', '/v1/chat/completions', headers=headers, json=data, timeout=self.request_timeout) as response:
+                    if not response.is_success:
+                        body = await response.aread()
+                        raise Exception(f"Failed to create daily plan: {response.status_code} - {body.decode(errors='replace')}")
+                    async for line in response.aiter_lines():
+                        if not line.startswith('data:'):
+                            continue
+                        payload = line[len('data:'):].strip()
+                        if payload == '[DONE]':
+                            break
+                        delta = tool_arguments_delta(orjson.loads(payload))
+                        pieces.append(delta)
+                        for item in scanner.feed(delta):
+                            try:
+                                day = DayPlan.from_dict(item)
+                            except ValueError as e:
+                                print(f"Skipped invalid day of the daily plan: {e}")
+                                continue
+                            days += 1
+                            yield day
+            except httpx.HTTPError as e:
+                raise Exception(f"Failed to create daily plan from the OpenAI API: {e}")
+        if not days:
+            raise Exception("Invalid daily plan from the OpenAI API: no complete day")
+        if key is not None:
+            try:
+                arguments = orjson.loads("".join(pieces))
+                DailyPlan.from_dict(arguments)
+            except ValueError as e:
+                # Days sent so far stay valid, but a truncated or invalid plan is not cached
+                print(f"Invalid daily plan from the OpenAI API: {e}")
+            else:
+                await self.content_cache.set("daily_plan", key, arguments)
+
+    async def stream_trip_details(self, destination, vacation_type, start_date, end_date, month):
+        """
+        Stream the daily plan of a trip day by day and start generating the image of each day's first activity as soon
+        as the day is complete. For trips shorter than four days, the remaining images start once the plan is complete.
+        
+        :param destination: str: Destination city
+        :param vacation_type: str: Type of vacation
+        :param start_date: str: Start date of the trip in YYYY-MM-DD format
+        :param end_date: str: End date of the trip in YYYY-MM-DD format
+        :param month: str: Month of the trip
+        :return: async iterator: Event dictionaries for days, activities, images and the final result
+        """
+        events = asyncio.Queue()
+        image_tasks = []
+
+        async def create_image_event(position, activity):
+            # Every started image must answer with an event, or the stream below would wait for it forever
+            try:
+                image_url = await self.create_image(activity)
+            except Exception as e:
+                print(f"Failed to create image for activity {activity}: {e}")
+                image_url = None
+            await events.put({"event": "image", "position": position, "image_url": image_url})
+
+        def start_activity(activity):
+            position = len(image_tasks)
+            image_tasks.append(asyncio.create_task(create_image_event(position, activity)))
+            return {"event": "activity", "position": position, "activity": activity}
+
+        async def produce_plan():
+            try:
+                days = []
+                started = []
+                async for day in self.stream_daily_plan(destination, vacation_type, start_date, end_date, month):
+                    days.append(day)
+                    await events.put({"event": "day", "day": day})
+                    # The first activity of every day comes first in extract_activities
+                    if len(image_tasks) < 4 and day.activities[0] not in started:
+                        started.append(day.activities[0])
+                        await events.put(start_activity(day.activities[0]))
+                daily_plan = DailyPlan(days=tuple(days))
+                for activity in self.extract_activities(daily_plan):
+                    if activity not in started:
+                        started.append(activity)
+                        await events.put(start_activity(activity))
+                await events.put({"event": "plan_complete", "daily_plan": daily_plan})
+            except Exception as e:
+                await events.put({"event": "plan_failed", "error": e})
+
+        plan_task = asyncio.create_task(produce_plan())
+        daily_plan = None
+        plan_complete = False
+        image_urls = {}
+        try:
+            while not plan_complete or len(image_urls) < len(image_tasks):
+                event = await events.get()
+                if event["event"] == "plan_failed":
+                    raise event["error"]
+                if event["event"] == "plan_complete":
+                    daily_plan = event["daily_plan"]
+                    plan_complete = True
+                    continue
+                if event["event"] == "image":
+                    image_urls[event["position"]] = event["image_url"]
+                yield event
+            yield {"event": "done", "daily_plan": daily_plan, "image_urls": [image_urls[position] for position in range(len(image_tasks))]}
+        finally:
+            plan_task.cancel()
+            for task in image_tasks:
+                task.cancel()
+
+    @timed("create_image")
+    async def create_image(self, activity):
+        """
+        Create an image for a single activity. With a blob store, images are generated once per normalized prompt
+        and served from the local store afterwards.
+        
+        :param activity: str: Activity to illustrate
+        :return: str: Image URL or None if the generation failed or timed out
+        """
+        if self.blob_store is None or self.content_cache is None:
+            return await self.generate_image(activity)
+
+        params = {"prompt": activity, "size": IMAGE_SIZE}
+        try:
+            name = await self.content_cache.get_or_fetch("image", params, lambda: self.store_image(activity))
+            if name not in self.blob_store:
+                # The file was evicted from the blob store, so generate it again
+                await self.content_cache.invalidate(self.content_cache.make_key("image", params))
+                name = await self.content_cache.get_or_fetch("image", params, lambda: self.store_image(activity))
+        except Exception as e:
+            print(f"Failed to store image: {e}")
+            return None
+        return f"{self.image_base_url}/{name}"
+
+    async def generate_image(self, activity):
+        """
+        Generate an image for a single activity using the OpenAI API.
+        
+        :param activity: str: Activity to illustrate
+        :return: str: Temporary image URL or None if the generation failed or timed out
         """
         headers = {
             'Authorization': f'Bearer {self.openai_api_key}',  # Use the stored API key
             'Content-Type': 'application/json'
         }
 
-        image_urls = []
-        for activity in activities:
-            prompt = f"{activity}"
-            data = {
-                "prompt": prompt,
-                "n": 1,
-                "size": "1024x1024"
-            }
+        data = {
+            "prompt": f"{activity}",
+            "n": 1,
+            "size": IMAGE_SIZE
+        }
 
+        async with self.image_semaphore:
             try:
-                response = requests.post('https://api.openai.com/v1/images/generations', headers=headers, json=data)
-                if response.ok:
-                    images = response.json()['data']
-                    for img in images:
-                        image_urls.append(img['url'])
-                else:
-                    print(f"Failed to create image: {response.status_code} - {response.text}")
-            except requests.RequestException as e:
+                response = await asyncio.wait_for(
+                    self.openai.post('/v1/images/generations', headers=headers, json=data, timeout=self.image_timeout),
+                    remaining_time(self.image_timeout)
+                )
+                if response.is_success:
+                    return response.json()['data'][0]['url']
+                print(f"Failed to create image: {response.status_code} - {response.text}")
+            except asyncio.TimeoutError:
+                print(f"Timed out creating image for activity: {activity}")
+            except httpx.HTTPError as e:
                 print(f"API Error: {e}")
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Unexpected image response: {e}")
+        self.metrics.increment("trip_planner_stage_errors_total", stage="create_image")
+        return None
+
+    async def store_image(self, activity):
+        """
+        Generate an image and download it into the blob store before its temporary URL expires.
+        
+        :param activity: str: Activity to illustrate
+        :return: str: Name of the stored image
+        """
+        image_url = await self.generate_image(activity)
+        if not image_url:
+            raise Exception(f"Failed to create image for activity: {activity}")
+        url = httpx.URL(image_url)
+        client = self.pool.client(f"{url.scheme}://{url.netloc.decode()}")
+        response = await client.get(url, timeout=self.image_timeout)
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        return self.blob_store.put(response.content, IMAGE_EXTENSIONS.get(content_type, "png"))
+
+    @timed("create_images")
+    async def create_images(self, activities):
+        """
+        Create images for activities concurrently using the OpenAI API.
+        
+        :param activities: list: List of activities
+        :return: list: Image URLs in the order of the activities, with None where a generation failed
+        """
+        return list(await asyncio.gather(*(self.create_image(activity) for activity in activities)))
 
-        return image_urls
+    async def iter_images(self, activities):
+        """
+        Create images for activities concurrently and yield each one as soon as it is ready.
+        
+        :param activities: list: List of activities
+        :return: async iterator: (position, image URL or None) pairs in completion order
+        """
+        tasks = {asyncio.ensure_future(self.create_image(activity)): position for position, activity in enumerate(activities)}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield tasks[task], task.result()
+        finally:
+            for task in pending:
+                task.cancel()
 
-    def suggest_activities_images(self, activities):
+    async def suggest_activities_images(self, activities):
         """
         Suggest image prompts for activities using OpenAI API.
         
@@ -215,12 +935,12 @@ class TripPlanner:
         }
 
         try:
-            response = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=data)
-            if response.ok:
+            response = await self.openai.post('/v1/chat/completions', headers=headers, json=data, timeout=self.request_timeout)
+            if response.is_success:
                 suggestions = response.json()['choices'][0]['message']['content'].strip().split('\n')
                 return [suggestion.strip() for suggestion in suggestions if suggestion.strip()][:4]
             else:
                 raise Exception(f"Failed to fetch suggestions: {response.status_code} - {response.text}")
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             print("API Error:", str(e))
             raise Exception("Failed to fetch data from the OpenAI API.")
@@ -0,0 +1,528 @@
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from metrics import Metrics
+import asyncio
+import httpx
+import math
+import random
+import time
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Monotonic time by which the current request must be answered, or None when it has no time budget
+request_deadline = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def time_budget(seconds):
+    """
+    Give the current request a time budget. Upstream calls and planning stages started within it, also in tasks
+    created within it, get the time left as their deadline. A nested budget never extends the one around it.
+    
+    :param seconds: float: Time budget in seconds
+    """
+    deadline = time.monotonic() + seconds
+    outer = request_deadline.get()
+    request_deadline.set(deadline if outer is None else min(deadline, outer))
+    try:
+        yield
+    finally:
+        # Restored by value rather than with a token, since async generators may be closed from another task
+        request_deadline.set(outer)
+
+
+def remaining_time(limit=None):
+    """
+    Get the time left in the budget of the current request.
+    
+    :param limit: float: Time in seconds the caller allows itself, returned as is without a time budget
+    :return: float: Seconds left, at most limit, negative once the budget has run out, or None without budget and limit
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return limit
+    remaining = deadline - time.monotonic()
+    return remaining if limit is None else min(remaining, limit)
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """
+    Raised without calling the upstream while its circuit breaker is open.
+    """
+
+
+class DeadlineExceededError(httpx.TimeoutException):
+    """
+    Raised without calling the upstream once the time budget of the current request has run out.
+    """
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream API fails or gives an unusable answer, with the underlying error as its cause.
+    """
+
+
+class LatencyWindow:
+    """
+    A class to keep the latencies of the most recent requests to an upstream endpoint, so timeouts and hedges
+    follow its current percentiles rather than its whole history.
+    """
+
+    def __init__(self, size=200, min_samples=20):
+        """
+        Initialize the LatencyWindow empty.
+        
+        :param size: int: Number of recent latencies kept
+        :param min_samples: int: Latencies needed before percentiles are estimated
+        """
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def observe(self, value):
+        self.samples.append(value)
+
+    def quantile(self, q):
+        """
+        Get a quantile of the recent latencies.
+        
+        :param q: float: Quantile between 0 and 1
+        :return: float: Latency in seconds, or None with too few observations
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class TokenBucket:
+    """
+    A class to limit the rate of requests to an upstream, allowing short bursts.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Initialize the TokenBucket full.
+        
+        :param rate: float: Tokens added per second, i.e. the sustained requests per second
+        :param burst: int: Maximum number of tokens, i.e. the largest burst of requests
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it. Waiters are served in order.
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def try_acquire(self):
+        """
+        Take a token only if one is available right away and nobody is waiting for one.
+        
+        :return: bool: True if a token was taken
+        """
+        if self.lock.locked():
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """
+    A class to stop calling an upstream after repeated failures, and to try it again after a cool-down.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        Initialize the CircuitBreaker closed.
+        
+        :param failure_threshold: int: Consecutive failures that open the circuit
+        :param reset_timeout: float: Time in seconds the circuit stays open before one trial request is let through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """
+        Check whether a request may be sent. While half open, only a single trial request is allowed.
+        
+        :return: bool: True if the request may be sent
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class Upstream:
+    """
+    A class to send requests to one upstream provider through a shared rate limiter, retries with jittered
+    exponential backoff that respect Retry-After, and a circuit breaker. Each attempt gets a timeout from the
+    recent latencies of its endpoint, within the time budget of the current request, and idempotent requests
+    can be hedged with a second copy once they are slower than usual.
+    """
+
+    def __init__(self, name, base_url, pool, rate=10.0, burst=20, max_retries=3, backoff_base=0.5, backoff_max=20.0,
+                 failure_threshold=5, reset_timeout=30.0, metrics=None, timeout_multiplier=3.0, min_timeout=2.0,
+                 hedge_quantile=None, latency_window=200):
+        """
+        Initialize the Upstream.
+        
+        :param name: str: Name of the provider (e.g. openai, serpapi)
+        :param base_url: str: Base URL of the provider
+        :param pool: HTTPPool: Connection pool the requests are sent through
+        :param rate: float: Sustained requests per second
+        :param burst: int: Largest burst of requests
+        :param max_retries: int: Retries after the first attempt for 429, 5xx and transport errors
+        :param backoff_base: float: Backoff in seconds before the first retry, doubled for every further retry
+        :param backoff_max: float: Longest wait in seconds before a retry, including Retry-After
+        :param failure_threshold: int: Consecutive failures that open the circuit
+        :param reset_timeout: float: Time in seconds the circuit stays open
+        :param metrics: Metrics: Registry the request latencies, bytes and errors are recorded in
+        :param timeout_multiplier: float: Timeout of an attempt as a multiple of the recent p99 latency of its endpoint,
+            never over the timeout given with the request, or None to always use that timeout
+        :param min_timeout: float: Shortest adaptive timeout in seconds
+        :param hedge_quantile: float: Quantile of the recent latencies after which a hedged request sends a second copy,
+            or None to not hedge
+        :param latency_window: int: Number of recent latencies per endpoint the timeouts and hedges are based on
+        """
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool = pool
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self.metrics = metrics or Metrics()
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.hedge_quantile = hedge_quantile
+        self.latency_window = latency_window
+        self.latencies = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+
+    def backoff(self, attempt, response=None):
+        """
+        Compute the wait before a retry: the Retry-After header when the upstream sent one, otherwise full jitter.
+        
+        :param attempt: int: Number of the retry, starting at 0
+        :param response: httpx.Response: Response that caused the retry, if any
+        :return: float: Time to wait in seconds
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(delay, 0.0), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def timeout(self, window, limit):
+        """
+        Choose the timeout of an attempt from the recent latencies of its endpoint: a multiple of their p99,
+        within the timeout given with the request.
+        
+        :param window: LatencyWindow: Recent latencies of the endpoint
+        :param limit: float: Timeout in seconds given with the request
+        :return: float: Timeout in seconds
+        """
+        p99 = window.quantile(0.99) if self.timeout_multiplier else None
+        if p99 is None:
+            return limit
+        return min(limit, max(self.min_timeout, p99 * self.timeout_multiplier))
+
+    def deadline_error(self, message):
+        """
+        Count a request stopped by the time budget of the current request.
+        
+        :param message: str: Message of the error
+        :return: DeadlineExceededError: The error to raise
+        """
+        self.deadline_exceeded += 1
+        self.metrics.increment("upstream_errors_total", upstream=self.name, reason="deadline_exceeded")
+        return DeadlineExceededError(message)
+
+    def check_deadline(self, timeout):
+        if timeout <= 0:
+            raise self.deadline_error(f"The time budget ran out before calling {self.name}")
+
+    async def attempt(self, send, endpoint=None, limit=None, hedge=False):
+        """
+        Run send() with rate limiting, retries, the circuit breaker, adaptive timeouts and the time budget
+        of the current request.
+        
+        :param send: callable: Coroutine function that sends the request with a timeout in seconds and returns its response
+        :param endpoint: tuple: Key of the endpoint whose recent latencies set the timeouts and hedges
+        :param limit: float: Longest timeout in seconds of an attempt, the pool timeout if not given
+        :param hedge: bool: Send a second copy of a slow attempt, only for idempotent requests
+        :return: httpx.Response: The first response that is not retried, or the last one
+        """
+        window = self.latencies.get(endpoint)
+        if window is None:
+            window = self.latencies[endpoint] = LatencyWindow(self.latency_window)
+        limit = limit or self.pool.timeout.read
+        for attempt in range(self.max_retries + 1):
+            self.check_deadline(remaining_time(math.inf))
+            if not self.breaker.allow():
+                self.rejected += 1
+                self.metrics.increment("upstream_errors_total", upstream=self.name, reason="circuit_open")
+                raise CircuitOpenError(f"{self.name} is unavailable, circuit breaker is open")
+            wait = remaining_time()
+            if wait is None:
+                await self.bucket.acquire()
+            else:
+                try:
+                    await asyncio.wait_for(self.bucket.acquire(), max(wait, 0))
+                except asyncio.TimeoutError:
+                    raise self.deadline_error(f"The time budget ran out waiting for the rate limit of {self.name}") from None
+            adaptive = self.timeout(window, limit)
+            timeout = remaining_time(adaptive)
+            self.requests += 1
+            response = None
+            error = None
+            started = time.perf_counter()
+            try:
+                self.check_deadline(timeout)
+                if hedge and self.hedge_quantile is not None:
+                    # A winning second copy was sent later, so only its own latency is recorded
+                    response, started = await self.hedged(send, timeout, window)
+                else:
+                    response = await send(timeout)
+            except asyncio.CancelledError:
+                # Let the next request be the trial if this one was the trial and got cancelled
+                self.breaker.trial_running = False
+                raise
+            except DeadlineExceededError:
+                self.breaker.trial_running = False
+                raise
+            except httpx.TransportError as e:
+                timed_out = isinstance(e, httpx.TimeoutException)
+                if timed_out and timeout < adaptive:
+                    # Cut short by the time budget of the request, which is not a failure of the upstream
+                    self.breaker.trial_running = False
+                else:
+                    self.metrics.increment("upstream_errors_total", upstream=self.name, reason=type(e).__name__)
+                    self.breaker.record_failure()
+                    if timed_out:
+                        # A timed out attempt took at least its timeout, so timeouts grow back when the upstream slows down
+                        window.observe(timeout)
+                if timed_out and (timeout < adaptive or remaining_time(math.inf) <= 0):
+                    raise self.deadline_error(f"The time budget ran out while waiting for {self.name}") from e
+                if attempt == self.max_retries:
+                    raise
+                error = e
+            else:
+                elapsed = time.perf_counter() - started
+                self.record(response, elapsed)
+                if response.status_code < 400:
+                    window.observe(elapsed)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                # Too many requests means we are over quota, not that the provider is down
+                if response.status_code == 429:
+                    self.breaker.trial_running = False
+                else:
+                    self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    return response
+            delay = self.backoff(attempt, response)
+            if delay >= remaining_time(math.inf):
+                # The retry could not be answered within the time budget
+                if response is not None:
+                    return response
+                raise error
+            if response is not None:
+                await response.aclose()
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def hedged(self, send, timeout, window):
+        """
+        Send a request and, if it is still running after the hedge quantile of the recent latencies of its endpoint,
+        a second copy, answering with whichever succeeds first. A copy is only sent while the circuit is closed and
+        the rate limiter has a token to spare, so hedging never delays other requests.
+        
+        :param send: callable: Coroutine function that sends the request with a timeout in seconds
+        :param timeout: float: Timeout in seconds of the whole attempt
+        :param window: LatencyWindow: Recent latencies of the endpoint
+        :return: tuple: (the first successful response or the last failed one, time.perf_counter() when its copy was sent)
+        """
+        delay = window.quantile(self.hedge_quantile)
+        first = asyncio.ensure_future(send(timeout))
+        tasks = [first]
+        sent = {first: time.perf_counter()}
+        try:
+            if delay is None or delay >= timeout:
+                return await first, sent[first]
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.breaker.state == "closed" and self.bucket.try_acquire():
+                self.hedges += 1
+                self.requests += 1
+                second = asyncio.ensure_future(send(timeout - delay))
+                sent[second] = time.perf_counter()
+                tasks.append(second)
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code not in RETRY_STATUS_CODES:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result(), sent[task]
+                if not pending:
+                    return task.result(), sent[task]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def record(self, response, elapsed):
+        """
+        Record the latency, status and size of a response. Streamed bodies are counted when they are closed.
+        
+        :param response: httpx.Response: Response from the upstream
+        :param elapsed: float: Time in seconds until the response headers (and unstreamed body) arrived
+        """
+        self.metrics.observe("upstream_request_duration_seconds", elapsed, upstream=self.name, status=response.status_code)
+        self.metrics.increment("upstream_sent_bytes_total", int(response.request.headers.get('Content-Length', 0)), upstream=self.name)
+        self.metrics.increment("upstream_received_bytes_total", response.num_bytes_downloaded, upstream=self.name)
+        if response.status_code >= 400:
+            self.metrics.increment("upstream_errors_total", upstream=self.name, reason=str(response.status_code))
+
+    async def request(self, method, path, hedge=False, timeout=None, **kwargs):
+        """
+        Send a request to the upstream.
+        
+        :param method: str: HTTP method
+        :param path: str: Path relative to the base URL
+        :param hedge: bool: The request is idempotent and may be hedged
+        :param timeout: float: Longest timeout in seconds of an attempt, the pool timeout if not given
+        :param kwargs: dict: Arguments for httpx.AsyncClient.request (params, json, headers, ...)
+        :return: httpx.Response: The response
+        """
+        client = self.pool.client(self.base_url)
+        return await self.attempt(lambda attempt_timeout: client.request(method, path, timeout=attempt_timeout, **kwargs),
+                                  (method, path, "response"), timeout, hedge)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method, path, timeout=None, **kwargs):
+        """
+        Send a request and stream its response body. Retries only happen before the body is read.
+        
+        :param method: str: HTTP method
+        :param path: str: Path relative to the base URL
+        :param timeout: float: Longest timeout in seconds of an attempt, the pool timeout if not given
+        :param kwargs: dict: Arguments for httpx.AsyncClient.build_request (json, headers, ...)
+        :return: async context manager: The streaming httpx.Response
+        """
+        client = self.pool.client(self.base_url)
+        # Only the headers are awaited here, so streamed requests keep their own latencies
+        response = await self.attempt(
+            lambda attempt_timeout: client.send(client.build_request(method, path, timeout=attempt_timeout, **kwargs), stream=True),
+            (method, path, "headers"), timeout
+        )
+        try:
+            yield response
+        finally:
+            downloaded = response.num_bytes_downloaded
+            await response.aclose()
+            self.metrics.increment("upstream_received_bytes_total", downloaded, upstream=self.name)
+
+    def stats(self):
+        """
+        Get the upstream counters.
+        
+        :return: dict: Requests sent, retries, requests rejected by the open circuit, hedges sent and won,
+            requests stopped by the time budget, and the circuit state
+        """
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "circuit": self.breaker.state
+        }
+
+    def collect(self):
+        """
+        Read the counters and circuit state for the metrics endpoint.
+        
+        :return: list: (name, type, labels, value) tuples
+        """
+        labels = {"upstream": self.name}
+        return [
+            ("upstream_requests_total", "counter", labels, self.requests),
+            ("upstream_retries_total", "counter", labels, self.retries),
+            ("upstream_rejected_total", "counter", labels, self.rejected),
+            ("upstream_hedges_total", "counter", labels, self.hedges),
+            ("upstream_hedge_wins_total", "counter", labels, self.hedge_wins),
+            ("upstream_deadline_exceeded_total", "counter", labels, self.deadline_exceeded),
+            ("upstream_circuit_open", "gauge", labels, int(self.breaker.state != "closed"))
+        ] + [
+            ("upstream_latency_p99_seconds", "gauge", dict(labels, method=endpoint[0], path=endpoint[1], until=endpoint[2]),
+             window.quantile(0.99))
+            for endpoint, window in self.latencies.items() if endpoint and window.quantile(0.99) is not None
+        ]
@@ -0,0 +1,37 @@
+"""
+Fill the destination suggestion cache ahead of time.
+
+Run from the repository root, with the server's configuration in main.py:
+    python warm_cache.py
+    python warm_cache.py --vacation-types beach ski --months July August
+"""
+from main import WARMUP_VACATION_TYPES, suggestion_cache, trip_planner
+import argparse
+import asyncio
+import calendar
+import time
+
+
+async def warm(vacation_types, months):
+    started = time.perf_counter()
+    try:
+        result = await trip_planner.client.warm_suggestions(vacation_types, months)
+    finally:
+        await trip_planner.aclose()
+    print(f"Warmed {result['warmed']} suggestion lists in {time.perf_counter() - started:.1f}s")
+    for failure in result["failed"]:
+        print(f"Failed: {failure}")
+    print(suggestion_cache.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vacation-types", nargs="+", default=WARMUP_VACATION_TYPES, help="vacation types to warm up")
+    parser.add_argument("--months", nargs="+", default=list(calendar.month_name)[1:], help="month names to warm up")
+    args = parser.parse_args()
+    asyncio.run(warm(args.vacation_types, args.months))
+    suggestion_cache.close()
+
+
+if __name__ == "__main__":
+    main()